@@ -1,84 +1,429 @@
-from constraint import Problem, AllDifferentConstraint
-import pytholog as pl
+from collections import OrderedDict
+import threading
+import numpy as np
 import random
+import instrumentation
+import kb_index
+import menu_solver
+import recipe_store
 
-def solve_menu_csp(kb, user_data, preferred_taste, df):
-    problem = Problem()
+# --- CACHE DEI DOMINI PER PROFILO ---
+# I domini di colazione e pranzo/cena dipendono solo dalle tre intolleranze e dal
+# gusto preferito: rigenerando il menu per lo stesso utente si riusano già filtrati
+# (si rimescolano e si risolve di nuovo). La chiave include anche dataframe e indice,
+# che non vanno modificati sul posto finché sono in cache.
+# Dove il CSP accetta 'df' si può passare anche un recipe_store.RecipeStore: le
+# ricette del menu sono viste (recipe_store.Recipe) sull'archivio, non copie delle righe.
+class ProfileDomains:
+    def __init__(self, colazione, pranzo_cena, store, ultima_riga):
+        self.colazione = colazione
+        self.pranzo_cena = pranzo_cena
+        # Copie in array object per rimescolare senza ricopiare le liste
+        self._array = {'Colazione': np.array(colazione, dtype=object),
+                       'PranzoCena': np.array(pranzo_cena, dtype=object)}
+        self.store = store
+        # titolo -> ultima riga del dataframe con quel titolo
+        self.ultima_riga = ultima_riga
+        # titolo -> ingredienti (frozenset di id del vocabolario), per il punteggio di diversità
+        self.ingredienti_dict = {}
 
-    # --- HELPER PER INTERROGARE LA KB ---
-    def check_kb(query_str):
-        try:
-            res = kb.query(pl.Expr(query_str))
-            if res is None: return False
-            return res and res != 'No' and len(res) > 0
-        except Exception:
+    # Dominio rimescolato (nuova lista) per un pasto
+    def mescolato(self, pasto, rng):
+        valori = self._array['Colazione' if pasto == "Colazione" else 'PranzoCena']
+        return valori[rng.permutation(len(valori))].tolist()
+
+    def ingredienti(self, titoli):
+        for t in titoli:
+            if t not in self.ingredienti_dict:
+                self.ingredienti_dict[t] = self.store.ingredient_set(self.ultima_riga[t])
+        return self.ingredienti_dict
+
+    # titolo -> vista sulla riga dell'archivio (le stringhe si leggono solo in stampa)
+    def ricette(self, titoli):
+        return {t: self.store.recipe(self.ultima_riga[t]) for t in titoli}
+
+
+class DomainCache:
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Condivisa tra i thread di menu_service
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, df, index):
+        with self._lock:
+            entry = self._entries.get(key)
+            # Controllo di identità: un id() può essere riusato da un oggetto nuovo
+            if entry is None or entry[0] is not df or entry[1] is not index:
+                self.misses += 1
+                instrumentation.count('csp.domain_cache.miss')
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            instrumentation.count('csp.domain_cache.hit')
+            return entry[2]
+
+    # Archivio già costruito per 'df' da una voce in cache (None se nessuna):
+    # profili diversi sullo stesso dataframe non lo riconvertono
+    def store_for(self, df):
+        with self._lock:
+            for entry_df, _, domains in self._entries.values():
+                if entry_df is df:
+                    return domains.store
+        return None
+
+    def put(self, key, df, index, domains):
+        with self._lock:
+            self._entries[key] = (df, index, domains)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        richieste = self.hits + self.misses
+        return {'size': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits,
+                'misses': self.misses, 'hit_rate': self.hits / richieste if richieste else 0.0}
+
+
+DOMAIN_CACHE = DomainCache()
+
+
+# --- CACHE DEI PREDICATI PER RISOLUZIONE ---
+# Una per modello, condivisa da tutti i vincoli: per ogni combinazione di
+# predicati l'insieme dei titoli che ne soddisfa almeno uno (l'OR del vincolo
+# sportivo si calcola una volta, non con tre scansioni a chiamata) e, per ogni
+# dominio di pasto, il sottoinsieme dei suoi titoli che li supporta. LRU limitata.
+class PredicateCache:
+    def __init__(self, index, maxsize=64):
+        self.index = index
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _get(self, key, calcola):
+        valore = self._entries.get(key)
+        if valore is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return valore
+        self.misses += 1
+        valore = self._entries[key] = calcola()
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return valore
+
+    # Titoli che soddisfano almeno uno dei predicati
+    def titles(self, *predicates):
+        def unione():
+            insiemi = [self.index.title_set(p) for p in predicates]
+            return insiemi[0] if len(insiemi) == 1 else frozenset().union(*insiemi)
+        return self._get(('titles',) + predicates, unione)
+
+    # Titoli del dominio (chiave: nome del dominio di base) che soddisfano i predicati
+    def supports(self, predicates, nome, dominio):
+        return self._get(('supports', nome) + tuple(predicates),
+                         lambda: self.titles(*predicates).intersection(dominio))
+
+    def stats(self):
+        richieste = self.hits + self.misses
+        return {'size': len(self._entries), 'maxsize': self.maxsize, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': self.hits / richieste if richieste else 0.0}
+
+
+# Requisito "almeno un pasto della settimana soddisfa il predicato", come
+# callback di python-constraint registrato con assigned=False: riceve anche gli
+# assegnamenti parziali (Unassigned al posto delle variabili libere). Rifiuta
+# appena nessun pasto assegnato lo soddisfa e nessuna variabile libera ha nel
+# dominio un titolo che lo supporti: stesso esito del controllo ad assegnamento
+# completo (quei rami non hanno soluzioni), ma con la potatura anticipata.
+class RequirementConstraint:
+    def __init__(self, name, predicates, cache, domini):
+        self.__name__ = name
+        self.predicates = predicates
+        self.titoli = cache.titles(*predicates)
+        self._cache = cache
+        # (nome, dominio di base) per variabile, nell'ordine dello scope
+        self._domini = domini
+        self.supporto = [True] * len(domini)
+        self.unassigned = None
+        self.calls = 0
+        self.rejected = 0
+
+    # Prima della ricerca con python-constraint: una bandiera per variabile, vera se
+    # il suo dominio contiene titoli che soddisfano il requisito (solo qui: la
+    # propagazione di menu_solver non ne ha bisogno)
+    def bind(self, unassigned):
+        self.unassigned = unassigned
+        self.supporto = [bool(self._cache.supports(self.predicates, nome, dominio))
+                         for nome, dominio in self._domini]
+
+    def __call__(self, *pasti):
+        self.calls += 1
+        aperto = False
+        for p, supporto in zip(pasti, self.supporto):
+            if p is self.unassigned:
+                aperto = aperto or supporto
+            elif p in self.titoli:
+                return True
+        if aperto:
+            return True
+        self.rejected += 1
+        return False
+
+
+# Coppia pranzo/cena dello stesso giorno che non può avere due titoli
+# dell'insieme (fat_limit_constraint: non due pasti high_fat) o, con titoli
+# None, lo stesso titolo. Con il forward checking di python-constraint, a ogni
+# assegnamento il vincolo veniva chiamato per ogni valore dell'altro dominio e
+# i valori tolti uno per volta (list.remove: quadratico sui domini grandi);
+# _pair_constraint li nasconde in un solo passaggio, nello stesso ordine.
+class PairExclusionConstraint:
+    def __init__(self, name, titoli=None):
+        self.__name__ = name
+        self.titoli = titoli
+        self.calls = 0
+        self.rejected = 0
+
+    def __call__(self, a, b):
+        self.calls += 1
+        if a == b if self.titoli is None else (a in self.titoli and b in self.titoli):
+            self.rejected += 1
             return False
+        return True
+
+    # Valori da togliere al dominio dell'altra variabile quando questa vale 'valore'
+    def excluded(self, valore):
+        if self.titoli is None:
+            return (valore,)
+        return self.titoli if valore in self.titoli else None
+
+
+_PAIR_CLASS = None
+
+
+# FunctionConstraint di python-constraint (import solo se serve) per un PairExclusionConstraint
+def _pair_constraint(vincolo):
+    global _PAIR_CLASS
+    if _PAIR_CLASS is None:
+        from constraint import FunctionConstraint
 
+        class PairConstraint(FunctionConstraint):
+            # Chiamato con una sola delle due variabili assegnata: stesso stato del
+            # dominio (valori visibili e nascosti, in ordine) di Domain.hideValue per valore
+            def forwardCheck(self, variables, domains, assignments, _unassigned=None):
+                a, b = variables
+                libera, valore = (b, assignments[a]) if a in assignments else (a, assignments[b])
+                domain = domains[libera]
+                escludere = self._func.excluded(valore)
+                if escludere and domain:
+                    nascosti = [v for v in domain if v in escludere]
+                    if nascosti:
+                        domain[:] = [v for v in domain if v not in escludere]
+                        domain._hidden.extend(nascosti)
+                return bool(domain)
+        _PAIR_CLASS = PairConstraint
+    return _PAIR_CLASS(vincolo)
+
+
+def profile_key(user_data, preferred_taste, df, index):
+    intolleranze = user_data['intolleranze']
+    return (bool(intolleranze['lattosio']), bool(intolleranze['noci']), bool(intolleranze['glutine']),
+            preferred_taste, id(df), id(index))
+
+
+def build_profile_domains(user_data, preferred_taste, df, index, store=None):
     # --- RECUPERO DOMINI DALLA KB ---
-    tutte_le_ricette = df.to_dict('records')
-    
-    colazione_titles = []
-    pranzo_cena_titles = []
+    if store is None:
+        store = recipe_store.as_store(df)
+    titoli = store.row_titles()
+    gusti = store.column('primary_taste')
 
-    for res in tutte_le_ricette:
-        t = res['recipe_title']
-        taste = res['primary_taste']
-        
-        # --- FILTRI INTOLLERANZE ---
-        if user_data['intolleranze']['lattosio'] and not check_kb(f"is_dairy_free({t}, yes)"): continue
-        if user_data['intolleranze']['noci'] and not check_kb(f"nut_free({t}, yes)"): continue
-        if user_data['intolleranze']['glutine'] and not check_kb(f"no_gluten({t}, yes)"): continue
-
-        # --- SUDDIVISIONE PASTI ---
-        if taste in ['sweet', 'neutral']:
-            colazione_titles.append(t)
-        
-        # Pranzi e cene: includiamo il gusto preferito o tutto ciò che non è prettamente da colazione
-        if taste not in ['sweet', 'neutral'] or taste == preferred_taste:
-            pranzo_cena_titles.append(t)
+    # --- FILTRI INTOLLERANZE (maschere vettoriali sull'indice) ---
+    ammesse = np.ones(len(index), dtype=bool)
+    if user_data['intolleranze']['lattosio']: ammesse &= index.mask('is_dairy_free')
+    if user_data['intolleranze']['noci']: ammesse &= index.mask('nut_free')
+    if user_data['intolleranze']['glutine']: ammesse &= index.mask('no_gluten')
+
+    ids = index.ids_of(titoli)
+    righe_ammesse = (ids >= 0) & ammesse[np.maximum(ids, 0)]
+
+    # Per titoli duplicati vale l'ultima riga (come il vecchio dict costruito da
+    # to_dict('records')): è quella mostrata, usata per il punteggio e per la
+    # lista della spesa, quindi è anche l'unica che decide il pasto del titolo
+    ultima_riga = store.title_rows()
+    mostrate = np.zeros(len(titoli), dtype=bool)
+    righe = np.fromiter(ultima_riga.values(), dtype=np.int64, count=len(ultima_riga))
+    mostrate[righe[righe >= 0]] = True
+    righe_ammesse &= mostrate
+
+    # --- SUDDIVISIONE PASTI ---
+    da_colazione = np.isin(gusti, ['sweet', 'neutral'])
+    colazione_titles = titoli[righe_ammesse & da_colazione].tolist()
+
+    # Pranzi e cene: includiamo il gusto preferito o tutto ciò che non è prettamente da colazione
+    pranzo_cena_titles = titoli[righe_ammesse & (~da_colazione | (gusti == preferred_taste))].tolist()
+
+    return ProfileDomains(colazione_titles, pranzo_cena_titles, store, ultima_riga)
+
+
+GIORNI = ["Lun", "Mar", "Mer", "Gio", "Ven", "Sab", "Dom"]
+PASTI_TIPO = ["Colazione", "Pranzo", "Cena"]
+
+
+# --- MODELLO DEL MENU ---
+# Variabili, domini e vincoli del menu settimanale, sia come Problem di
+# python-constraint sia nella forma usata da menu_solver (gruppi AllDifferent,
+# coppie pranzo/cena, requisiti di conteggio).
+# I vincoli per python-constraint sono tenuti come (funzione, variabili), con
+# funzione None per AllDifferent: il Problem (e l'import della libreria) si
+# costruisce solo se lo chiede il solver 'backtracking'.
+class MenuModel:
+    def __init__(self, vincoli, variabili, domini, gruppi, coppie, high_fat, requisiti, domini_profilo,
+                 predicati=None):
+        self.vincoli = vincoli
+        self._problem = None
+        self.variabili = variabili
+        self.domini = domini
+        self.gruppi = gruppi
+        self.coppie = coppie
+        self.high_fat = high_fat
+        # (nome, titoli che lo soddisfano, variabili coinvolte)
+        self.requisiti = requisiti
+        self.domini_profilo = domini_profilo
+        # PredicateCache del modello
+        self.predicati = predicati
+
+    def solver_options(self):
+        return {'groups': self.gruppi, 'pairs': self.coppie, 'high_fat': self.high_fat,
+                'requirements': self.requisiti}
+
+    @property
+    def problem(self):
+        if self._problem is None:
+            from constraint import Problem, AllDifferentConstraint, FunctionConstraint, Unassigned
+            problem = Problem()
+            for var_name in self.variabili:
+                problem.addVariable(var_name, self.domini[var_name])
+            for funzione, scope in self.vincoli:
+                if funzione is None:
+                    funzione = AllDifferentConstraint()
+                elif isinstance(funzione, RequirementConstraint):
+                    funzione.bind(Unassigned)
+                    funzione = FunctionConstraint(funzione, assigned=False)
+                elif isinstance(funzione, PairExclusionConstraint):
+                    funzione = _pair_constraint(funzione)
+                problem.addConstraint(funzione, scope)
+            self._problem = problem
+        return self._problem
+
+    # Statistiche dei vincoli sui predicati (chiamate, rifiuti, sommati per nome)
+    # e della cache dei predicati
+    def constraint_stats(self):
+        vincoli = {}
+        for f, _ in self.vincoli:
+            if isinstance(f, (RequirementConstraint, PairExclusionConstraint)):
+                voce = vincoli.setdefault(f.__name__, {'calls': 0, 'rejected': 0})
+                voce['calls'] += f.calls
+                voce['rejected'] += f.rejected
+        return {'predicate_cache': self.predicati.stats() if self.predicati is not None else None,
+                'constraints': vincoli}
+
+
+# shuffle=False lascia i domini nell'ordine del dataframe (per l'ottimizzazione
+# l'ordine lo decide il punteggio); restituisce None se un dominio è vuoto.
+# seed: seme del rimescolamento (default: preso da 'random'); quiet=True non stampa
+# nulla (es. dai thread di menu_service, dove redirect_stdout non è utilizzabile)
+def build_menu_model(user_data, preferred_taste, df, index, cache=DOMAIN_CACHE, shuffle=True, seed=None,
+                     quiet=False):
+    vincoli = []
+
+    domini_profilo = None
+    if cache is not None:
+        key = profile_key(user_data, preferred_taste, df, index)
+        domini_profilo = cache.get(key, df, index)
+    if domini_profilo is None:
+        with instrumentation.stage('csp.profile_domains'):
+            store = cache.store_for(df) if cache is not None else None
+            domini_profilo = build_profile_domains(user_data, preferred_taste, df, index, store)
+        if cache is not None:
+            cache.put(key, df, index, domini_profilo)
+    colazione_titles = domini_profilo.colazione
+    pranzo_cena_titles = domini_profilo.pranzo_cena
 
     # --- DEFINIZIONE VARIABILI ---
-    giorni = ["Lun", "Mar", "Mer", "Gio", "Ven", "Sab", "Dom"]
-    pasti_tipo = ["Colazione", "Pranzo", "Cena"]
+    giorni = GIORNI
+    pasti_tipo = PASTI_TIPO
     variabili_create = []
+    domini = {}
+    # Permutazioni NumPy con seme preso da 'random': random.seed() rende ancora ripetibile il menu.
+    # Un seed esplicito non tocca lo stato globale (più richieste in parallelo su thread diversi)
+    rng = np.random.default_rng(random.getrandbits(64) if seed is None else seed)
 
     for g in giorni:
         for pt in pasti_tipo:
             var_name = f"{g}_{pt}"
-            domain = list(colazione_titles if pt == "Colazione" else pranzo_cena_titles)
-            
-            if not domain:
-                print(f"ERRORE: Dominio vuoto per {var_name}. Controlla i filtri sanitari o il dataset.")
+            if not (colazione_titles if pt == "Colazione" else pranzo_cena_titles):
+                if not quiet:
+                    print(f"ERRORE: Dominio vuoto per {var_name}. Controlla i filtri sanitari o il dataset.")
                 return None 
             
-            random.shuffle(domain) # Aggiunge varietà ad ogni generazione
-            problem.addVariable(var_name, domain)
+            if shuffle:
+                domain = domini_profilo.mescolato(pt, rng) # Aggiunge varietà ad ogni generazione
+            else:
+                domain = colazione_titles if pt == "Colazione" else pranzo_cena_titles
             variabili_create.append(var_name)
+            domini[var_name] = domain
 
     # --- VINCOLI ---
-    
+    # Lookup O(1) sui predicati derivati, dalla cache condivisa da tutti i vincoli
+    predicati = PredicateCache(index)
+    high_fat = predicati.titles('high_fat')
+    domini_base = {'Colazione': colazione_titles, 'PranzoCena': pranzo_cena_titles}
+
+    def requisito(nome, *nomi_predicati):
+        # Supporto per variabile dal dominio di base del suo pasto (i domini sono sue permutazioni)
+        basi = ['Colazione' if var.endswith('_Colazione') else 'PranzoCena' for var in pasti_principali_effettivi]
+        vincolo = RequirementConstraint(nome, nomi_predicati, predicati, [(b, domini_base[b]) for b in basi])
+        vincoli.append((vincolo, pasti_principali_effettivi))
+        requisiti.append((nome, vincolo.titoli))
+
     # Varietà settimanale: non mangiare la stessa cosa a pranzo (o cena) in giorni diversi
     vars_pranzo = [f"{g}_Pranzo" for g in giorni if f"{g}_Pranzo" in variabili_create]
     vars_cena = [f"{g}_Cena" for g in giorni if f"{g}_Cena" in variabili_create]
     
     if len(vars_pranzo) > 1:
-        problem.addConstraint(AllDifferentConstraint(), vars_pranzo)
+        vincoli.append((None, vars_pranzo))
     if len(vars_cena) > 1:
-        problem.addConstraint(AllDifferentConstraint(), vars_cena)
+        vincoli.append((None, vars_cena))
 
+    coppie = []
+    requisiti = []
     for g in giorni:
         p_var = f"{g}_Pranzo"
         c_var = f"{g}_Cena"
         
         if p_var in variabili_create and c_var in variabili_create:
             # Pranzo diverso da Cena nello stesso giorno
-            problem.addConstraint(lambda p, c: p != c, (p_var, c_var))
+            vincoli.append((PairExclusionConstraint('pranzo_diverso_da_cena'), (p_var, c_var)))
 
             # Vincolo Grassi: Non due pasti "High Fat" nello stesso giorno
-            def fat_limit_constraint(p, c):
-                return not (check_kb(f"high_fat({p})") and check_kb(f"high_fat({c})"))
-            
-            problem.addConstraint(fat_limit_constraint, (p_var, c_var))
+            vincoli.append((PairExclusionConstraint('fat_limit_constraint', high_fat), (p_var, c_var)))
+            coppie.append((p_var, c_var))
 
 
     pasti_principali = [f"{g}_{pt}" for g in giorni for pt in ["Pranzo", "Cena"]]
@@ -86,47 +431,176 @@ def solve_menu_csp(kb, user_data, preferred_taste, df):
     
     if pasti_principali_effettivi:
         # Almeno un piatto Mediterraneo a settimana
-        def general_mediterranean_constraint(*pasti):
-            return any(check_kb(f"is_mediterranean({p})") for p in pasti)
-        problem.addConstraint(general_mediterranean_constraint, pasti_principali_effettivi)
+        requisito('general_mediterranean_constraint', 'is_mediterranean')
 
-        # Vincoli Sportivi (Recupero o Performance)
+        # Vincoli Sportivi (Recupero o Performance): basta uno dei tre
         if user_data.get('sport'):
-            def sport_requirements_constraint(*pasti):
-                has_recovery = any(check_kb(f"is_muscle_recovery({p})") for p in pasti)
-                has_peak = any(check_kb(f"is_peak_performance({p})") for p in pasti)
-                has_athlete = any(check_kb(f"is_athlete_diet({p})") for p in pasti)
-                return has_recovery or has_peak or has_athlete
-            problem.addConstraint(sport_requirements_constraint, pasti_principali_effettivi)
+            requisito('sport_requirements_constraint',
+                      'is_muscle_recovery', 'is_peak_performance', 'is_athlete_diet')
 
         # BMI Basso (Weight Gainer)
         if user_data.get('bmi', 20) < 18.5:
-            def weight_gainer_constraint(*pasti):
-                return any(check_kb(f"is_weight_gainer({p})") for p in pasti)
-            problem.addConstraint(weight_gainer_constraint, pasti_principali_effettivi)
+            requisito('weight_gainer_constraint', 'is_weight_gainer')
         
         # Super Veggie (Solo se l'utente è vegetariano)
         if user_data.get('is_vegetarian'):
-            def super_veggie_constraint(*pasti):
-                return any(check_kb(f"is_super_veggie({p})") for p in pasti)
-            problem.addConstraint(super_veggie_constraint, pasti_principali_effettivi)
+            requisito('super_veggie_constraint', 'is_super_veggie')
+
+    instrumentation.count('csp.predicate_cache.hit', predicati.hits)
+    instrumentation.count('csp.predicate_cache.miss', predicati.misses)
+    gruppi = [g for g in (vars_pranzo, vars_cena) if len(g) > 1]
+    return MenuModel(vincoli, variabili_create, domini, gruppi, coppie, high_fat,
+                     [(nome, valori, pasti_principali_effettivi) for nome, valori in requisiti],
+                     domini_profilo, predicati)
+
+
+# L'indice dei predicati (kb_index.PredicateIndex) sostituisce le query Prolog:
+# se non viene passato lo si costruisce dal dataframe, ma conviene crearlo una
+# volta sola per KB e riusarlo tra le generazioni. Con l'indice, kb può essere None.
+# solver='propagation' usa menu_solver (forward checking + vincoli di conteggio,
+# con timeout in secondi); solver='backtracking' il getSolution() di python-constraint.
+# cache: DomainCache per i domini filtrati del profilo (None per ricalcolarli sempre).
+# should_stop: interruzione dall'esterno (solo con 'propagation'), es. threading.Event.is_set
+def solve_menu_csp(kb, user_data, preferred_taste, df, index=None,
+                   solver='propagation', timeout=5.0, best_effort=False, cache=DOMAIN_CACHE,
+                   seed=None, should_stop=None):
+    if index is None:
+        index = kb_index.build_predicate_index(df)
+
+    with instrumentation.stage('csp.build_model'):
+        modello = build_menu_model(user_data, preferred_taste, df, index, cache, seed=seed)
+    if modello is None:
+        return None
 
     # --- RISOLUZIONE ---
-    soluzione = problem.getSolution()
+    if solver == 'propagation':
+        # Stesso modello, risolto con propagazione: i requisiti "almeno uno a
+        # settimana" diventano vincoli di conteggio sui pasti principali
+        with instrumentation.stage('csp.solver_init'):
+            risolutore = menu_solver.MenuSolver(modello.variabili, modello.domini, **modello.solver_options())
+        with instrumentation.stage('csp.search'):
+            soluzione, stats = risolutore.solve(timeout=timeout, best_effort=best_effort, should_stop=should_stop)
+        instrumentation.record_search('propagation', stats)
+        if stats.status == menu_solver.CANCELLED:
+            print(" ! Ricerca del menu interrotta.")
+            return None
+        if stats.status == menu_solver.TIMEOUT:
+            print(f" :( Tempo scaduto ({timeout}s) durante la ricerca del menu.")
+        elif stats.status == menu_solver.BEST_EFFORT:
+            print(f" ! Tempo scaduto: menu parziale, vincoli non soddisfatti: {', '.join(stats.unmet) or 'nessuno'}")
+    elif solver == 'backtracking':
+        with instrumentation.stage('csp.search'):
+            soluzione = modello.problem.getSolution()
+        if instrumentation.enabled():
+            stats = modello.constraint_stats()
+            for nome, n in stats['constraints'].items():
+                instrumentation.count(f"constraint.{nome}.calls", n['calls'])
+                instrumentation.count(f"constraint.{nome}.rejected", n['rejected'])
+    else:
+        raise ValueError(f"Solver sconosciuto: {solver}")
     
     if not soluzione:
         print(" :( Nessun menu trovato. Prova a ridurre i piatti preferiti o cambiare i dati.")
         return None
 
-    # Formattazione output
-    ricette_dict = {row['recipe_title']: row for row in tutte_le_ricette}
+    return menu_da_soluzione(soluzione, modello.domini_profilo)
+
+
+# Formattazione output: giorno -> pasto -> record della ricetta
+def menu_da_soluzione(soluzione, domini_profilo):
+    ricette_dict = domini_profilo.ricette(soluzione.values())
     
     menu_finale = {}
-    for g in giorni:
+    for g in GIORNI:
         menu_finale[g] = {}
-        for pt in pasti_tipo:
+        for pt in PASTI_TIPO:
             titolo_scelto = soluzione[f"{g}_{pt}"]
-            # Recuperiamo l'oggetto ricetta completo dal nostro lookup
+            # Vista sulla ricetta nell'archivio (si usa come il vecchio record)
             menu_finale[g][pt] = ricette_dict[titolo_scelto]
             
-    return menu_finale
\ No newline at end of file
+    return menu_finale
+
+
+# Testo di un giorno del menu (pasti: pasto -> ricetta, dict o recipe_store.Recipe):
+# usato da Main.stampa_menu_completo e dai client di menu_service, un blocco per giorno
+def format_day(giorno, pasti):
+    righe = [f"\n{giorno.upper()}:"]
+    for pasto in PASTI_TIPO:
+        ricetta = pasti[pasto]
+        titolo = ricetta['recipe_title'].replace('_', ' ').title()
+        righe.append(f"  {pasto:10}: {titolo} [{ricetta['primary_taste']}]")
+
+    righe.append(f"\n  --- LISTA INGREDIENTI {giorno.upper()} ---")
+    for pasto in PASTI_TIPO:
+        r = pasti[pasto]
+        titolo = r['recipe_title'].replace('_', ' ').title()
+        # Mostra gli ingredienti separati da virgola per leggibilità
+        ingredienti_raw = r['ingredients_raw'].replace('_', ', ')
+        righe.append(f"  * Per {titolo}:")
+        righe.append(f"    {ingredienti_raw}")
+
+    righe.append("-" * 40)
+    return "\n".join(righe) + "\n"
+
+
+# --- MENU ORDINATI PER PUNTEGGIO ---
+# Punteggio di una ricetta: probabilità del gusto preferito (taste_proba, una per
+# riga del dataframe, es. Main.score_catalogue; senza, 1 se primary_taste coincide),
+# meno tempo di preparazione (in ore) e difficoltà, meno 'repeat' per ogni volta che
+# la ricetta è già stata proposta (served). 'diversity' premia ogni ingrediente
+# nuovo nella settimana.
+PESI_DEFAULT = {'taste': 3.0, 'diversity': 0.1, 'prep_time': 0.5, 'difficulty': 0.25, 'repeat': 1.0}
+DIFFICOLTA = {'easy': 0.0, 'medium': 1.0, 'hard': 2.0}
+
+
+def recipe_scores(df, preferred_taste, titoli, ultima_riga, taste_proba=None, pesi=None, served=None):
+    pesi = {**PESI_DEFAULT, **(pesi or {})}
+    store = recipe_store.as_store(df)
+    righe = np.fromiter((ultima_riga[t] for t in titoli), dtype=np.int64, count=len(titoli))
+    if taste_proba is None:
+        gusto = (store.column('primary_taste', righe) == preferred_taste).astype(float)
+    else:
+        gusto = np.asarray(taste_proba, dtype=float)[righe]
+    tempo = np.asarray(store.column('est_prep_time_min', righe), dtype=float)
+    if np.isnan(tempo).any():
+        tempo = np.where(np.isnan(tempo), np.nanmedian(tempo) if not np.isnan(tempo).all() else 0.0, tempo)
+    difficolta = np.array([DIFFICOLTA.get(d, 1.0) for d in store.column('difficulty', righe).tolist()])
+    punteggio = pesi['taste'] * gusto - pesi['prep_time'] * tempo / 60.0 - pesi['difficulty'] * difficolta
+    if served:
+        punteggio -= pesi['repeat'] * np.array([served.get(t, 0) for t in titoli], dtype=float)
+    return dict(zip(titoli, punteggio.tolist()))
+
+
+# I k menu migliori (distinti) in una sola ricerca: lista di (punteggio, menu_finale)
+# in ordine decrescente. Le rigenerazioni si servono da questa lista; per averne
+# di nuovi si passa in served il conteggio delle ricette già proposte.
+def solve_menu_topk(kb, user_data, preferred_taste, df, index=None, k=5, taste_proba=None,
+                    weights=None, served=None, timeout=5.0, beam_width=None, min_diff=7,
+                    cache=DOMAIN_CACHE):
+    if index is None:
+        index = kb_index.build_predicate_index(df)
+
+    with instrumentation.stage('csp.build_model'):
+        modello = build_menu_model(user_data, preferred_taste, df, index, cache, shuffle=False)
+    if modello is None:
+        return []
+
+    profilo = modello.domini_profilo
+    titoli = list(dict.fromkeys(profilo.colazione + profilo.pranzo_cena))
+    pesi = {**PESI_DEFAULT, **(weights or {})}
+    with instrumentation.stage('csp.scores'):
+        unary = recipe_scores(profilo.store, preferred_taste, titoli, profilo.ultima_riga, taste_proba, pesi, served)
+        items = profilo.ingredienti(titoli) if pesi['diversity'] else None
+
+    with instrumentation.stage('csp.solver_init'):
+        ottimizzatore = menu_solver.MenuOptimizer(modello.variabili, modello.domini, unary, items,
+                                                  diversity=pesi['diversity'], **modello.solver_options())
+    with instrumentation.stage('csp.search_topk'):
+        risultati, stats = ottimizzatore.top_k(k, beam_width=beam_width, min_diff=min_diff, timeout=timeout)
+    instrumentation.record_search('topk', stats)
+    if stats.status == menu_solver.TIMEOUT:
+        print(f" :( Tempo scaduto ({timeout}s) durante la ricerca del menu.")
+    if not risultati:
+        print(" :( Nessun menu trovato. Prova a ridurre i piatti preferiti o cambiare i dati.")
+        return []
+    return [(punteggio, menu_da_soluzione(soluzione, profilo)) for punteggio, soluzione in risultati]
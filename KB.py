@@ -1,87 +1,94 @@
-import pytholog as pl
-import pandas as pd
-import re
+import datalog
+import numpy as np
 import pickle
+import instrumentation
 import os
+from recipe_store import RecipeStore, TITLE_COLUMN, TOKEN_COLUMN, merge_uniques
+
+# pandas, pytholog e cleaning (che importa pandas) si importano solo nelle
+# funzioni che li usano: leggere le regole o caricare le tabelle dei fatti da
+# uno snapshot non richiede lo stack CSV
 
 # --- Funzione pulizia dati + sintassi Prolog ---
+# Versione per singola cella; per colonne intere si usa cleaning.PROLOG_CLEANER.clean_series
 def clean_pl(text):
-    if pd.isna(text): 
-        return ""
-    # Rimuove caratteri speciali che rompono la sintassi Prolog
-    text = re.sub(r'[\[\]"\'\(\),]', '', text)
-    # Rimuove pesi e misure
-    text = re.sub(r'\d+/\d+|\d+\s*(pound|cup|tablespoon|teaspoon|ounce|g|ml|lb|oz)s?', '', text, flags=re.IGNORECASE)
-    text = re.sub(r'\b\d+\b', '', text)
-    # Sostituisce spazi con underscore per nomi atomici Prolog
-    text = text.strip().replace(" ", "_")
-    return text.lower()
+    import cleaning
+    return cleaning.PROLOG_CLEANER.clean(text)
 
 # --- Costruzione dataframe ridotto ---
-def build_dataframe(limit=30000):
+# chunksize: legge il CSV a blocchi tenendo solo le righe del campione
+# (stesso campione di df.sample(n=limit, random_state=42) sul file intero)
+def build_dataframe(limit=30000, path="recipes_extended.csv", chunksize=None):
+    import pandas as pd
+    import cleaning
     try:
-        df = pd.read_csv("recipes_extended.csv")
+        if chunksize:
+            df = cleaning.read_csv_sampled(path, limit, random_state=42, chunksize=chunksize)
+        else:
+            df = pd.read_csv(path)
     except FileNotFoundError:
-        print("Errore: File 'recipes_extended.csv' non trovato.")
+        print(f"Errore: File '{path}' non trovato.")
         return None
-    
+
+    # CAMPIONAMENTO (prima della pulizia: si ripuliscono solo le righe estratte)
+    if len(df) > limit:
+        df = df.sample(n=limit, random_state=42)
+    return prepare_dataframe(df)
+
+# Pulizia delle righe grezze del CSV (anche per le ricette aggiunte con add_recipes)
+def prepare_dataframe(df):
+    import cleaning
+    df = df.reset_index(drop=True)
+
     df['ingredients_raw'] = df['ingredients']
     
     # Pulizia iniziale nomi e categorie
     cols_to_clean = ['recipe_title', 'cuisine_list', 'difficulty', 'primary_taste', 'ingredients']
     for col in cols_to_clean:
-        df[col] = df[col].apply(clean_pl)
+        df[col] = cleaning.PROLOG_CLEANER.clean_series(df[col])
     
     # Conversione booleani
     bool_cols = ['is_vegetarian', 'is_dairy_free', 'is_gluten_free', 'is_nut_free']
     for col in bool_cols:
-        df[col] = df[col].apply(lambda x: 'yes' if x == 1 or x is True else 'no')
-
-    # CAMPIONAMENTO
-    if len(df) > limit:
-        df = df.sample(n=limit, random_state=42).reset_index(drop=True)
+        df[col] = np.where(df[col].to_numpy(dtype=object) == 1, 'yes', 'no')
 
     return df[['recipe_title', 'cuisine_list', 'difficulty', 'est_prep_time_min',
                'primary_taste', 'is_vegetarian', 'is_dairy_free',
                'is_gluten_free', 'is_nut_free', 'ingredients','ingredients_raw']]
 
-# --- KNOWLEDGE BASE ---
-def populate_kb(dataframe):
-    recipe_kb = pl.KnowledgeBase('Ricette_Logiche_KB')
-    kb = []
+# --- CONOSCENZA DEL DOMINIO ---
+# Colonne del dataframe da cui derivano i fatti di base di ogni ricetta
+FACT_COLUMNS = {
+    'is_dairy_free': 'is_dairy_free',
+    'taste': 'primary_taste',
+    'is_veg': 'is_vegetarian',
+    'no_gluten': 'is_gluten_free',
+    'nut_free': 'is_nut_free',
+}
 
-    # --- FATTI ---
-    for _, row in dataframe.iterrows():
-        title = row['recipe_title']
-        kb.append(f"is_dairy_free({title},{row['is_dairy_free']})")
-        kb.append(f"taste({title},{row['primary_taste']})")
-        kb.append(f"is_veg({title},{row['is_vegetarian']})")
-        kb.append(f"no_gluten({title},{row['is_gluten_free']})")
-        kb.append(f"nut_free({title},{row['is_nut_free']})")
-
-        ing_list = row['ingredients'].split('_')
-        for ing in ing_list:
-            if len(ing) > 2:
-                kb.append(f"contains({title},{ing})")
-
-    # --- CONOSCENZA DEL DOMINIO ---
-    taxonomy = {
-        'is_protein_source': ['meat', 'beef', 'chicken', 'egg', 'fish', 'tofu', 'tempeh'],
-        'is_fat_source': ['oil', 'butter', 'avocado', 'lard', 'bacon', 'cheese', 'walnut'],
-        'is_fiber_source': ['lentils', 'beans', 'broccoli', 'oats', 'apple'],
-        'is_carb_source': ['rice', 'pasta', 'potato', 'bread', 'quinoa', 'flour'],
-        'is_vegetable_source': ['spinach', 'carrot', 'broccoli', 'tomato', 'zucchini', 'kale', 'pepper'],
-        'is_fish_source': ['salmon', 'tuna', 'cod', 'shrimp', 'mackerel', 'sardines'],
-        'is_high_calorie': ['peanut_butter', 'pasta', 'rice', 'olive_oil', 'honey', 'walnuts', 'beef', 'whole_milk']
-    }
-    
+TAXONOMY = {
+    'is_protein_source': ['meat', 'beef', 'chicken', 'egg', 'fish', 'tofu', 'tempeh'],
+    'is_fat_source': ['oil', 'butter', 'avocado', 'lard', 'bacon', 'cheese', 'walnut'],
+    'is_fiber_source': ['lentils', 'beans', 'broccoli', 'oats', 'apple'],
+    'is_carb_source': ['rice', 'pasta', 'potato', 'bread', 'quinoa', 'flour'],
+    'is_vegetable_source': ['spinach', 'carrot', 'broccoli', 'tomato', 'zucchini', 'kale', 'pepper'],
+    'is_fish_source': ['salmon', 'tuna', 'cod', 'shrimp', 'mackerel', 'sardines'],
+    'is_high_calorie': ['peanut_butter', 'pasta', 'rice', 'olive_oil', 'honey', 'walnuts', 'beef', 'whole_milk']
+}
+
+# Fonti di Potassio ed Elettroliti
+ELECTROLYTE_SOURCES = ['banana', 'spinach', 'potato', 'coconut_water', 'yogurt', 'avocado', 'salmon']
+
+# Tassonomia + regole, comuni a tutte le ricette (indipendenti dal dataframe)
+def domain_knowledge():
+    kb = []
     kb.append("high_fat(R) :- has_fat(R)")
-    for category, items in taxonomy.items():
+    for category, items in TAXONOMY.items():
         for item in items:
             kb.append(f"{category}({item})")
 
     # Fonti di Potassio ed Elettroliti
-    for item in ['banana', 'spinach', 'potato', 'coconut_water', 'yogurt', 'avocado', 'salmon']: 
+    for item in ELECTROLYTE_SOURCES:
         kb.append(f"is_electrolyte_source({item})")
         kb.append(f"is_potassium_source({item})")
 
@@ -110,13 +117,178 @@ def populate_kb(dataframe):
     kb.append("is_athlete_diet(R) :- has_protein(R), has_carb(R), has_fiber(R)")
     kb.append("is_keto_style(R) :- has_protein(R), has_fat(R)")
     kb.append("is_super_veggie(R) :- is_veg(R, yes), has_fiber(R), has_veggies(R)")
+    return kb
+
+# --- KNOWLEDGE BASE ---
+# engine='pytholog' risolve le query top-down ad ogni chiamata,
+# engine='datalog' materializza tutte le relazioni derivate una volta sola
+def new_knowledge_base(engine='pytholog'):
+    if engine == 'datalog':
+        return datalog.KnowledgeBase('Ricette_Logiche_KB')
+    if engine == 'pytholog':
+        import pytholog as pl
+        return pl.KnowledgeBase('Ricette_Logiche_KB')
+    raise ValueError(f"Motore KB sconosciuto: {engine}")
+
+# --- TABELLE DEI FATTI (PER COLONNE) ---
+# I fatti di base sono tenuti in array interi invece che come lista di stringhe:
+#   - titoli internati: title_codes[riga] -> indice in titles
+#   - per ogni predicato di FACT_COLUMNS: codici del valore + tabella dei valori
+#   - contains: coppie (riga, ingrediente) con ingredienti internati in vocabulary,
+#     nell'ordine originale (riga per riga, token per token)
+# Il testo Prolog viene generato solo quando serve (iter_facts).
+class FactTables:
+    def __init__(self, titles, title_codes, values, contains_rows, contains_ings, vocabulary):
+        self.titles = titles
+        self.title_codes = title_codes
+        # predicato -> (codici per riga, valori distinti)
+        self.values = values
+        self.contains_rows = contains_rows
+        self.contains_ings = contains_ings
+        self.vocabulary = vocabulary
+
+    # Stato serializzabile (solo dict e array NumPy): il pickle non dipende dal
+    # modulo in cui è definita la classe, che sotto "python KB.py" è __main__
+    def to_state(self):
+        return {'titles': self.titles, 'title_codes': self.title_codes, 'values': dict(self.values),
+                'contains_rows': self.contains_rows, 'contains_ings': self.contains_ings,
+                'vocabulary': self.vocabulary}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(state['titles'], state['title_codes'], dict(state['values']),
+                   state['contains_rows'], state['contains_ings'], state['vocabulary'])
+
+    @property
+    def n_rows(self):
+        return len(self.title_codes)
+
+    def __len__(self):
+        return self.n_rows * len(self.values) + len(self.contains_rows)
+
+    # Titolo di ogni riga del dataframe
+    def row_titles(self):
+        return self.titles[self.title_codes]
+
+    # Righe (maschera booleana) dei titoli indicati
+    def rows_of(self, titles):
+        import pandas as pd
+        codici = pd.Index(self.titles).get_indexer(list(titles))
+        return np.isin(self.title_codes, codici[codici >= 0])
+
+    # Nuova tabella con le sole righe in 'keep'; i titoli non più usati escono
+    # dalla tabella dei titoli (l'ordine di prima apparizione resta lo stesso)
+    def _take(self, keep):
+        nuova_riga = np.cumsum(keep) - 1
+        tenuti = keep[self.contains_rows]
+        usati = np.zeros(len(self.titles), dtype=bool)
+        usati[self.title_codes[keep]] = True
+        nuovo_codice = np.cumsum(usati) - 1
+        return FactTables(self.titles[usati], nuovo_codice[self.title_codes[keep]].astype(np.int32),
+                          {p: (codes[keep], uniques) for p, (codes, uniques) in self.values.items()},
+                          nuova_riga[self.contains_rows[tenuti]].astype(np.int32),
+                          self.contains_ings[tenuti], self.vocabulary)
+
+    def subset(self, titles):
+        return self._take(self.rows_of(titles))
 
-    save_kb_to_pickle(kb)
-    recipe_kb(kb)
+    # --- MODIFICHE SUL POSTO (add_recipes / retract_recipes) ---
+    def retract(self, titles):
+        vars(self).update(vars(self._take(~self.rows_of(titles))))
+
+    # Righe di un'altra tabella in coda, con titoli, valori e ingredienti rimappati sui codici di questa
+    def extend(self, other):
+        offset = self.n_rows
+        self.titles, mappa = merge_uniques(self.titles, other.titles)
+        self.title_codes = np.concatenate([self.title_codes, mappa[other.title_codes]])
+        for predicate, (codes, uniques) in self.values.items():
+            o_codes, o_uniques = other.values[predicate]
+            uniques, mappa = merge_uniques(uniques, o_uniques)
+            self.values[predicate] = (np.concatenate([codes, mappa[o_codes]]), uniques)
+        self.vocabulary, mappa = merge_uniques(self.vocabulary, other.vocabulary)
+        self.contains_rows = np.concatenate([self.contains_rows, other.contains_rows + np.int32(offset)])
+        self.contains_ings = np.concatenate([self.contains_ings, mappa[other.contains_ings]])
+
+    def column(self, predicate):
+        codes, uniques = self.values[predicate]
+        return uniques[codes]
+
+    # Stesse stringhe (e stesso ordine) del vecchio ciclo su iterrows()
+    def iter_facts(self):
+        row_titles = self.row_titles().tolist()
+        columns = [(predicate, self.column(predicate).tolist()) for predicate in self.values]
+        ingredients = self.vocabulary[self.contains_ings].tolist()
+        bounds = np.zeros(self.n_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.contains_rows, minlength=self.n_rows), out=bounds[1:])
+        bounds = bounds.tolist()
+        for r, title in enumerate(row_titles):
+            for predicate, values in columns:
+                yield f"{predicate}({title},{values[r]})"
+            for ing in ingredients[bounds[r]:bounds[r + 1]]:
+                yield f"contains({title},{ing})"
+
+    # Fatti di base come tuple per predicato (per KnowledgeBase.add_facts / update)
+    def relations(self):
+        row_titles = self.row_titles().tolist()
+        out = {predicate: zip(row_titles, self.column(predicate).tolist()) for predicate in self.values}
+        out['contains'] = zip(self.titles[self.title_codes[self.contains_rows]].tolist(),
+                              self.vocabulary[self.contains_ings].tolist())
+        return out
+
+    def to_kb_list(self):
+        kb = list(self.iter_facts())
+        kb.extend(domain_knowledge())
+        return kb
+
+    # Carica fatti e regole in una KB. Il motore datalog riceve direttamente
+    # le tuple, senza passare dal testo; pytholog legge le stringhe generate al volo.
+    def load_into(self, kb):
+        if hasattr(kb, 'add_facts'):
+            for predicate, tuples in self.relations().items():
+                kb.add_facts(predicate, tuples)
+        else:
+            kb(self.iter_facts())
+        kb(domain_knowledge())
+        return kb
+
+
+# Accetta un dataframe o un recipe_store.RecipeStore: i titoli e i valori internati
+# dell'archivio diventano direttamente le tabelle dei fatti, e contains sono le
+# sue postings ristrette ai token con più di due caratteri
+def build_fact_tables(dataframe):
+    if isinstance(dataframe, RecipeStore):
+        store = dataframe
+    else:
+        store = RecipeStore.from_dataframe(dataframe, columns=[TITLE_COLUMN, TOKEN_COLUMN, *FACT_COLUMNS.values()])
+    values = {}
+    for predicate, column in FACT_COLUMNS.items():
+        v_codes, uniques = store.codes(column)
+        values[predicate] = (np.asarray(v_codes, dtype=np.int32), uniques)
+
+    # Vocabolario dei soli token lunghi, nello stesso ordine di prima apparizione
+    lunghi = np.fromiter((len(v) > 2 for v in store.vocabulary.tolist()), dtype=bool, count=len(store.vocabulary))
+    indices = np.asarray(store.indices)
+    tenuti = lunghi[indices]
+    righe = np.repeat(np.arange(len(store), dtype=np.int32), np.diff(store.indptr))
+    nuovo_codice = (np.cumsum(lunghi) - 1).astype(np.int32)
+    return FactTables(store.titles, np.asarray(store.title_codes, dtype=np.int32), values,
+                      righe[tenuti], nuovo_codice[indices[tenuti]], store.vocabulary[lunghi])
+
+
+# Fasi cronometrate con instrumentation (populate_kb.*) se la profilazione è attiva
+def populate_kb(dataframe, engine='pytholog'):
+    recipe_kb = new_knowledge_base(engine)
+    with instrumentation.stage('populate_kb.build_fact_tables'):
+        facts = build_fact_tables(dataframe)
+    with instrumentation.stage('populate_kb.save_pickle'):
+        save_kb_to_pickle(facts)
+    with instrumentation.stage(f'populate_kb.load_into[{engine}]'):
+        facts.load_into(recipe_kb)
     return recipe_kb
 
 # --- FUNZIONI UTILI ---
 def print_query_results(kb, query_str, description, limit=3):
+    import pytholog as pl
     print(f"\n{'='*50}")
     print(f" {description.upper()}")
     print(f"{'='*50}")
@@ -136,21 +308,132 @@ def print_query_results(kb, query_str, description, limit=3):
     else:
         print(" ! Nessun risultato trovato per questa categoria.")
 
-def save_kb_to_pickle(kb_list, filename="kb_data.pkl"):
+def save_kb_to_pickle(kb_data, filename="kb_data.pkl"):
+    if isinstance(kb_data, FactTables):
+        kb_data = kb_data.to_state()
     with open(filename, 'wb') as f:
-        pickle.dump(kb_list, f)
+        pickle.dump(kb_data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    # La base riscritta include già tutte le modifiche: il registro precedente non vale più
+    if os.path.exists(delta_path(filename)):
+        os.remove(delta_path(filename))
     print(f"KB serializzata in {filename}")
 
-def load_kb_from_pickle(filename="kb_data.pkl"):
+def _read_kb_pickle(filename):
+    with open(filename, 'rb') as f:
+        kb_data = pickle.load(f)
+    # Pickle attuali: stato delle tabelle (dict); prima: FactTables o lista di stringhe
+    if isinstance(kb_data, dict):
+        kb_data = FactTables.from_state(kb_data)
+    if isinstance(kb_data, FactTables):
+        replay_kb_deltas(kb_data, filename)
+    return kb_data
+
+def load_kb_from_pickle(filename="kb_data.pkl", engine='pytholog'):
     if os.path.exists(filename):
-        with open(filename, 'rb') as f:
-            kb_list = pickle.load(f)
-        new_kb = pl.KnowledgeBase('Ricette_Logiche_KB')
-        new_kb(kb_list)
+        kb_data = _read_kb_pickle(filename)
+        new_kb = new_knowledge_base(engine)
+        if isinstance(kb_data, FactTables):
+            kb_data.load_into(new_kb)
+        else:
+            new_kb(kb_data)
         print(f"KB caricata da {filename}")
         return new_kb
     return None
 
+# Tabelle dei fatti del pickle con le modifiche del registro già applicate
+def load_fact_tables(filename="kb_data.pkl"):
+    if not os.path.exists(filename):
+        return None
+    kb_data = _read_kb_pickle(filename)
+    return kb_data if isinstance(kb_data, FactTables) else None
+
+# --- AGGIORNAMENTI INCREMENTALI ---
+# Le ricette aggiunte o ritirate non riscrivono kb_data.pkl: ogni modifica viene
+# accodata come record pickle ('add', stato di FactTables) o ('retract', [titoli]) nel
+# registro kb_data.pkl.delta, riapplicato in ordine al caricamento. Il costo di
+# un aggiornamento dipende quindi dalla dimensione della modifica; compact_kb
+# riscrive la base con tutte le modifiche e svuota il registro.
+def delta_path(filename="kb_data.pkl"):
+    return filename + ".delta"
+
+# Registro append-only di record (tipo, dati), usato anche da kb_snapshot
+def append_delta_record(path, kind, payload):
+    with open(path, 'ab') as f:
+        pickle.dump((kind, payload), f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+
+def read_delta_records(path):
+    if not os.path.exists(path):
+        return
+    letti = 0
+    with open(path, 'rb') as f:
+        while True:
+            try:
+                record = pickle.load(f)
+            except EOFError:
+                break
+            except (pickle.UnpicklingError, ValueError):
+                # Ultimo record scritto a metà (interruzione durante l'append): si ignora
+                print(f"[!] Registro {path} troncato dopo {letti} modifiche")
+                break
+            letti += 1
+            yield record
+
+def append_kb_delta(filename, kind, payload):
+    append_delta_record(delta_path(filename), kind, payload)
+
+def replay_kb_deltas(facts, filename="kb_data.pkl"):
+    applicati = 0
+    for kind, payload in read_delta_records(delta_path(filename)):
+        if kind == 'add':
+            facts.extend(payload if isinstance(payload, FactTables) else FactTables.from_state(payload))
+        elif kind == 'retract':
+            facts.retract(payload)
+        applicati += 1
+    return applicati
+
+def compact_kb(filename="kb_data.pkl"):
+    facts = load_fact_tables(filename)
+    if facts is not None:
+        save_kb_to_pickle(facts, filename)
+    return facts
+
+# Aggiunge le ricette di 'dataframe' (righe già pulite con prepare_dataframe):
+# fatti nuovi nella KB e nelle tabelle, record nel registro. Con il motore
+# datalog si ricalcolano solo le relazioni derivate dei titoli aggiunti;
+# pytholog risolve le query top-down e basta svuotarne la cache.
+# Restituisce i titoli toccati (es. per PredicateIndex.update).
+def add_recipes(kb, facts, dataframe, filename="kb_data.pkl"):
+    nuove = build_fact_tables(dataframe)
+    if not nuove.n_rows:
+        return set()
+    append_kb_delta(filename, 'add', nuove.to_state())
+    facts.extend(nuove)
+    if hasattr(kb, 'update'):
+        kb.update(added=nuove.relations())
+    else:
+        kb(nuove.iter_facts())
+        kb.clear_cache()
+    return set(nuove.titles.tolist())
+
+# Ritira tutte le righe dei titoli indicati (per modificare una ricetta: ritiro + aggiunta)
+def retract_recipes(kb, facts, titles, filename="kb_data.pkl"):
+    titles = list(dict.fromkeys(titles))
+    vecchie = facts.subset(titles)
+    if not vecchie.n_rows:
+        return set()
+    append_kb_delta(filename, 'retract', titles)
+    facts.retract(titles)
+    if hasattr(kb, 'update'):
+        kb.update(removed=vecchie.relations())
+    else:
+        # pytholog non permette di ritirare fatti: si ricarica dalle tabelle aggiornate
+        kb.db.clear()
+        kb.clear_cache()
+        facts.load_into(kb)
+    return set(vecchie.titles.tolist())
+
 if __name__ == "__main__":
     df = build_dataframe()
     if df is not None:
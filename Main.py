@@ -1,29 +1,76 @@
-import joblib
-import pandas as pd
+import sys
+import instrumentation
+# --importtime misura anche gli import di questo modulo (il flag vale solo da riga di comando)
+if __name__ == "__main__" and '--importtime' in sys.argv[1:]:
+    instrumentation.trace_imports()
+import argparse
+import os
+import numpy as np
+import warnings
 from collections import Counter
-import KB
 import CSP
+import kb_snapshot
+import shopping_list
+import taste_predictor
+from recipe_store import RecipeStore
 import re
 # --- FUNZIONE DI PREDIZIONE ---
-def predict_user_taste(model, vectorizer, user_recipes):
+NON_ALFABETICI = re.compile(r'[^a-zA-Z\s]')
+
+def clean_taste_text(text):
+    return NON_ALFABETICI.sub(' ', str(text).lower())
+
+# Probabilità di ogni gusto per una lista di testi ingredienti.
+# La matrice resta sparsa (CSR) e predict_proba viene chiamata una volta per
+# blocco di batch_size righe, così anche l'intero catalogo non viene densificato.
+def predict_taste_proba(model, vectorizer, texts, batch_size=20000):
+    texts = [clean_taste_text(t) for t in texts]
+    blocchi = []
+    with warnings.catch_warnings():
+        # Il modello è stato addestrato su un DataFrame con nomi di colonna
+        warnings.filterwarnings('ignore', message='X does not have valid feature names')
+        for start in range(0, len(texts), batch_size):
+            ing_matrix = vectorizer.transform(texts[start:start + batch_size])
+            blocchi.append(model.predict_proba(ing_matrix))
+    if not blocchi:
+        return model.classes_, np.zeros((0, len(model.classes_)))
+    return model.classes_, np.vstack(blocchi)
+
+# aggregate='vote': voto di maggioranza delle predizioni (come model.predict per ricetta)
+# aggregate='proba': gusto con la somma delle probabilità più alta
+def predict_user_taste(model, vectorizer, user_recipes, aggregate='vote'):
     if not user_recipes:
         return "neutral"
-        
-    predicted_tastes = []
-    feature_names = vectorizer.get_feature_names_out()
-    
-    for recipe in user_recipes:
-        
-        raw_text = recipe['ingredients'].lower()
-        cleaned_ing = re.sub(r'[^a-zA-Z\s]', ' ', raw_text) 
 
-        ing_matrix = vectorizer.transform([cleaned_ing]).toarray()
-        ing_df = pd.DataFrame(ing_matrix, columns=feature_names)
-        
-        taste = model.predict(ing_df)[0]
-        predicted_tastes.append(taste)
-    
-    return Counter(predicted_tastes).most_common(1)[0][0]
+    classes, proba = predict_taste_proba(model, vectorizer, [r['ingredients'] for r in user_recipes])
+    if aggregate == 'proba':
+        return str(classes[np.argmax(proba.sum(axis=0))])
+    if aggregate != 'vote':
+        raise ValueError(f"Aggregazione sconosciuta: {aggregate}")
+
+    predicted_tastes = classes[np.argmax(proba, axis=1)]
+    return str(Counter(predicted_tastes).most_common(1)[0][0])
+
+def _catalogue_texts(df, column):
+    if isinstance(df, RecipeStore):
+        return df.column(column).tolist()
+    return df[column].fillna('').tolist()
+
+# Probabilità dei gusti per tutte le ricette del catalogo (una colonna per gusto)
+# (df può essere anche un recipe_store.RecipeStore)
+def score_catalogue(model, vectorizer, df, column='ingredients_raw', batch_size=20000):
+    import pandas as pd
+    classes, proba = predict_taste_proba(model, vectorizer, _catalogue_texts(df, column), batch_size)
+    return pd.DataFrame(proba, columns=classes, index=None if isinstance(df, RecipeStore) else df.index)
+
+# Probabilità di un solo gusto per ogni ricetta (array NumPy, None se il modello non lo conosce):
+# come score_catalogue(...)[taste] ma senza pandas
+def taste_scores(model, vectorizer, df, taste, column='ingredients_raw', batch_size=20000):
+    classes = [str(c) for c in model.classes_]
+    if taste not in classes:
+        return None
+    _, proba = predict_taste_proba(model, vectorizer, _catalogue_texts(df, column), batch_size)
+    return proba[:, classes.index(taste)]
 
 # --- FUNZIONE STAMPA MENU ---
 def stampa_menu_completo(soluzione, preferred_taste):
@@ -31,64 +78,41 @@ def stampa_menu_completo(soluzione, preferred_taste):
         print("\n[!] Impossibile generare un menù con questi vincoli.")
         return
         
-    giorni = ["Lun", "Mar", "Mer", "Gio", "Ven", "Sab", "Dom"]
     print("\n" + "="*60)
     print(f"{'IL TUO MENÙ SETTIMANALE DETTAGLIATO':^60}")
     print(f"{'Gusto di riferimento: ' + preferred_taste.upper():^60}")
     print("="*60)
 
-    for g in giorni:
-        print(f"\n{g.upper()}:")
-        pasti_del_giorno = []
-        
-        for pasto in ["Colazione", "Pranzo", "Cena"]:
-            ricetta = soluzione[g][pasto]
-            titolo = ricetta['recipe_title'].replace('_', ' ').title()
-            print(f"  {pasto:10}: {titolo} [{ricetta['primary_taste']}]")
-            pasti_del_giorno.append(ricetta)
-        
-        print(f"\n  --- LISTA INGREDIENTI {g.upper()} ---")
-        for r in pasti_del_giorno:
-            titolo = r['recipe_title'].replace('_', ' ').title()
-            # Mostra gli ingredienti separati da virgola per leggibilità
-            ingredienti_raw = r['ingredients_raw'].replace('_', ', ')
-            print(f"  * Per {titolo}:")
-            print(f"    {ingredienti_raw}")
-        
-        print("-" * 40)
+    # Un blocco (una sola scrittura) per giorno, con flush: il giorno appare appena pronto
+    for g in CSP.GIORNI:
+        sys.stdout.write(CSP.format_day(g, soluzione[g]))
+        sys.stdout.flush()
+
+    # Ingredienti della settimana sommati per nome e unità
+    store = soluzione[CSP.GIORNI[0]][CSP.PASTI_TIPO[0]].store
+    sys.stdout.write(shopping_list.format_shopping_list(*shopping_list.ShoppingAggregator(store).aggregate(soluzione)))
     
     print("="*60)
 
-# --- MAIN ---
-def main():
+# --- CARICAMENTO MODELLO E INPUT ---
+# (model, vectorizer), None se il modello manca o non si carica
+def carica_modello():
     try:
         print("Caricamento modello...")
-        data = joblib.load('modello_gusti_ricette.pkl')
-        # Estrazione modello e vettorizzatore
-        model = data['model']
-        vectorizer = data['vectorizer']
+        # Modello compatto (array NumPy, senza scikit-learn) se aggiornato rispetto al pickle;
+        # altrimenti pickle joblib, da cui il compatto viene esportato per il prossimo avvio
+        with instrumentation.stage('main.load_model'):
+            return taste_predictor.load_taste_model('modello_gusti_ricette.pkl')
         
     except FileNotFoundError:
         print("\n[ERRORE] Modello 'modello_gusti_ricette.pkl' non trovato!")
         print("Assicurati di aver addestrato il modello prima di avviare il Main.")
-        return
+        return None
     except (KeyError, Exception) as e:
         print(f"\n[ERRORE] Caricamento modello fallito: {e}")
-        return
+        return None
 
-    # Costruzione del dataframe ricette dal modulo KB
-    print("Caricamento KB...")
-    df = KB.build_dataframe()
-    if df is None:
-        return
-        
-    my_kb = KB.load_kb_from_pickle()
-    if my_kb is None:
-        print("KB non trovata, creazione in corso...")
-        my_kb = KB.populate_kb(df)
-        print("\n--- SISTEMA DI RACCOMANDAZIONE NUTRIZIONALE ---")
-    
-    # --- CONFIGURAZIONE PROFILO UTENTE ---
+def chiedi_piatti():
     user_recipes = []
     print("\nInserisci alcuni piatti che ti piacciono (almeno uno).")
     while True:
@@ -97,12 +121,39 @@ def main():
             break
         ingred = input("Ingredienti principali (es: tomato, pasta, chili): ")
         user_recipes.append({'title': nome, 'ingredients': ingred})
+    return user_recipes
+
+# --- GENERAZIONE MENU (interattiva) ---
+# Con MENU_PROFILE=report.json le fasi di calcolo (main.*, non l'attesa dell'input)
+# finiscono nel report di instrumentation insieme alle statistiche di KB e CSP.
+# Da snapshot valido e modello compatto non si importano né pandas né scikit-learn.
+def generate_menu(csv_path="recipes_extended.csv", limit=30000):
+    modello = carica_modello()
+    if modello is None:
+        return 1
+    model, vectorizer = modello
+
+    # Costruzione del dataframe ricette dal modulo KB
+    print("Caricamento KB...")
+    # Snapshot compilato (archivio delle ricette + indice dei predicati materializzato):
+    # al primo avvio viene creato dal CSV, poi non serve più rileggerlo né ripulirlo.
+    # L'archivio (recipe_store) sostituisce il dataframe: le stringhe si creano in stampa
+    with instrumentation.stage('main.load_kb'):
+        dati = kb_snapshot.load_or_build(csv_path, limit, as_store=True)
+    if dati is None:
+        return 1
+    df, index = dati
+    print("\n--- SISTEMA DI RACCOMANDAZIONE NUTRIZIONALE ---")
+
+    # --- CONFIGURAZIONE PROFILO UTENTE ---
+    user_recipes = chiedi_piatti()
 
     if not user_recipes:
         print("Nessun dato inserito. Chiusura.")
-        return
+        return 1
     # Predizione del gusto preferito
-    preferred_taste = predict_user_taste(model, vectorizer, user_recipes)
+    with instrumentation.stage('main.predict_taste'):
+        preferred_taste = predict_user_taste(model, vectorizer, user_recipes)
     print(f"\n>>> GUSTO RILEVATO: {preferred_taste.upper()} <<<")
 
     try:
@@ -110,7 +161,7 @@ def main():
         altezza = float(input("Altezza (cm): "))
     except ValueError:
         print("Inserire valori numerici validi per peso e altezza.")
-        return
+        return 1
     
     user_data = {
         "bmi": peso / ((altezza/100)**2),
@@ -123,17 +174,182 @@ def main():
     }
 
     
+    # Probabilità del gusto preferito per ogni ricetta, calcolata una sola volta:
+    # entra nel punteggio con cui vengono ordinati i menu
+    taste_proba = None
+    if 'ingredients_raw' in df.columns:
+        with instrumentation.stage('main.score_catalogue'):
+            taste_proba = taste_scores(model, vectorizer, df, preferred_taste)
+
     # --- CICLO DI GENERAZIONE MENU ---
+    # Una ricerca produce i k menu migliori: le richieste di un'altra versione si
+    # servono da questi e solo a lista esaurita si ricalcola, penalizzando le
+    # ricette già proposte
+    menu_pronti = []
+    serviti = Counter()
     while True:
-        print("\nGenerazione menù personalizzato in corso...")
-        # Il CSP userà il gusto predetto per filtrare o dare priorità ai piatti
-        menu_finale = CSP.solve_menu_csp(my_kb, user_data, preferred_taste,df)
-        stampa_menu_completo(menu_finale, preferred_taste)
+        if menu_pronti:
+            print("\nVersione già calcolata, successiva in classifica:")
+        else:
+            print("\nGenerazione menù personalizzato in corso...")
+            with instrumentation.stage('main.solve_menu_topk'):
+                menu_pronti = CSP.solve_menu_topk(None, user_data, preferred_taste, df, index=index,
+                                                  taste_proba=taste_proba, served=serviti)
+        if menu_pronti:
+            punteggio, menu_finale = menu_pronti.pop(0)
+            serviti.update(menu_finale[g][pt]['recipe_title'] for g in CSP.GIORNI for pt in CSP.PASTI_TIPO)
+            print(f"Punteggio del menù: {punteggio:.2f}")
+        else:
+            menu_finale = None
+        with instrumentation.stage('main.print_menu'):
+            stampa_menu_completo(menu_finale, preferred_taste)
 
         ancora = input("\nDesideri generare un'altra versione di questo menù? (s/n): ").lower()
         if ancora != 's':
             print("\nUscita in corso. Buona dieta e buon appetito!")
             break
+    return 0
+
+# --- ALTRI SOTTOCOMANDI ---
+def build_kb(csv_path, limit, directory, rebuild=False, pickle=False):
+    dati = kb_snapshot.load_or_build(csv_path, limit, directory, as_store=True, rebuild=rebuild)
+    if dati is None:
+        return 1
+    store, index = dati
+    print(f"KB: {len(store)} ricette, {len(index)} titoli, {len(index.predicates)} predicati")
+    if pickle:
+        # Tabelle dei fatti per KB.load_kb_from_pickle (pytholog / datalog)
+        import KB
+        KB.save_kb_to_pickle(KB.build_fact_tables(store))
+    return 0
+
+# Aggiornamenti incrementali: add / retract accodano una modifica al registro dello
+# snapshot (e di kb_data.pkl, se esiste) senza ricostruire nulla; compact riscrive
+# lo snapshot e il pickle con tutte le modifiche
+def update_kb(azione, csv_path, limit, directory, pickle_path, recipes=None, titles=()):
+    import KB
+    if azione == 'add':
+        import pandas as pd
+        try:
+            df = KB.prepare_dataframe(pd.read_csv(recipes))
+        except FileNotFoundError:
+            print(f"Errore: File '{recipes}' non trovato.")
+            return 1
+        kb_snapshot.add_recipes(df, directory)
+        if os.path.exists(pickle_path):
+            KB.append_kb_delta(pickle_path, 'add', KB.build_fact_tables(df).to_state())
+        print(f"{len(df)} ricette aggiunte al registro di {directory}/")
+    elif azione == 'retract':
+        titoli = kb_snapshot.retract_recipes([KB.clean_pl(t) for t in titles], directory)
+        if os.path.exists(pickle_path):
+            KB.append_kb_delta(pickle_path, 'retract', titoli)
+        print(f"{len(titoli)} titoli ritirati nel registro di {directory}/")
+    else:
+        dati = kb_snapshot.compact(csv_path, limit, directory)
+        if dati is None:
+            return 1
+        store, index = dati
+        print(f"KB: {len(store)} ricette, {len(index)} titoli, {len(index.predicates)} predicati")
+        if os.path.exists(pickle_path):
+            KB.compact_kb(pickle_path)
+    return 0
+
+def predict_taste(dishes, aggregate='vote'):
+    modello = carica_modello()
+    if modello is None:
+        return 1
+    model, vectorizer = modello
+    user_recipes = [{'title': d, 'ingredients': d} for d in dishes] or chiedi_piatti()
+    if not user_recipes:
+        print("Nessun dato inserito. Chiusura.")
+        return 1
+    with instrumentation.stage('main.predict_taste'):
+        classes, proba = predict_taste_proba(model, vectorizer, [r['ingredients'] for r in user_recipes])
+        preferred_taste = predict_user_taste(model, vectorizer, user_recipes, aggregate)
+    for r, p in zip(user_recipes, proba):
+        dettaglio = ", ".join(f"{c} {v:.2f}" for c, v in zip(classes, p))
+        print(f"  {r['ingredients']}: {classes[np.argmax(p)]} ({dettaglio})")
+    print(f"\n>>> GUSTO RILEVATO: {preferred_taste.upper()} <<<")
+    return 0
+
+# --- MAIN ---
+# Sottocomandi (senza sottocomando: generate-menu, come prima):
+#   generate-menu   menù settimanale interattivo
+#   build-kb        snapshot della KB dal CSV (e kb_data.pkl con --pickle)
+#   kb              add CSV | retract TITOLO... | compact: modifiche incrementali della KB
+#   predict-taste   gusto prevalente di alcuni piatti
+#   train           addestramento del modello (opzioni di learning_fase)
+#   batch           menu per un file di profili (opzioni di batch_menu)
+#   shopping        liste della spesa dei menu di batch (opzioni di shopping_list)
+#   plan            menu su più settimane con vincoli di varietà (opzioni di planner plan)
+# Ogni sottocomando importa solo ciò che usa: scikit-learn e lo stack CSV
+# (pandas, pulizia) entrano solo con train, con una KB da ricostruire o con
+# un modello ancora in formato pickle. --importtime stampa i tempi di import.
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sistema di raccomandazione nutrizionale")
+    parser.add_argument('--importtime', action='store_true',
+                        help="tempi di import dei moduli caricati (come python -X importtime)")
+    comandi = parser.add_subparsers(dest='comando')
+    p = comandi.add_parser('generate-menu', help="menù settimanale interattivo (default)")
+    p.add_argument('--csv', default="recipes_extended.csv")
+    p.add_argument('--limit', type=int, default=30000)
+    p = comandi.add_parser('build-kb', help="costruisce lo snapshot della KB")
+    p.add_argument('--csv', default="recipes_extended.csv")
+    p.add_argument('--limit', type=int, default=30000)
+    p.add_argument('--directory', default=kb_snapshot.SNAPSHOT_DIR)
+    p.add_argument('--rebuild', action='store_true', help="ricostruisce anche uno snapshot valido")
+    p.add_argument('--pickle', action='store_true', help="salva anche le tabelle dei fatti in kb_data.pkl")
+    comuni = argparse.ArgumentParser(add_help=False)
+    comuni.add_argument('--csv', default="recipes_extended.csv")
+    comuni.add_argument('--limit', type=int, default=30000)
+    comuni.add_argument('--directory', default=kb_snapshot.SNAPSHOT_DIR)
+    comuni.add_argument('--pickle-path', default="kb_data.pkl", help="aggiornato anche questo pickle, se esiste")
+    p = comandi.add_parser('kb', help="aggiunge o ritira ricette senza ricostruire la KB")
+    azioni = p.add_subparsers(dest='azione', required=True)
+    a = azioni.add_parser('add', parents=[comuni], help="aggiunge le ricette di un CSV (schema di recipes_extended.csv)")
+    a.add_argument('recipes')
+    a = azioni.add_parser('retract', parents=[comuni], help="ritira tutte le righe dei titoli indicati")
+    a.add_argument('titles', nargs='+')
+    azioni.add_parser('compact', parents=[comuni], help="riscrive lo snapshot con le modifiche del registro")
+    p = comandi.add_parser('predict-taste', help="gusto prevalente di alcuni piatti")
+    p.add_argument('dishes', nargs='*', help="ingredienti di un piatto, es. \"tomato, pasta, chili\"")
+    p.add_argument('--aggregate', choices=['vote', 'proba'], default='vote')
+    # Opzioni passate così come sono a learning_fase / batch_menu / shopping_list / planner (anche --help)
+    comandi.add_parser('train', help="addestramento del modello dei gusti", add_help=False)
+    comandi.add_parser('batch', help="menu per un file JSONL di profili", add_help=False)
+    comandi.add_parser('shopping', help="liste della spesa dei menu generati in batch", add_help=False)
+    comandi.add_parser('plan', help="menu su più settimane senza ripetizioni ravvicinate", add_help=False)
+    args, resto = parser.parse_known_args(argv)
+    if resto and args.comando not in ('train', 'batch', 'shopping', 'plan'):
+        parser.error(f"argomenti non riconosciuti: {' '.join(resto)}")
+
+    if args.importtime:
+        instrumentation.trace_imports()
+    try:
+        if args.comando == 'build-kb':
+            return build_kb(args.csv, args.limit, args.directory, args.rebuild, args.pickle)
+        if args.comando == 'kb':
+            return update_kb(args.azione, args.csv, args.limit, args.directory, args.pickle_path,
+                             getattr(args, 'recipes', None), getattr(args, 'titles', ()))
+        if args.comando == 'predict-taste':
+            return predict_taste(args.dishes, args.aggregate)
+        if args.comando == 'train':
+            import learning_fase
+            return learning_fase.cli(resto)
+        if args.comando == 'batch':
+            import batch_menu
+            return batch_menu.main(resto)
+        if args.comando == 'shopping':
+            return shopping_list.main(resto)
+        if args.comando == 'plan':
+            import planner
+            return planner.main(['plan'] + resto)
+        if args.comando == 'generate-menu':
+            return generate_menu(args.csv, args.limit)
+        return generate_menu()
+    finally:
+        if args.importtime:
+            instrumentation.print_imports()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
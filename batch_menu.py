@@ -0,0 +1,189 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing as mp
+import os
+import random
+import sys
+import time
+import numpy as np
+import CSP
+import kb_server
+import kb_snapshot
+
+# --- GENERAZIONE MENU IN BATCH ---
+# Legge un file JSONL di profili, uno per riga:
+#   {"id": "u1", "preferred_taste": "savory",
+#    "user_data": {"bmi": 22.1, "sport": true, "is_vegetarian": false,
+#                  "intolleranze": {"lattosio": false, "noci": true, "glutine": false}}}
+# e scrive un menu per profilo (JSONL, stesso ordine dell'input) con la latenza
+# di ogni risoluzione. Archivio delle ricette e indice vengono caricati una volta
+# nel processo principale: con il metodo 'fork' i worker li ereditano in
+# copy-on-write (gli array sono già mappati dallo snapshot), altrimenti ogni
+# worker carica lo snapshot all'avvio. Con --kb-shm NOME la KB viene dal
+# segmento pubblicato da kb_server (serve) e ogni worker vi si collega.
+
+# Stato condiviso dei worker: (df, index) e parametri del solver
+_DATI = None
+_OPZIONI = {}
+
+
+def _load(csv_path, limit, directory, kb_shm=None):
+    if kb_shm:
+        return kb_server.attach(kb_shm).data
+    return kb_snapshot.load_or_build(csv_path, limit, directory, as_store=True)
+
+
+def _init_worker(csv_path, limit, directory, opzioni, kb_shm=None):
+    global _DATI, _OPZIONI
+    _OPZIONI = opzioni
+    if _DATI is None:
+        # Metodo 'spawn'/'forkserver': nessuna memoria ereditata, si riapre lo snapshot
+        with contextlib.redirect_stdout(io.StringIO()):
+            _DATI = _load(csv_path, limit, directory, kb_shm)
+
+
+def _solve_one(item):
+    numero, profilo = item
+    df, index = _DATI
+    pid = profilo.get('id', numero)
+    preferred_taste = profilo.get('preferred_taste', 'neutral')
+    # Seme per profilo: lo stesso file produce gli stessi menu a ogni esecuzione
+    random.seed(_OPZIONI['seed'] + numero)
+
+    log = io.StringIO()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(log):
+            menu = CSP.solve_menu_csp(None, profilo['user_data'], preferred_taste, df, index=index,
+                                      timeout=_OPZIONI['timeout'], best_effort=_OPZIONI['best_effort'])
+        errore = None
+    except Exception as e:
+        # Un profilo che fa fallire il solver è un suo esito, non interrompe il batch
+        menu, errore = None, f"{type(e).__name__}: {e}"
+    latenza = time.perf_counter() - start
+
+    risultato = {'id': pid, 'preferred_taste': preferred_taste, 'latency_ms': round(latenza * 1000, 3)}
+    if errore is not None:
+        risultato['status'] = 'error'
+        risultato['error'] = errore
+    elif menu is None:
+        risultato['status'] = 'no_menu'
+        risultato['message'] = log.getvalue().strip()
+    else:
+        risultato['status'] = 'ok'
+        risultato['menu'] = {g: {pt: menu[g][pt]['recipe_title'] for pt in CSP.PASTI_TIPO} for g in CSP.GIORNI}
+    return risultato
+
+
+def read_profiles(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for riga in f:
+            riga = riga.strip()
+            if riga:
+                yield json.loads(riga)
+
+
+def _report(latenze, stati, elapsed, workers):
+    latenze = np.array(latenze, dtype=float)
+    report = {
+        'profiles': int(len(latenze)),
+        'workers': workers,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_per_s': round(len(latenze) / elapsed, 3) if elapsed > 0 else None,
+        'status': dict(stati),
+    }
+    if len(latenze):
+        report['latency_ms'] = {
+            'mean': round(float(latenze.mean()), 3),
+            'p50': round(float(np.percentile(latenze, 50)), 3),
+            'p95': round(float(np.percentile(latenze, 95)), 3),
+            'max': round(float(latenze.max()), 3),
+        }
+    return report
+
+
+def run_batch(profiles_path, output_path, workers=None, chunksize=8, timeout=5.0, best_effort=False,
+              seed=42, csv_path="recipes_extended.csv", limit=30000, directory=kb_snapshot.SNAPSHOT_DIR,
+              kb_shm=None):
+    global _DATI
+    workers = workers or os.cpu_count() or 1
+    opzioni = {'timeout': timeout, 'best_effort': best_effort, 'seed': seed}
+
+    print("Caricamento KB...")
+    if _DATI is None:
+        try:
+            _DATI = _load(csv_path, limit, directory, kb_shm)
+        except FileNotFoundError:
+            print(f"[ERRORE] KB condivisa '{kb_shm}' non trovata: avviare prima 'kb_server.py serve'.")
+            return None
+    if _DATI is None:
+        return None
+
+    # 'fork' dove disponibile: i worker condividono le pagine già caricate
+    metodo = 'fork' if 'fork' in mp.get_all_start_methods() else None
+    ctx = mp.get_context(metodo)
+    profili = enumerate(read_profiles(profiles_path))
+
+    latenze = []
+    stati = {}
+    start = time.perf_counter()
+    with open(output_path, 'w', encoding='utf-8') as out:
+        if workers == 1:
+            _init_worker(csv_path, limit, directory, opzioni, kb_shm)
+            risultati = map(_solve_one, profili)
+            pool = None
+        else:
+            pool = ctx.Pool(workers, initializer=_init_worker,
+                            initargs=(csv_path, limit, directory, opzioni, kb_shm))
+            risultati = pool.imap(_solve_one, profili, chunksize=chunksize)
+        try:
+            for risultato in risultati:
+                out.write(json.dumps(risultato) + "\n")
+                latenze.append(risultato['latency_ms'])
+                stati[risultato['status']] = stati.get(risultato['status'], 0) + 1
+        finally:
+            # A risultati consumati (o su errore/interruzione) i worker non servono più
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+    elapsed = time.perf_counter() - start
+
+    report = _report(latenze, stati, elapsed, workers)
+    print(f"Menu generati: {report['profiles']} in {report['elapsed_s']}s "
+          f"({report['throughput_per_s']} profili/s, {workers} worker)")
+    if 'latency_ms' in report:
+        lat = report['latency_ms']
+        print(f"Latenza per profilo (ms): media {lat['mean']}, p50 {lat['p50']}, p95 {lat['p95']}, max {lat['max']}")
+    print(f"Esiti: {report['status']}")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generazione dei menu settimanali per un file di profili")
+    parser.add_argument('profiles', help="file JSONL dei profili utente")
+    parser.add_argument('-o', '--output', default="menu_batch.jsonl", help="file JSONL dei menu generati")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="processi (default: numero di CPU)")
+    parser.add_argument('--chunksize', type=int, default=8)
+    parser.add_argument('--timeout', type=float, default=5.0, help="timeout del solver per profilo (s)")
+    parser.add_argument('--best-effort', action='store_true', help="menu parziale se il tempo scade")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--csv', default="recipes_extended.csv")
+    parser.add_argument('--limit', type=int, default=30000)
+    parser.add_argument('--report', default=None, help="salva il riepilogo anche in JSON")
+    parser.add_argument('--kb-shm', default=None, help="nome della KB condivisa di kb_server")
+    args = parser.parse_args(argv)
+
+    report = run_batch(args.profiles, args.output, args.workers, args.chunksize, args.timeout,
+                       args.best_effort, args.seed, args.csv, args.limit, kb_shm=args.kb_shm)
+    if report is None:
+        return 1
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
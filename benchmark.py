@@ -0,0 +1,315 @@
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import pytholog as pl
+import KB
+import CSP
+import kb_index
+import kb_snapshot
+import recipe_store
+
+# --- BENCHMARK DELLA PIPELINE KB -> CSP -> MENU ---
+# Genera CSV sintetici con lo schema di recipes_extended.csv e misura
+# separatamente ogni fase (pulizia, fatti, pickle, query, indice, snapshot,
+# CSP, predizione del gusto). Il risultato è un JSON confrontabile con un
+# benchmark precedente (--compare) per trovare le regressioni.
+
+DEFAULT_SIZES = [1000, 10000, 30000, 64000]
+
+COLONNE_CSV = ['recipe_title', 'cuisine_list', 'difficulty', 'est_prep_time_min', 'primary_taste',
+               'is_vegetarian', 'is_dairy_free', 'is_gluten_free', 'is_nut_free',
+               'ingredients', 'ingredient_text']
+
+# Ingredienti della tassonomia (così le regole hanno ricette che le soddisfano) più altri comuni
+INGREDIENTI_EXTRA = ['salt', 'sugar', 'garlic', 'onion', 'water', 'milk', 'lemon', 'chili',
+                     'vanilla', 'cinnamon', 'soy_sauce', 'ginger', 'basil', 'mushroom', 'cream']
+UNITA = ['cup', 'cups', 'tablespoon', 'tablespoons', 'teaspoon', 'ounce', 'g', 'ml', 'lb', 'pound']
+CUCINE = ['Italian', 'Mexican', 'Thai', 'Indian', 'French', 'Japanese', 'Greek', 'American']
+SILLABE = ['ba', 'ce', 'di', 'fo', 'gu', 'la', 'me', 'ni', 'po', 'ra', 'se', 'ti', 'vo', 'za', 'ro', 'ma']
+INDIZI_GUSTO = {'sweet': {'sugar', 'honey', 'banana', 'apple', 'vanilla', 'cinnamon'},
+                'spicy': {'chili', 'pepper', 'ginger'},
+                'umami': {'soy_sauce', 'mushroom', 'cheese', 'tuna'}}
+
+QUERY = [
+    "taste(X, sweet)",
+    "is_mediterranean(X)",
+    "is_complete(X)",
+    "is_super_veggie(X)",
+]
+
+
+# --- DATI SINTETICI ---
+def _vocabolario():
+    voci = {i for items in KB.TAXONOMY.values() for i in items}
+    voci.update(KB.ELECTROLYTE_SOURCES)
+    voci.update(INGREDIENTI_EXTRA)
+    return sorted(voci)
+
+
+def generate_recipes_csv(path, n_rows, seed=0):
+    rnd = random.Random(seed)
+    vocabolario = _vocabolario()
+    # Circa il 2% dei titoli è ripetuto, come nel dataset reale
+    titoli_comuni = [f"classic {rnd.choice(vocabolario).replace('_', ' ')}" for _ in range(50)]
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        w = csv.writer(f)
+        w.writerow(COLONNE_CSV)
+        for _ in range(n_rows):
+            scelti = rnd.sample(vocabolario, rnd.randint(3, 10))
+            voci = []
+            for ing in scelti:
+                nome = ing.replace('_', ' ')
+                if rnd.random() < 0.7:
+                    nome = f"{rnd.randint(1, 4)} {rnd.choice(UNITA)} {nome}"
+                voci.append(nome)
+            if rnd.random() < 0.02:
+                titolo = rnd.choice(titoli_comuni)
+            else:
+                titolo = ' '.join(''.join(rnd.choice(SILLABE) for _ in range(rnd.randint(2, 4)))
+                                  for _ in range(rnd.randint(2, 4)))
+            gusto = 'savory'
+            for candidato, indizi in INDIZI_GUSTO.items():
+                if indizi & set(scelti) and rnd.random() < 0.8:
+                    gusto = candidato
+                    break
+            else:
+                if rnd.random() < 0.2:
+                    gusto = 'neutral'
+            w.writerow([titolo, str(rnd.sample(CUCINE, rnd.randint(1, 2))),
+                        rnd.choice(['easy', 'medium', 'hard']), rnd.randint(5, 180), gusto,
+                        int(rnd.random() < 0.3), rnd.choice([True, False]),
+                        int(rnd.random() < 0.6), int(rnd.random() < 0.8),
+                        str(voci), ', '.join(voci)])
+    return path
+
+
+# Matrice di profili: tutte le combinazioni di intolleranze, sport, BMI basso e dieta vegetariana
+def profile_matrix(tastes=('savory', 'sweet', 'spicy'), full=False):
+    profili = []
+    for mask in range(8 if full else 4):
+        for sport in (False, True):
+            for bmi in (22.0, 17.5):
+                for veg in ((False, True) if full else (False,)):
+                    for taste in tastes:
+                        profili.append({
+                            'preferred_taste': taste,
+                            'user_data': {'bmi': bmi, 'sport': sport, 'is_vegetarian': veg,
+                                          'intolleranze': {'lattosio': bool(mask & 1), 'noci': bool(mask & 2),
+                                                           'glutine': bool(mask & 4)}}})
+    return profili
+
+
+# --- MISURE ---
+def _misura(fn, repeat=1):
+    tempi = []
+    risultato = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            risultato = fn()
+            tempi.append(time.perf_counter() - start)
+    return risultato, _riassunto(tempi)
+
+
+def _riassunto(tempi):
+    return {'repeat': len(tempi), 'min_s': round(min(tempi), 6), 'median_s': round(statistics.median(tempi), 6),
+            'mean_s': round(statistics.fmean(tempi), 6), 'max_s': round(max(tempi), 6)}
+
+
+def _modello_gusti(model_path, csv_path):
+    import joblib
+    if model_path and os.path.exists(model_path):
+        data = joblib.load(model_path)
+        return data['model'], data['vectorizer']
+    # Nessun modello: piccolo modello addestrato sul CSV sintetico (stessa pipeline di learning_fase)
+    import cleaning
+    from sklearn.ensemble import RandomForestClassifier
+    from sklearn.feature_extraction.text import CountVectorizer
+    df = pd.read_csv(csv_path, usecols=['ingredient_text', 'primary_taste'], nrows=5000)
+    testi = cleaning.TRAINING_CLEANER.clean_series(df['ingredient_text'])
+    vectorizer = CountVectorizer(stop_words='english', max_features=500, binary=True)
+    X = vectorizer.fit_transform(testi)
+    model = RandomForestClassifier(n_estimators=20, max_depth=8, random_state=42).fit(X, df['primary_taste'])
+    return model, vectorizer
+
+
+def bench_size(n_rows, workdir, engines, repeat=3, max_pytholog_rows=10000, profiles=None,
+               solvers=('propagation',), model=None, seed=0):
+    csv_path = os.path.join(workdir, f"recipes_{n_rows}.csv")
+    if not os.path.exists(csv_path):
+        generate_recipes_csv(csv_path, n_rows, seed)
+    stages = {}
+
+    df, stages['build_dataframe'] = _misura(lambda: KB.build_dataframe(n_rows, path=csv_path), repeat)
+    store, stages['recipe_store'] = _misura(lambda: recipe_store.RecipeStore.from_dataframe(df), repeat)
+    _, stages['build_fact_tables'] = _misura(lambda: KB.build_fact_tables(df), repeat)
+    index, stages['build_predicate_index'] = _misura(lambda: kb_index.build_predicate_index(df), repeat)
+
+    for engine in engines:
+        if engine == 'pytholog' and n_rows > max_pytholog_rows:
+            stages[f'populate_kb[{engine}]'] = {'skipped': f"oltre {max_pytholog_rows} righe"}
+            continue
+        kb, stages[f'populate_kb[{engine}]'] = _misura(lambda: KB.populate_kb(df, engine=engine), 1)
+        kb, stages[f'load_kb_from_pickle[{engine}]'] = _misura(
+            lambda: KB.load_kb_from_pickle("kb_data.pkl", engine=engine), 1)
+        if hasattr(kb, 'materialize'):
+            # Datalog: regole materializzate una volta, poi le query sono lookup
+            _, stages[f'materialize[{engine}]'] = _misura(kb.materialize, 1)
+        for q in QUERY:
+            risposta, misura = _misura(lambda: kb.query(pl.Expr(q)), 1)
+            misura['results'] = len(risposta) if risposta != ['No'] else 0
+            stages[f'query[{engine}] {q}'] = misura
+
+    snap_dir = os.path.join(workdir, f"snapshot_{n_rows}")
+    _, stages['snapshot_save'] = _misura(lambda: kb_snapshot.save_snapshot(df, index, csv_path, n_rows, snap_dir), 1)
+    _, stages['snapshot_load'] = _misura(lambda: kb_snapshot.load_snapshot(csv_path, n_rows, snap_dir), repeat)
+    _, stages['snapshot_load[store]'] = _misura(
+        lambda: kb_snapshot.load_snapshot(csv_path, n_rows, snap_dir, as_store=True), repeat)
+
+    for solver in solvers:
+        for fase in ('cold', 'warm'):
+            tempi = []
+            esiti = {}
+            for i, profilo in enumerate(profiles or []):
+                if fase == 'cold':
+                    CSP.DOMAIN_CACHE.clear()
+                random.seed(seed + i)
+                menu, misura = _misura(lambda: CSP.solve_menu_csp(None, profilo['user_data'], profilo['preferred_taste'],
+                                                                  store, index=index, solver=solver, timeout=5.0), 1)
+                tempi.append(misura['min_s'])
+                esito = 'ok' if menu else 'no_menu'
+                esiti[esito] = esiti.get(esito, 0) + 1
+            if tempi:
+                stages[f'solve_menu_csp[{solver},{fase}]'] = {**_riassunto(tempi), 'profiles': len(tempi),
+                                                              'p95_s': round(float(np.percentile(tempi, 95)), 6),
+                                                              'status': esiti}
+
+    if model is not None:
+        import Main
+        m, vectorizer = model
+        ricette_utente = [{'title': t, 'ingredients': ing} for t, ing in
+                          zip(df['recipe_title'][:5], df['ingredients_raw'][:5])]
+        _, stages['predict_user_taste'] = _misura(lambda: Main.predict_user_taste(m, vectorizer, ricette_utente), repeat)
+        _, stages['score_catalogue'] = _misura(lambda: Main.score_catalogue(m, vectorizer, df), 1)
+
+    return {'rows': n_rows, 'stages': stages}
+
+
+def run(sizes=DEFAULT_SIZES, engines=('pytholog', 'datalog'), repeat=3, max_pytholog_rows=10000,
+        full_matrix=False, solvers=('propagation',), model_path=None, seed=0, workdir=None):
+    risultati = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'seed': seed,
+            'repeat': repeat,
+        },
+        'sizes': {},
+    }
+    profili = profile_matrix(full=full_matrix)
+    with tempfile.TemporaryDirectory(prefix="kb_bench_") as tmp:
+        workdir = workdir or tmp
+        os.makedirs(workdir, exist_ok=True)
+        cwd = os.getcwd()
+        # populate_kb scrive kb_data.pkl nella directory corrente
+        os.chdir(workdir)
+        try:
+            model = None
+            if model_path is not False:
+                csv_modello = generate_recipes_csv(os.path.join(workdir, "recipes_model.csv"), 5000, seed + 1)
+                model = _modello_gusti(model_path and os.path.join(cwd, model_path), csv_modello)
+            for n in sizes:
+                print(f"Benchmark con {n} ricette...")
+                risultati['sizes'][str(n)] = bench_size(n, workdir, engines, repeat, max_pytholog_rows,
+                                                        profili, solvers, model, seed)
+        finally:
+            os.chdir(cwd)
+    return risultati
+
+
+# --- CONFRONTO CON UN BENCHMARK PRECEDENTE ---
+# Regressione: mediana peggiore di oltre 'tolerance' (relativa) e di almeno 'min_delta' secondi
+def compare(current, baseline, tolerance=0.2, min_delta=0.005):
+    regressioni = []
+    for size, dati in current['sizes'].items():
+        base = baseline.get('sizes', {}).get(size)
+        if base is None:
+            continue
+        for stage, misura in dati['stages'].items():
+            vecchia = base['stages'].get(stage, {})
+            if 'median_s' not in misura or 'median_s' not in vecchia:
+                continue
+            delta = misura['median_s'] - vecchia['median_s']
+            if delta > min_delta and misura['median_s'] > vecchia['median_s'] * (1 + tolerance):
+                regressioni.append({'rows': int(size), 'stage': stage, 'baseline_s': vecchia['median_s'],
+                                    'current_s': misura['median_s'],
+                                    'ratio': round(misura['median_s'] / vecchia['median_s'], 3)})
+    return regressioni
+
+
+def _stampa(risultati):
+    for size, dati in risultati['sizes'].items():
+        print(f"\n{'='*60}\n {size} RICETTE\n{'='*60}")
+        for stage, misura in dati['stages'].items():
+            if 'skipped' in misura:
+                print(f"  {stage:55} saltato ({misura['skipped']})")
+            else:
+                print(f"  {stage:55} {misura['median_s'] * 1000:10.2f} ms")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark della pipeline KB -> CSP -> menu")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help="numero di ricette sintetiche, separati da virgola")
+    parser.add_argument('--engines', default='pytholog,datalog')
+    parser.add_argument('--solvers', default='propagation')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-pytholog-rows', type=int, default=10000,
+                        help="oltre questa dimensione il motore pytholog non viene misurato")
+    parser.add_argument('--full-matrix', action='store_true', help="tutte le combinazioni di profilo")
+    parser.add_argument('--model', default=None, help="modello joblib (default: piccolo modello sintetico)")
+    parser.add_argument('--no-model', action='store_true', help="salta la predizione del gusto")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', default=None, help="conserva qui i CSV generati (default: temporanea)")
+    parser.add_argument('-o', '--output', default="benchmark.json")
+    parser.add_argument('--compare', default=None, help="JSON di un benchmark precedente")
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    risultati = run([int(s) for s in args.sizes.split(',') if s], args.engines.split(','), args.repeat,
+                    args.max_pytholog_rows, args.full_matrix, args.solvers.split(','),
+                    False if args.no_model else args.model, args.seed,
+                    os.path.abspath(args.workdir) if args.workdir else None)
+    _stampa(risultati)
+    with open(args.output, 'w') as f:
+        json.dump(risultati, f, indent=2)
+    print(f"\nRisultati salvati in {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            regressioni = compare(risultati, json.load(f), args.tolerance)
+        if regressioni:
+            print(f"\n[!] {len(regressioni)} regressioni rispetto a {args.compare}:")
+            for r in regressioni:
+                print(f"  {r['rows']:>6} {r['stage']:50} {r['baseline_s']:.4f}s -> {r['current_s']:.4f}s (x{r['ratio']})")
+            return 1
+        print(f"\nNessuna regressione rispetto a {args.compare}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
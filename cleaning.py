@@ -0,0 +1,83 @@
+import re
+import numpy as np
+
+# --- PULIZIA TESTI CONDIVISA (KB + ADDESTRAMENTO) ---
+# Stessi passi di KB.clean_pl e learning_fase.clean_ingredients_format, con le
+# espressioni regolari compilate una volta sola e applicate a intere colonne
+# con le operazioni vettoriali .str di pandas. Il vocabolario delle unità di
+# misura è un parametro di configurazione. pandas si importa nelle funzioni che
+# lo usano: espressioni e unità (es. per shopping_list) non lo richiedono.
+
+# Unità rimosse per i nomi atomici della KB
+KB_UNITS = ['pound', 'cup', 'tablespoon', 'teaspoon', 'ounce', 'g', 'ml', 'lb', 'oz']
+# Unità (e parole poco informative) rimosse dal testo di addestramento
+TRAINING_UNITS = ['pound', 'cup', 'with', 'liquid', 'green', 'tablespoon', 'teaspoon',
+                  'package', 'large', 'ounce', 'g', 'ml', 'lb', 'oz']
+
+
+class TextCleaner:
+    def __init__(self, special_chars, units, atomize):
+        # Caratteri speciali da rimuovere (es. quelli che rompono la sintassi Prolog)
+        self.special = re.compile(special_chars)
+        # Pesi e misure
+        self.units = re.compile(r'\d+/\d+|\d+\s*(' + '|'.join(units) + r')s?', flags=re.IGNORECASE)
+        self.numbers = re.compile(r'\b\d+\b')
+        # atomize=True: spazi sostituiti da underscore per nomi atomici Prolog
+        self.atomize = atomize
+
+    def clean(self, text):
+        import pandas as pd
+        if pd.isna(text):
+            return ""
+        text = self.special.sub('', text)
+        text = self.units.sub('', text)
+        text = self.numbers.sub('', text)
+        if self.atomize:
+            return text.strip().replace(" ", "_").lower()
+        return text.lower().strip()
+
+    def clean_series(self, series):
+        # dtype object: stesso motore 're' (e stesso lower()) della versione scalare
+        s = series.astype(object).where(series.notna(), "")
+        s = s.str.replace(self.special, '', regex=True)
+        s = s.str.replace(self.units, '', regex=True)
+        s = s.str.replace(self.numbers, '', regex=True)
+        if self.atomize:
+            s = s.str.strip().str.replace(" ", "_", regex=False).str.lower()
+        else:
+            s = s.str.lower().str.strip()
+        return s.astype(str)
+
+
+PROLOG_CLEANER = TextCleaner(r'[\[\]"\'\(\),]', KB_UNITS, atomize=True)
+TRAINING_CLEANER = TextCleaner(r'[\[\]"]', TRAINING_UNITS, atomize=False)
+
+
+# --- LETTURA CAMPIONATA ---
+# Stesso campione di pd.read_csv(path).sample(n=limit, random_state=...), ma
+# leggendo il file a blocchi e tenendo in memoria solo le righe estratte:
+# sample() senza pesi equivale a RandomState(seed).permutation(len(df))[:limit].
+def read_csv_sampled(path, limit, random_state=42, chunksize=10000, **kwargs):
+    import pandas as pd
+    n_rows = 0
+    for chunk in pd.read_csv(path, usecols=[0], chunksize=chunksize):
+        n_rows += len(chunk)
+    if n_rows <= limit:
+        return pd.read_csv(path, **kwargs)
+
+    selected = np.random.RandomState(random_state).permutation(n_rows)[:limit]
+    order = np.empty(n_rows, dtype=np.int64)
+    order.fill(-1)
+    order[selected] = np.arange(limit)
+
+    parts = []
+    start = 0
+    for chunk in pd.read_csv(path, chunksize=chunksize, **kwargs):
+        pos = order[start:start + len(chunk)]
+        keep = pos >= 0
+        if keep.any():
+            part = chunk[keep]
+            part.index = pos[keep]
+            parts.append(part)
+        start += len(chunk)
+    return pd.concat(parts).sort_index()
@@ -0,0 +1,394 @@
+import re
+from operator import itemgetter
+import instrumentation
+
+# --- VALUTATORE DATALOG BOTTOM-UP (SEMI-NAIVE) ---
+# Alternativa a pytholog per le regole di KB.populate_kb: legge le stesse
+# stringhe di fatti e regole, materializza tutte le relazioni derivate in
+# un'unica passata (join hash sugli argomenti già legati, es. contains
+# raggruppato per ingrediente) e risponde a query(Expr) con lo stesso formato
+# di pytholog: ['Yes'] / ['No'] per query ground, lista di dict altrimenti.
+# update() aggiunge/ritira fatti di base e ricalcola solo le relazioni derivate
+# delle chiavi toccate (es. le ricette aggiunte o rimosse).
+
+ATOM_RE = re.compile(r'(\w+)\s*\(([^()]*)\)')
+
+
+def is_variable(term):
+    return term[:1].isupper() or term[:1] == '_'
+
+
+def parse_atom(text):
+    m = ATOM_RE.match(text.strip())
+    if m is None:
+        raise ValueError(f"Sintassi non valida: {text}")
+    return m.group(1), tuple(a.strip() for a in m.group(2).split(','))
+
+
+def parse_clause(text):
+    if ':-' in text:
+        head, body = text.split(':-', 1)
+        atoms = [(p, tuple(a.strip() for a in args.split(','))) for p, args in ATOM_RE.findall(body)]
+        return parse_atom(head), atoms
+    return parse_atom(text), None
+
+
+class KnowledgeBase:
+    def __init__(self, name=None):
+        self.name = name
+        # predicato -> dict(tupla -> None): insieme ordinato per inserimento
+        self.relations = {}
+        self.rules = []
+        self._materialized = True
+        self._indexes = {}
+        # Predicati che hanno ricevuto fatti di base
+        self._fact_preds = set()
+
+    def __call__(self, kb_list):
+        self.add_kn(kb_list)
+
+    def __str__(self):
+        return "KnowledgeBase: " + str(self.name)
+
+    __repr__ = __str__
+
+    def add_kn(self, kb_list):
+        for entry in kb_list:
+            (pred, args), body = parse_clause(entry)
+            if body is None:
+                self.relations.setdefault(pred, {})[args] = None
+                self._fact_preds.add(pred)
+            else:
+                self.rules.append(((pred, args), body))
+        self._materialized = False
+        self._indexes.clear()
+
+    # Inserimento diretto di tuple già pronte (es. da KB.FactTables), senza parsing
+    def add_facts(self, pred, tuples):
+        self.relations.setdefault(pred, {}).update(dict.fromkeys(tuples))
+        self._fact_preds.add(pred)
+        self._materialized = False
+        self._indexes.clear()
+
+    # --- INDICI HASH ---
+    # (predicato, posizioni legate) -> {valori: {tupla: None}}; i gruppi sono
+    # insiemi ordinati così che aggiunte e rimozioni aggiornino gli indici sul posto
+    def _index(self, pred, positions):
+        key = (pred, positions)
+        idx = self._indexes.get(key)
+        if idx is None:
+            idx = {}
+            getter = _getter(positions)
+            for t in self.relations.get(pred, ()):
+                idx.setdefault(getter(t), {})[t] = None
+            self._indexes[key] = idx
+        return idx
+
+    def _index_add(self, pred, tuples):
+        for (p, positions), idx in self._indexes.items():
+            if p == pred:
+                getter = _getter(positions)
+                for t in tuples:
+                    idx.setdefault(getter(t), {})[t] = None
+
+    def _index_remove(self, pred, tuples):
+        for (p, positions), idx in self._indexes.items():
+            if p == pred:
+                getter = _getter(positions)
+                for t in tuples:
+                    k = getter(t)
+                    gruppo = idx.get(k)
+                    if gruppo is not None:
+                        gruppo.pop(t, None)
+                        if not gruppo:
+                            del idx[k]
+
+    def _join(self, body, first, first_rel):
+        # Si parte dall'atomo 'first' (il delta), poi si sceglie ogni volta
+        # l'atomo con più argomenti già legati (a parità, la relazione più piccola).
+        # Le variabili legate vivono in una tupla 'env' in ordine di slot.
+        relations = self.relations
+        slots = {}
+        pred, args = body[first]
+        match, new_vars = _compile_atom(args, slots)
+        getter = _getter([p for p, _ in new_vars])
+        envs = [getter(t) for t in first_rel if match is None or match(t)]
+
+        remaining = [a for i, a in enumerate(body) if i != first]
+        while remaining and envs:
+            remaining.sort(key=lambda a: (-sum(1 for x in a[1] if not is_variable(x) or x in slots),
+                                          len(relations.get(a[0], ()))))
+            pred, args = remaining.pop(0)
+            key_pos = [i for i, x in enumerate(args) if not is_variable(x) or x in slots]
+            key_of = _env_key([args[i] if not is_variable(args[i]) else slots[args[i]] for i in key_pos],
+                              [not is_variable(args[i]) for i in key_pos])
+            match, new_vars = _compile_atom([args[i] if i not in key_pos else '_' for i in range(len(args))], slots)
+            getter = _getter([p for p, _ in new_vars])
+            idx = self._index(pred, tuple(key_pos))
+            if match is None:
+                envs = [env + getter(t) for env in envs for t in idx.get(key_of(env), ())]
+            else:
+                envs = [env + getter(t) for env in envs for t in idx.get(key_of(env), ()) if match(t)]
+        return envs, slots
+
+    def materialize(self):
+        if self._materialized:
+            return self
+        self._indexes.clear()
+
+        # Strati in ordine di dipendenza: un predicato non ricorsivo viene
+        # derivato una volta sola, quando tutti i predicati del corpo sono completi
+        for rules, recursive in _strata(self.rules):
+            new = {}
+            for (head_pred, head_args), body in rules:
+                # Si parte dalla relazione più piccola del corpo
+                first = min(range(len(body)), key=lambda i: len(self.relations.get(body[i][0], ())))
+                self._derive(head_pred, head_args, body, first, self.relations.get(body[first][0], ()), new)
+            delta = self._merge(new)
+
+            # Semi-naive sulle sole componenti ricorsive: ogni giro usa i fatti appena derivati
+            heads = {head_pred for (head_pred, _), _ in rules}
+            while recursive and delta:
+                new = {}
+                for (head_pred, head_args), body in rules:
+                    for i, (pred, _) in enumerate(body):
+                        if pred in delta and pred in heads:
+                            self._derive(head_pred, head_args, body, i, delta[pred], new)
+                delta = self._merge(new)
+
+        self._materialized = True
+        return self
+
+    def _derive(self, head_pred, head_args, body, first, first_rel, new):
+        known = self.relations.get(head_pred, ())
+        envs, slots = self._join(body, first, first_rel)
+        if not envs:
+            return
+        head_of = _env_key([slots[a] if is_variable(a) else a for a in head_args],
+                           [not is_variable(a) for a in head_args])
+        out = new.setdefault(head_pred, {})
+        for env in envs:
+            t = head_of(env)
+            if t not in known:
+                out[t] = None
+        if not out:
+            del new[head_pred]
+
+    def _merge(self, new):
+        for pred, rel in new.items():
+            self.relations.setdefault(pred, {}).update(rel)
+            self._index_add(pred, rel)
+        return new
+
+    # --- AGGIORNAMENTO INCREMENTALE ---
+    # added / removed: predicato -> tuple di fatti di base da aggiungere / ritirare.
+    # Le chiavi toccate sono i primi argomenti delle tuple (es. i titoli). Se le
+    # regole sono locali alla chiave, cioè ogni atomo del corpo su un predicato
+    # aggiornato o derivato ha come primo argomento la variabile del primo
+    # argomento della testa, i fatti derivati di una chiave dipendono solo dai
+    # fatti della stessa chiave: si cancellano e si ricalcolano solo quelli.
+    # Altrimenti (o con regole ricorsive) si rimaterializza tutto.
+    def update(self, added=None, removed=None):
+        added = {p: list(ts) for p, ts in (added or {}).items()}
+        removed = {p: list(ts) for p, ts in (removed or {}).items()}
+        keys = {t[0] for ts in list(added.values()) + list(removed.values()) for t in ts}
+
+        for pred, tuples in removed.items():
+            rel = self.relations.get(pred, {})
+            for t in tuples:
+                rel.pop(t, None)
+            self._index_remove(pred, tuples)
+        for pred, tuples in added.items():
+            rel = self.relations.setdefault(pred, {})
+            nuove = [t for t in dict.fromkeys(tuples) if t not in rel]
+            rel.update(dict.fromkeys(nuove))
+            self._fact_preds.add(pred)
+            self._index_add(pred, nuove)
+        if not keys:
+            return set()
+
+        heads = {head_pred for (head_pred, _), _ in self.rules}
+        if heads & self._fact_preds:
+            raise ValueError("Aggiornamento incrementale non supportato: predicati derivati con fatti di base "
+                             f"({', '.join(sorted(heads & self._fact_preds))})")
+        if not self._materialized:
+            # Nessuna relazione derivata ancora calcolata: ci pensa materialize()
+            return keys
+        strata = _strata(self.rules)
+        if any(recursive for _, recursive in strata) or not _local_rules(self.rules, heads | set(added) | set(removed)):
+            for pred in heads:
+                self.relations.pop(pred, None)
+            for key in [k for k in self._indexes if k[0] in heads]:
+                del self._indexes[key]
+            self._materialized = False
+            self.materialize()
+            return keys
+
+        # Cancellazione dei fatti derivati delle chiavi toccate...
+        for pred in heads:
+            idx = self._index(pred, (0,))
+            vecchi = [t for k in keys for t in idx.get((k,), ())]
+            rel = self.relations.get(pred, {})
+            for t in vecchi:
+                rel.pop(t, None)
+            self._index_remove(pred, vecchi)
+        # ...e ricalcolo strato per strato, partendo dai fatti delle sole chiavi toccate
+        for rules, _ in strata:
+            new = {}
+            for (head_pred, head_args), body in rules:
+                first = next(i for i, (_, args) in enumerate(body) if args[0] == head_args[0])
+                idx = self._index(body[first][0], (0,))
+                seme = [t for k in keys for t in idx.get((k,), ())]
+                self._derive(head_pred, head_args, body, first, seme, new)
+            self._merge(new)
+        return keys
+
+    # --- QUERY ---
+    def query(self, expr, cut=False):
+        if isinstance(expr, str):
+            pred, args = parse_atom(expr)
+        else:
+            pred, args = expr.predicate, tuple(t.strip() for t in expr.terms)
+        if not self._materialized:
+            with instrumentation.stage("kb.materialize"):
+                self.materialize()
+        with instrumentation.stage(f"kb.query.{pred}"):
+            return self._query(pred, args, cut)
+
+    def _query(self, pred, args, cut):
+
+        positions = tuple(i for i, x in enumerate(args) if not is_variable(x))
+        if positions:
+            candidates = self._index(pred, positions).get(tuple(args[i] for i in positions), ())
+        else:
+            candidates = self.relations.get(pred, ())
+
+        answer = []
+        visti = set()
+        for t in candidates:
+            env = _unify(args, t, {})
+            if env is None:
+                continue
+            if not env:
+                return ['Yes']
+            key = tuple(env.items())
+            if key not in visti:
+                visti.add(key)
+                answer.append(env)
+                if cut:
+                    break
+        return answer if answer else ['No']
+
+    def clear_cache(self):
+        self._indexes.clear()
+
+
+# --- PIANI DI JOIN COMPILATI ---
+def _getter(positions):
+    positions = tuple(positions)
+    if not positions:
+        return lambda t: ()
+    if len(positions) == 1:
+        p = positions[0]
+        return lambda t: (t[p],)
+    return itemgetter(*positions)
+
+
+# Chiave (o tupla di testa) da un env: slot delle variabili legate oppure costanti
+def _env_key(parts, is_const):
+    if not any(is_const):
+        return _getter(parts)
+    return lambda env: tuple(p if c else env[p] for p, c in zip(parts, is_const))
+
+
+# Restituisce (filtro sulle tuple, variabili nuove) e registra gli slot delle variabili nuove.
+# Gli argomenti già usati come chiave di join vanno passati come '_'.
+def _compile_atom(args, slots):
+    checks = []
+    new_vars = []
+    first_pos = {}
+    for i, a in enumerate(args):
+        if a == '_':
+            continue
+        if not is_variable(a):
+            checks.append((i, a, True))
+        elif a in first_pos:
+            checks.append((i, first_pos[a], False))
+        elif a in slots:
+            continue
+        else:
+            first_pos[a] = i
+            new_vars.append((i, a))
+    for _, a in new_vars:
+        slots[a] = len(slots)
+    # Le relazioni hanno arità fissa per predicato: il filtro serve solo per costanti e variabili ripetute
+    if not checks:
+        return None, new_vars
+    return (lambda t: all(t[i] == (v if c else t[v]) for i, v, c in checks)), new_vars
+
+
+# Componenti fortemente connesse (Tarjan) del grafo testa -> predicati del corpo,
+# restituite in ordine topologico: prima gli strati da cui gli altri dipendono
+def _strata(rules):
+    by_head = {}
+    for rule in rules:
+        by_head.setdefault(rule[0][0], []).append(rule)
+    deps = {h: {p for (_, _), body in rs for p, _ in body if p in by_head} for h, rs in by_head.items()}
+
+    index, low, stack, on_stack, out = {}, {}, [], set(), []
+
+    def visit(v):
+        index[v] = low[v] = len(index)
+        stack.append(v)
+        on_stack.add(v)
+        for w in deps[v]:
+            if w not in index:
+                visit(w)
+                low[v] = min(low[v], low[w])
+            elif w in on_stack:
+                low[v] = min(low[v], index[w])
+        if low[v] == index[v]:
+            component = []
+            while True:
+                w = stack.pop()
+                on_stack.discard(w)
+                component.append(w)
+                if w == v:
+                    break
+            recursive = len(component) > 1 or v in deps[v]
+            out.append(([r for h in component for r in by_head[h]], recursive))
+
+    for v in by_head:
+        if v not in index:
+            visit(v)
+    return out
+
+
+# Ogni regola ha una variabile come primo argomento della testa, e ogni atomo
+# del corpo su un predicato "per chiave" (aggiornato o derivato) la usa come
+# primo argomento
+def _local_rules(rules, keyed):
+    for (_, head_args), body in rules:
+        var = head_args[0] if head_args else None
+        if var is None or not is_variable(var):
+            return False
+        if not any(args[0] == var for _, args in body):
+            return False
+        if any(pred in keyed and args[0] != var for pred, args in body):
+            return False
+    return True
+
+
+def _unify(args, values, env):
+    if len(args) != len(values):
+        return None
+    out = dict(env)
+    for a, v in zip(args, values):
+        if is_variable(a):
+            if a == '_':
+                continue
+            if out.setdefault(a, v) != v:
+                return None
+        elif a != v:
+            return None
+    return out
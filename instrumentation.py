@@ -0,0 +1,250 @@
+import atexit
+import builtins
+import contextlib
+import importlib.util
+import json
+import os
+import sys
+import threading
+import time
+
+# --- STRUMENTAZIONE DEI PERCORSI CRITICI ---
+# Profilatore opzionale per capire dove va il tempo di un menu:
+#   - fasi (stage): chiamate, tempo totale e massimo (KB.populate_kb, Main.main, CSP)
+#   - consultazioni della KB per predicato (indice dei predicati e query datalog)
+#   - statistiche della ricerca sommate per solver (nodi, backtrack, verifiche di
+#     consistenza, scarti per vincolo) e chiamate dei vincoli di python-constraint
+# Disattivato per default: stage() restituisce un contesto vuoto condiviso e
+# counted() la funzione originale, così il costo è un controllo di flag.
+# Si attiva con enable() oppure con MENU_PROFILE=report.json nell'ambiente
+# (il report JSON viene scritto all'uscita del processo).
+# trace_imports() misura anche i tempi di import, come python -X importtime.
+
+ENV_VAR = 'MENU_PROFILE'
+REPORT_VERSION = 1
+_NULL = contextlib.nullcontext()
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # nome -> [chiamate, secondi totali, secondi massimi]
+            self.stages = {}
+            self.counters = {}
+            # solver -> statistiche sommate di menu_solver.SolverStats
+            self.search = {}
+            # moduli importati (trace_imports): nome, tempo proprio e cumulativo, profondità
+            self.imports = []
+            self.started = time.perf_counter()
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            voce = self.stages.get(name)
+            if voce is None:
+                self.stages[name] = [1, seconds, seconds]
+            else:
+                voce[0] += 1
+                voce[1] += seconds
+                if seconds > voce[2]:
+                    voce[2] = seconds
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def record_search(self, name, stats):
+        with self._lock:
+            voce = self.search.setdefault(name, {'runs': 0, 'status': {}, 'nodes': 0, 'backtracks': 0,
+                                                 'checks': 0, 'seconds': 0.0, 'rejections': {}})
+            voce['runs'] += 1
+            voce['status'][stats.status] = voce['status'].get(stats.status, 0) + 1
+            voce['nodes'] += stats.nodes
+            voce['backtracks'] += stats.backtracks
+            voce['checks'] += stats.checks
+            voce['seconds'] += stats.elapsed
+            for vincolo, n in stats.rejections.items():
+                voce['rejections'][vincolo] = voce['rejections'].get(vincolo, 0) + n
+
+    def add_import(self, name, self_s, cumulative_s, depth):
+        with self._lock:
+            self.imports.append({'module': name, 'self_ms': round(self_s * 1000, 3),
+                                 'cumulative_ms': round(cumulative_s * 1000, 3), 'depth': depth})
+
+    def report(self):
+        with self._lock:
+            stages = [{'stage': nome, 'calls': chiamate, 'seconds': round(totale, 6),
+                       'mean_ms': round(totale / chiamate * 1000, 3), 'max_ms': round(massimo * 1000, 3)}
+                      for nome, (chiamate, totale, massimo) in self.stages.items()]
+            stages.sort(key=lambda s: -s['seconds'])
+            return {'version': REPORT_VERSION, 'pid': os.getpid(), 'argv': sys.argv,
+                    'wall_seconds': round(time.perf_counter() - self.started, 6),
+                    'stages': stages, 'counters': dict(sorted(self.counters.items())),
+                    'search': {nome: {**voce, 'status': dict(voce['status']), 'rejections': dict(voce['rejections'])}
+                               for nome, voce in self.search.items()},
+                    'imports': list(self.imports)}
+
+    def write(self, path=None):
+        path = path or self.path
+        tmp = path + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+        os.replace(tmp, path)
+        return path
+
+
+class _Stage:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+PROFILER = Profiler()
+
+
+def enabled():
+    return PROFILER.enabled
+
+
+# path: file del report, scritto all'uscita del processo (None: solo report()/write())
+def enable(path=None, reset=True):
+    if reset:
+        PROFILER.reset()
+    PROFILER.enabled = True
+    if path and PROFILER.path is None:
+        atexit.register(_write_at_exit)
+    PROFILER.path = path or PROFILER.path
+
+
+def disable():
+    PROFILER.enabled = False
+
+
+def _write_at_exit():
+    if PROFILER.path:
+        try:
+            print(f"Report di profilazione salvato in {PROFILER.write()}", file=sys.stderr)
+        except OSError as e:
+            print(f"[!] Report di profilazione non salvato: {e}", file=sys.stderr)
+
+
+# with stage('csp.search'): ...
+def stage(name):
+    return _Stage(PROFILER, name) if PROFILER.enabled else _NULL
+
+
+def count(name, n=1):
+    if PROFILER.enabled:
+        PROFILER.count(name, n)
+
+
+def record_search(name, stats):
+    if PROFILER.enabled:
+        PROFILER.record_search(name, stats)
+
+
+# Vincolo di python-constraint con conteggio delle chiamate e dei rifiuti
+# (constraint.<nome>.calls / .rejected, nome di default: func.__name__);
+# a profilatore spento resta la funzione originale
+def counted(func, name=None):
+    if not PROFILER.enabled:
+        return func
+    name = name or func.__name__
+    chiamate, rifiuti = f"constraint.{name}.calls", f"constraint.{name}.rejected"
+
+    def contato(*args):
+        esito = func(*args)
+        PROFILER.count(chiamate)
+        if not esito:
+            PROFILER.count(rifiuti)
+        return esito
+    contato.__name__ = name
+    return contato
+
+
+# --- TEMPI DI IMPORT ---
+# Sostituisce builtins.__import__: ogni modulo non ancora in sys.modules viene
+# registrato con il tempo proprio e quello cumulativo (compresi i moduli che
+# importa), nell'ordine in cui finisce di caricarsi, come -X importtime.
+# I sottomoduli caricati da 'from pacchetto import modulo' finiscono nel tempo del pacchetto.
+_import_originale = None
+_pila_import = threading.local()
+
+
+def trace_imports():
+    global _import_originale
+    if _import_originale is not None:
+        return
+    _import_originale = originale = builtins.__import__
+
+    def importa(name, globals=None, locals=None, fromlist=(), level=0):
+        nome = name
+        if level:
+            try:
+                nome = importlib.util.resolve_name('.' * level + name, (globals or {}).get('__package__') or '')
+            except (ImportError, ValueError):
+                pass
+        if nome in sys.modules:
+            return originale(name, globals, locals, fromlist, level)
+        pila = _pila_import.__dict__.setdefault('figli', [])
+        pila.append(0.0)
+        start = time.perf_counter()
+        try:
+            return originale(name, globals, locals, fromlist, level)
+        finally:
+            cumulativo = time.perf_counter() - start
+            figli = pila.pop()
+            if pila:
+                pila[-1] += cumulativo
+            PROFILER.add_import(nome, cumulativo - figli, cumulativo, len(pila))
+
+    builtins.__import__ = importa
+
+
+def untrace_imports():
+    global _import_originale
+    if _import_originale is not None:
+        builtins.__import__ = _import_originale
+        _import_originale = None
+
+
+HEAVY_MODULES = ['pandas', 'sklearn', 'scipy', 'joblib', 'pytholog', 'constraint']
+
+
+def print_imports(top=15, file=None):
+    file = file or sys.stderr
+    imports = PROFILER.report()['imports']
+    radici = sorted((i for i in imports if i['depth'] == 0), key=lambda i: -i['cumulative_ms'])
+    print(f"\n--- TEMPI DI IMPORT ({len(imports)} moduli, "
+          f"{sum(i['cumulative_ms'] for i in radici):.1f} ms) ---", file=file)
+    for i in radici[:top]:
+        print(f"  {i['module']:32} {i['cumulative_ms']:9.1f} ms  (proprio {i['self_ms']:.1f} ms)", file=file)
+    pesanti = [m for m in HEAVY_MODULES if m in sys.modules]
+    print(f"  moduli pesanti caricati: {', '.join(pesanti) or 'nessuno'}", file=file)
+
+
+def report():
+    return PROFILER.report()
+
+
+def write(path):
+    return PROFILER.write(path)
+
+
+if os.environ.get(ENV_VAR):
+    enable(os.environ[ENV_VAR])
@@ -0,0 +1,192 @@
+import re
+import numpy as np
+import KB
+import instrumentation
+
+# --- INDICE MATERIALIZZATO DEI PREDICATI ---
+# Le regole di KB.domain_knowledge() sono Datalog non ricorsivo su un solo
+# argomento (la ricetta): ogni predicato derivato si riduce quindi a una
+# colonna booleana indicizzata per id ricetta. L'id è quello del titolo
+# (i titoli duplicati nel dataset sono lo stesso atomo Prolog), così i
+# risultati coincidono con quelli di kb.query sugli stessi fatti.
+
+RULE_RE = re.compile(r'^\s*(\w+)\((\w+)\)\s*:-\s*(.+)$')
+ATOM_RE = re.compile(r'(\w+)\(([^()]*)\)')
+FACT_RE = re.compile(r'^\s*(\w+)\((\w+)\)\s*$')
+
+
+def _is_var(term):
+    return term[:1].isupper() or term[:1] == '_'
+
+
+class PredicateIndex:
+    def __init__(self, titles, columns):
+        # titles[i] = titolo della ricetta con id i
+        self.titles = titles
+        self.ids = {t: i for i, t in enumerate(titles)}
+        # predicato -> np.ndarray(bool) di lunghezza len(titles)
+        self.columns = columns
+        self._sets = {}
+
+    def __len__(self):
+        return len(self.titles)
+
+    @property
+    def predicates(self):
+        return list(self.columns)
+
+    # Consultazioni della KB: contate e cronometrate per predicato (instrumentation)
+    def mask(self, predicate):
+        with instrumentation.stage(f"kb.{predicate}"):
+            return self.columns[predicate]
+
+    def holds(self, predicate, title):
+        i = self.ids.get(title)
+        return i is not None and bool(self.columns[predicate][i])
+
+    # Insieme dei titoli che soddisfano il predicato: lookup O(1) nei vincoli del CSP
+    def title_set(self, predicate):
+        with instrumentation.stage(f"kb.{predicate}"):
+            s = self._sets.get(predicate)
+            if s is None:
+                s = frozenset(self.titles[self.columns[predicate]].tolist())
+                self._sets[predicate] = s
+            return s
+
+    # Id per ogni titolo (es. una colonna del dataframe), -1 se sconosciuto
+    def ids_of(self, titles):
+        return np.fromiter((self.ids.get(t, -1) for t in titles), dtype=np.int64, count=len(titles))
+
+    # Dopo KB.add_recipes / retract_recipes: colonne ricalcolate per i soli titoli
+    # toccati, a partire dalle loro righe nelle tabelle dei fatti aggiornate.
+    # I titoli nuovi prendono id in coda; quelli ritirati tengono l'id con tutte
+    # le colonne a False. Le colonne mappate dallo snapshot vengono copiate.
+    def update(self, facts, titles):
+        titles = list(dict.fromkeys(titles))
+        parziale = build_predicate_index(None, facts=facts.subset(titles))
+        nuovi = [t for t in titles if t not in self.ids]
+        if nuovi:
+            self.titles = np.concatenate([self.titles, np.array(nuovi, dtype=object)])
+            for t in nuovi:
+                self.ids[t] = len(self.ids)
+        n = len(self.titles)
+        ids = self.ids_of(titles)
+        ids_parziali = parziale.ids_of(titles)
+        presenti = ids_parziali >= 0
+        for predicate in list(dict.fromkeys(list(self.columns) + list(parziale.columns))):
+            colonna = self.columns.get(predicate)
+            if colonna is None or len(colonna) < n or not colonna.flags.writeable:
+                estesa = np.zeros(n, dtype=bool)
+                if colonna is not None:
+                    estesa[:len(colonna)] = colonna
+                colonna = estesa
+            colonna[ids] = False
+            if predicate in parziale.columns:
+                colonna[ids[presenti]] = parziale.columns[predicate][ids_parziali[presenti]]
+            self.columns[predicate] = colonna
+        self._sets.clear()
+        return self
+
+
+def _parse_domain_knowledge(kb_list):
+    categories = {}
+    rules = []
+    for entry in kb_list:
+        m = RULE_RE.match(entry)
+        if m:
+            head, var, body = m.groups()
+            atoms = [(p, [a.strip() for a in args.split(',')]) for p, args in ATOM_RE.findall(body)]
+            rules.append((head, var, atoms))
+            continue
+        m = FACT_RE.match(entry)
+        if m:
+            categories.setdefault(m.group(1), set()).add(m.group(2))
+    return categories, rules
+
+
+# Per ogni id ricetta, indica se almeno un suo ingrediente appartiene alla categoria
+def _ingredient_masks(facts, n_titles, categories):
+    import pandas as pd
+    row_codes = facts.title_codes[facts.contains_rows]
+    masks = {}
+    for category, items in categories.items():
+        # Filtro sul vocabolario (pochi elementi), poi lookup per codice ingrediente
+        in_category = pd.Index(facts.vocabulary).isin(list(items))
+        hit = in_category[facts.contains_ings]
+        mask = np.zeros(n_titles, dtype=bool)
+        mask[row_codes[hit]] = True
+        masks[category] = mask
+    return masks
+
+
+def build_predicate_index(df, kb_list=None, facts=None):
+    if kb_list is None:
+        kb_list = KB.domain_knowledge()
+    if facts is None:
+        facts = KB.build_fact_tables(df)
+
+    codes = facts.title_codes
+    titles = facts.titles
+    n_titles = len(titles)
+
+    categories, rules = _parse_domain_knowledge(kb_list)
+    ingredient_masks = _ingredient_masks(facts, n_titles, categories)
+
+    # Fatti di base con costante, es. is_veg(R, yes): vero se almeno una riga del titolo lo dichiara
+    base_cache = {}
+
+    def base_mask(predicate, value):
+        key = (predicate, value)
+        if key not in base_cache:
+            v_codes, uniques = facts.values[predicate]
+            mask = np.zeros(n_titles, dtype=bool)
+            matching = np.flatnonzero(np.array([str(u) == value for u in uniques], dtype=bool))
+            mask[codes[np.isin(v_codes, matching)]] = True
+            base_cache[key] = mask
+        return base_cache[key]
+
+    columns = {}
+    for predicate in KB.FACT_COLUMNS:
+        if predicate != 'taste':
+            columns[predicate] = base_mask(predicate, 'yes')
+
+    # Valutazione delle regole in ordine di dipendenza (più regole sulla stessa testa = OR)
+    pending = {}
+    for head, var, atoms in rules:
+        pending.setdefault(head, []).append((var, atoms))
+
+    def body_mask(var, atoms):
+        mask = np.ones(n_titles, dtype=bool)
+        if sum(1 for _, args in atoms if len(args) == 1 and args[0] != var) > 1:
+            raise ValueError(f"Regola non supportata dall'indice: {atoms}")
+        for predicate, args in atoms:
+            if predicate == 'contains':
+                continue
+            if len(args) == 1 and args[0] == var:
+                # Predicato derivato sulla ricetta
+                mask &= derive(predicate)
+            elif len(args) == 1 and _is_var(args[0]):
+                # Categoria dell'ingrediente legata da contains(R, I)
+                mask &= ingredient_masks.get(predicate, np.zeros(n_titles, dtype=bool))
+            elif len(args) == 2 and args[0] == var and not _is_var(args[1]):
+                mask &= base_mask(predicate, args[1])
+            else:
+                raise ValueError(f"Regola non supportata dall'indice: {predicate}({', '.join(args)})")
+        return mask
+
+    def derive(predicate):
+        if predicate in columns:
+            return columns[predicate]
+        if predicate not in pending:
+            # Predicato senza fatti né regole: in Prolog nessuna soluzione
+            return np.zeros(n_titles, dtype=bool)
+        mask = np.zeros(n_titles, dtype=bool)
+        for var, atoms in pending[predicate]:
+            mask |= body_mask(var, atoms)
+        columns[predicate] = mask
+        return mask
+
+    for head in pending:
+        derive(head)
+
+    return PredicateIndex(titles, columns)
@@ -0,0 +1,339 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing as mp
+import signal
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+import kb_index
+import kb_snapshot
+from recipe_store import RecipeStore, encode_strings, decode_strings, uniques_to_json, uniques_from_json
+
+# --- KB CONDIVISA IN MEMORIA TRA PIÙ PROCESSI ---
+# Il server carica una volta lo snapshot (archivio delle ricette + indice dei
+# predicati materializzato) e copia tutti gli array in un unico segmento
+# multiprocessing.shared_memory:
+#   [lunghezza dell'intestazione: 8 byte][intestazione JSON][array allineati a 64 byte]
+# L'intestazione descrive layout e valori distinti dell'archivio, i predicati
+# e la posizione di ogni array (offset, dtype, shape). Un client si collega con
+# il solo nome del segmento e costruisce RecipeStore e PredicateIndex come viste
+# in sola lettura sul segmento: le pagine sono le stesse per tutti i processi,
+# quindi la memoria non cresce con i worker. Per ogni client restano solo
+# titoli e vocabolario decodificati (servono come stringhe ai domini del CSP).
+#
+#   python kb_server.py serve --name menu_kb      (resta attivo fino a Ctrl-C / SIGTERM)
+#   python kb_server.py info --name menu_kb
+#   python kb_server.py bench --name menu_kb -w 1 2 4
+#
+# batch_menu e menu_service accettano --kb-shm NOME per usare il segmento invece dello snapshot.
+
+SHM_VERSION = 1
+DEFAULT_NAME = "menu_kb"
+ALLINEAMENTO = 64
+
+
+def _allinea(n):
+    return -(-n // ALLINEAMENTO) * ALLINEAMENTO
+
+
+def _store_arrays(store):
+    arrays = {'title_codes': store.title_codes, 'indptr': store.indptr, 'indices': store.indices}
+    for nome, (codes, _) in store.categorical.items():
+        arrays[f"category.{nome}"] = codes
+    for nome, valori in store.numeric.items():
+        arrays[f"numeric.{nome}"] = valori
+    for nome, (data, offsets) in store.texts.items():
+        arrays[f"text.{nome}.data"], arrays[f"text.{nome}.offsets"] = data, offsets
+    arrays['titles.data'], arrays['titles.offsets'] = encode_strings(store.titles.tolist())
+    arrays['vocabulary.data'], arrays['vocabulary.offsets'] = encode_strings(store.vocabulary.tolist())
+    return arrays
+
+
+def _index_arrays(store, index):
+    predicates = index.predicates
+    arrays = {'index.columns': np.vstack([index.mask(p) for p in predicates]) if predicates
+              else np.zeros((0, len(index)), dtype=bool)}
+    # Di norma l'indice usa gli stessi titoli (stesso ordine) dell'archivio
+    if not (len(index.titles) == len(store.titles) and np.array_equal(index.titles, store.titles)):
+        arrays['index.titles.data'], arrays['index.titles.offsets'] = encode_strings(index.titles.tolist())
+    return arrays, predicates
+
+
+# --- SERVER ---
+class KBServer:
+    def __init__(self, data=None, name=DEFAULT_NAME, csv_path="recipes_extended.csv", limit=30000,
+                 directory=kb_snapshot.SNAPSHOT_DIR):
+        self.data = data
+        self.name = name
+        self.csv_path = csv_path
+        self.limit = limit
+        self.directory = directory
+        self.shm = None
+
+    def publish(self):
+        if self.data is None:
+            self.data = kb_snapshot.load_or_build(self.csv_path, self.limit, self.directory, as_store=True)
+            if self.data is None:
+                raise RuntimeError("KB non disponibile")
+        store, index = self.data
+        arrays = _store_arrays(store)
+        index_arrays, predicates = _index_arrays(store, index)
+        arrays.update(index_arrays)
+
+        posizioni, offset = {}, 0
+        for nome, a in arrays.items():
+            posizioni[nome] = [offset, a.dtype.str, list(a.shape)]
+            offset = _allinea(offset + a.nbytes)
+        header = json.dumps({
+            'version': SHM_VERSION, 'csv_path': self.csv_path, 'limit': self.limit,
+            'layout': store.layout,
+            'uniques': {nome: uniques_to_json(valori) for nome, (_, valori) in store.categorical.items()},
+            'predicates': predicates, 'arrays': posizioni,
+        }).encode('utf-8')
+        inizio = _allinea(8 + len(header))
+
+        self.shm = shared_memory.SharedMemory(name=self.name, create=True, size=max(1, inizio + offset))
+        self.shm.buf[:8] = len(header).to_bytes(8, 'little')
+        self.shm.buf[8:8 + len(header)] = header
+        for nome, a in arrays.items():
+            start = inizio + posizioni[nome][0]
+            self.shm.buf[start:start + a.nbytes] = np.ascontiguousarray(a).view(np.uint8).reshape(-1)
+        return self.name
+
+    @property
+    def nbytes(self):
+        return self.shm.size if self.shm is not None else 0
+
+    def close(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def __enter__(self):
+        self.publish()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# --- CLIENT (sola lettura) ---
+class KBClient:
+    def __init__(self, name=DEFAULT_NAME):
+        start = time.perf_counter()
+        self.name = name
+        self.shm = shared_memory.SharedMemory(name=name)
+        # Il segmento appartiene al server: senza questo, all'uscita del client il
+        # resource_tracker lo rimuoverebbe (Python < 3.13 non ha track=False)
+        with contextlib.suppress(Exception):
+            resource_tracker.unregister(self.shm._name, 'shared_memory')
+        n = int.from_bytes(self.shm.buf[:8], 'little')
+        meta = json.loads(bytes(self.shm.buf[8:8 + n]).decode('utf-8'))
+        if meta.get('version') != SHM_VERSION:
+            self.shm.close()
+            raise ValueError(f"Segmento '{name}' di versione {meta.get('version')}, attesa {SHM_VERSION}")
+        self.meta = meta
+        inizio = _allinea(8 + n)
+
+        def vista(nome):
+            offset, dtype, shape = meta['arrays'][nome]
+            a = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=self.shm.buf, offset=inizio + offset)
+            a.flags.writeable = False
+            return a
+
+        layout = [tuple(x) for x in meta['layout']]
+        categorical, numeric, texts = {}, {}, {}
+        for nome, tipo in layout:
+            if tipo == 'category':
+                categorical[nome] = (vista(f"category.{nome}"), uniques_from_json(meta['uniques'][nome]))
+            elif tipo == 'numeric':
+                numeric[nome] = vista(f"numeric.{nome}")
+            elif tipo == 'text':
+                texts[nome] = (vista(f"text.{nome}.data"), vista(f"text.{nome}.offsets"))
+        titles = np.array(decode_strings(vista('titles.data'), vista('titles.offsets')), dtype=object)
+        self.store = RecipeStore(layout, titles, vista('title_codes'), categorical, numeric, texts,
+                                 np.array(decode_strings(vista('vocabulary.data'), vista('vocabulary.offsets')),
+                                          dtype=object),
+                                 vista('indptr'), vista('indices'))
+
+        if 'index.titles.data' in meta['arrays']:
+            titles = np.array(decode_strings(vista('index.titles.data'), vista('index.titles.offsets')),
+                              dtype=object)
+        matrix = vista('index.columns')
+        self.index = kb_index.PredicateIndex(titles, {p: matrix[i] for i, p in enumerate(meta['predicates'])})
+        self.attach_seconds = time.perf_counter() - start
+
+    # (archivio, indice): come kb_snapshot.load_or_build(..., as_store=True)
+    @property
+    def data(self):
+        return self.store, self.index
+
+    @property
+    def predicates(self):
+        return self.index.predicates
+
+    # Titoli che soddisfano il predicato: i valori di X in kb.query(pl.Expr(f"{predicate}(X)"))
+    def query(self, predicate):
+        if predicate not in self.index.columns:
+            return []
+        return self.index.titles[self.index.mask(predicate)].tolist()
+
+    def holds(self, predicate, title):
+        return predicate in self.index.columns and self.index.holds(predicate, title)
+
+    def title_set(self, predicate):
+        return self.index.title_set(predicate)
+
+    def close(self):
+        # Le viste su shm.buf devono essere già state rilasciate
+        self.store = self.index = None
+        with contextlib.suppress(BufferError):
+            self.shm.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Un client per segmento e per processo: le viste sull'archivio restano valide
+# finché il processo vive, anche se il chiamante tiene solo (archivio, indice)
+_CLIENTS = {}
+
+
+def attach(name=DEFAULT_NAME):
+    client = _CLIENTS.get(name)
+    if client is None or client.store is None:
+        client = _CLIENTS[name] = KBClient(name)
+    return client
+
+
+# --- MISURE: memoria e tempo di collegamento per worker ---
+def _memoria():
+    # kB da /proc/self/smaps_rollup (Linux): Rss, Pss, memoria privata
+    valori = {}
+    try:
+        with open('/proc/self/smaps_rollup', 'r') as f:
+            for riga in f:
+                parti = riga.split()
+                if parti and parti[0] in ('Rss:', 'Pss:', 'Private_Clean:', 'Private_Dirty:'):
+                    valori[parti[0][:-1]] = int(parti[1])
+    except OSError:
+        return {}
+    return {'rss_kb': valori.get('Rss'), 'pss_kb': valori.get('Pss'),
+            'private_kb': valori.get('Private_Clean', 0) + valori.get('Private_Dirty', 0)}
+
+
+def _bench_worker(modo, name, csv_path, limit, directory, risultati, pronto, via):
+    import CSP
+    start = time.perf_counter()
+    if modo == 'shm':
+        client = KBClient(name)
+        store, index = client.data
+    else:
+        with contextlib.redirect_stdout(io.StringIO()):
+            store, index = kb_snapshot.load_or_build(csv_path, limit, directory, as_store=True)
+    attach_ms = (time.perf_counter() - start) * 1000
+    profilo = {'bmi': 22.0, 'sport': False, 'intolleranze': {'lattosio': False, 'noci': False, 'glutine': False}}
+    with contextlib.redirect_stdout(io.StringIO()):
+        menu = CSP.solve_menu_csp(None, profilo, 'savory', store, index, seed=0)
+    risultati.put({'attach_ms': round(attach_ms, 3), 'ok': menu is not None, **_memoria()})
+    # Tutti i worker restano vivi finché non sono stati misurati tutti
+    pronto.release()
+    via.wait()
+
+
+def bench(name, workers, csv_path="recipes_extended.csv", limit=30000, directory=kb_snapshot.SNAPSHOT_DIR):
+    ctx = mp.get_context('spawn')
+    righe = []
+    for modo in ('snapshot', 'shm'):
+        for n in workers:
+            risultati, pronto, via = ctx.Queue(), ctx.Semaphore(0), ctx.Event()
+            processi = [ctx.Process(target=_bench_worker,
+                                    args=(modo, name, csv_path, limit, directory, risultati, pronto, via))
+                        for _ in range(n)]
+            for p in processi:
+                p.start()
+            misure = [risultati.get() for _ in processi]
+            for _ in processi:
+                pronto.acquire()
+            via.set()
+            for p in processi:
+                p.join()
+            righe.append({'mode': modo, 'workers': n,
+                          'attach_ms_mean': round(float(np.mean([m['attach_ms'] for m in misure])), 3),
+                          'pss_kb_total': sum(m.get('pss_kb') or 0 for m in misure),
+                          'private_kb_mean': round(float(np.mean([m.get('private_kb') or 0 for m in misure]))),
+                          'ok': all(m['ok'] for m in misure)})
+    return righe
+
+
+def print_bench(righe):
+    print(f"  {'modo':9} {'worker':>6} {'attach ms':>10} {'PSS tot MB':>11} {'privata MB':>11}  menu")
+    for r in righe:
+        print(f"  {r['mode']:9} {r['workers']:6} {r['attach_ms_mean']:10.1f} {r['pss_kb_total'] / 1024:11.1f} "
+              f"{r['private_kb_mean'] / 1024:11.1f}  {'ok' if r['ok'] else 'NO'}")
+
+
+# --- MAIN ---
+def serve(args):
+    server = KBServer(name=args.name, csv_path=args.csv, limit=args.limit, directory=args.directory)
+    # SIGTERM come Ctrl-C: il segmento viene comunque rimosso
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.publish()
+        store, index = server.data
+        print(f"KB condivisa '{server.name}': {len(store)} ricette, {len(index.predicates)} predicati, "
+              f"{server.nbytes / 1e6:.1f} MB (Ctrl-C per terminare)", flush=True)
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        print(f"KB condivisa '{server.name}' rimossa")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="KB in memoria condivisa per più processi")
+    parser.add_argument('comando', choices=['serve', 'info', 'bench'])
+    parser.add_argument('--name', default=DEFAULT_NAME, help="nome del segmento di memoria condivisa")
+    parser.add_argument('--csv', default="recipes_extended.csv")
+    parser.add_argument('--limit', type=int, default=30000)
+    parser.add_argument('--directory', default=kb_snapshot.SNAPSHOT_DIR)
+    parser.add_argument('-w', '--workers', type=int, nargs='+', default=[1, 2, 4],
+                        help="numero di worker per le misure di bench")
+    parser.add_argument('--report', default=None, help="salva le misure di bench in JSON")
+    args = parser.parse_args(argv)
+
+    if args.comando == 'serve':
+        return serve(args)
+    try:
+        client = KBClient(args.name)
+    except FileNotFoundError:
+        print(f"[ERRORE] Segmento '{args.name}' non trovato: avviare prima 'kb_server.py serve'.")
+        return 1
+    if args.comando == 'info':
+        store, index = client.data
+        print(f"KB condivisa '{client.name}': {len(store)} ricette, {len(index)} titoli, "
+              f"{len(index.predicates)} predicati, {client.shm.size / 1e6:.1f} MB, "
+              f"collegamento in {client.attach_seconds * 1000:.1f} ms")
+        client.close()
+        return 0
+    client.close()
+    righe = bench(args.name, args.workers, args.csv, args.limit, args.directory)
+    print_bench(righe)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(righe, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,201 @@
+import hashlib
+import itertools
+import json
+import os
+import numpy as np
+import KB
+import kb_index
+from recipe_store import RecipeStore, save_strings, load_strings
+
+# --- SNAPSHOT COMPILATO DELLA KB ---
+# Salva su disco il dataframe già pulito (come recipe_store.RecipeStore: codici
+# interi, postings degli ingredienti e buffer UTF-8 per i testi) e l'indice dei
+# predicati già materializzato, in array NumPy (.npy, caricabili con mmap_mode='r').
+# Il manifest registra l'hash del CSV sorgente e delle regole: se uno dei due
+# cambia lo snapshot viene ignorato. Con as_store=True si ottiene l'archivio
+# invece del dataframe, senza ricostruire le colonne di stringhe.
+#
+# Ricette aggiunte o ritirate (Main.py kb add|retract) non riscrivono gli array:
+# ogni modifica è un record del registro updates.delta (come kb_data.pkl.delta),
+# applicato all'archivio e all'indice al caricamento. Il manifest conta i record
+# già inclusi negli array (updates_applied); compact li riscrive con tutte le
+# modifiche. Il registro sopravvive alla ricostruzione dal CSV, che lo riapplica.
+
+SNAPSHOT_VERSION = 2
+SNAPSHOT_DIR = "kb_snapshot"
+MANIFEST = "manifest.json"
+UPDATES = "updates.delta"
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def rules_sha256():
+    h = hashlib.sha256()
+    h.update(json.dumps(KB.FACT_COLUMNS, sort_keys=True).encode())
+    for entry in KB.domain_knowledge():
+        h.update(entry.encode())
+        h.update(b'\n')
+    return h.hexdigest()
+
+
+# --- VALIDITÀ ---
+def _csv_state(csv_path):
+    st = os.stat(csv_path)
+    return {'csv_size': st.st_size, 'csv_mtime_ns': st.st_mtime_ns}
+
+
+def _read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def is_valid(manifest, csv_path, limit):
+    if manifest is None or manifest.get('version') != SNAPSHOT_VERSION:
+        return False
+    if manifest.get('limit') != limit or manifest.get('rules_sha256') != rules_sha256():
+        return False
+    if not os.path.exists(csv_path):
+        return False
+    # Stesse dimensioni e data di modifica: non serve rileggere il CSV
+    state = _csv_state(csv_path)
+    if all(manifest.get(k) == v for k, v in state.items()):
+        return True
+    return manifest.get('csv_sha256') == file_sha256(csv_path)
+
+
+# --- SALVATAGGIO / CARICAMENTO ---
+def save_snapshot(df, index, csv_path="recipes_extended.csv", limit=30000, directory=SNAPSHOT_DIR,
+                  updates_applied=0):
+    os.makedirs(directory, exist_ok=True)
+    store = df if isinstance(df, RecipeStore) else RecipeStore.from_dataframe(df)
+    store.save(directory)
+
+    save_strings(directory, "index.titles", index.titles.tolist())
+    predicates = index.predicates
+    matrix = np.vstack([index.mask(p) for p in predicates]) if predicates else np.zeros((0, len(index)), dtype=bool)
+    np.save(os.path.join(directory, "index.columns.npy"), matrix)
+
+    manifest = {
+        'version': SNAPSHOT_VERSION,
+        'limit': limit,
+        'rows': len(store),
+        'columns': store.columns,
+        'predicates': predicates,
+        'rules_sha256': rules_sha256(),
+        'csv_sha256': file_sha256(csv_path),
+        **_csv_state(csv_path),
+        'updates_applied': updates_applied,
+    }
+    # Il manifest si scrive per ultimo: uno snapshot interrotto resta invalido
+    tmp = os.path.join(directory, MANIFEST + ".tmp")
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(directory, MANIFEST))
+    print(f"Snapshot KB salvato in {directory}/")
+
+
+def _load(directory, manifest, mmap_mode='r'):
+    store = RecipeStore.load(directory, mmap_mode=mmap_mode)
+    titles = np.array(load_strings(directory, "index.titles"), dtype=object)
+    matrix = np.load(os.path.join(directory, "index.columns.npy"), mmap_mode=mmap_mode)
+    columns = {p: matrix[i] for i, p in enumerate(manifest['predicates'])}
+    return store, kb_index.PredicateIndex(titles, columns)
+
+
+def load_snapshot(csv_path="recipes_extended.csv", limit=30000, directory=SNAPSHOT_DIR, as_store=False):
+    manifest = _read_manifest(directory)
+    if not is_valid(manifest, csv_path, limit):
+        return None
+
+    store, index = _load(directory, manifest)
+    store, index = apply_updates(store, index, _pending_updates(directory, manifest))
+    df = store if as_store else store.to_dataframe()
+    print(f"Snapshot KB caricato da {directory}/")
+    return df, index
+
+
+# Snapshot valido se esiste, altrimenti dataframe + indice ricostruiti dal CSV
+# (rebuild=True: ricostruzione anche con uno snapshot valido)
+def load_or_build(csv_path="recipes_extended.csv", limit=30000, directory=SNAPSHOT_DIR, as_store=False,
+                  rebuild=False):
+    snapshot = None if rebuild else load_snapshot(csv_path, limit, directory, as_store)
+    if snapshot is not None:
+        return snapshot
+    df = KB.build_dataframe(limit, path=csv_path)
+    if df is None:
+        return None
+    store = RecipeStore.from_dataframe(df)
+    index = kb_index.build_predicate_index(store)
+    # Le modifiche registrate valgono anche sopra il CSV nuovo
+    records = list(KB.read_delta_records(updates_path(directory)))
+    if records:
+        store, index = apply_updates(store, index, records)
+        df = store.to_dataframe()
+    save_snapshot(store, index, csv_path, limit, directory, updates_applied=len(records))
+    return (store if as_store else df), index
+
+
+# --- AGGIORNAMENTI INCREMENTALI ---
+def updates_path(directory=SNAPSHOT_DIR):
+    return os.path.join(directory, UPDATES)
+
+
+def _pending_updates(directory, manifest):
+    records = KB.read_delta_records(updates_path(directory))
+    return itertools.islice(records, manifest.get('updates_applied', 0), None)
+
+
+# Record ('add', colonne del dataframe pulito) o ('retract', [titoli]) applicati in
+# ordine: l'indice ricalcola solo i titoli toccati (PredicateIndex.update)
+def apply_updates(store, index, records):
+    for kind, payload in records:
+        if kind == 'add':
+            import pandas as pd
+            nuove = RecipeStore.from_dataframe(pd.DataFrame(payload), columns=store.columns)
+            store = store.concat(nuove)
+            toccati = nuove.titles.tolist()
+        elif kind == 'retract':
+            toccati = list(payload)
+            store = store.take(~store.rows_of(toccati))
+        else:
+            raise ValueError(f"Record sconosciuto nel registro: {kind}")
+        index.update(KB.build_fact_tables(store.take(store.rows_of(toccati))), toccati)
+    return store, index
+
+
+# df: righe già pulite con KB.prepare_dataframe
+def add_recipes(df, directory=SNAPSHOT_DIR):
+    os.makedirs(directory, exist_ok=True)
+    KB.append_delta_record(updates_path(directory), 'add', {c: df[c].tolist() for c in df.columns})
+    return len(df)
+
+
+def retract_recipes(titles, directory=SNAPSHOT_DIR):
+    os.makedirs(directory, exist_ok=True)
+    titles = list(dict.fromkeys(titles))
+    KB.append_delta_record(updates_path(directory), 'retract', titles)
+    return titles
+
+
+# Riscrive archivio e indice con tutte le modifiche del registro (array letti in
+# memoria, non mappati: i file vengono sovrascritti)
+def compact(csv_path="recipes_extended.csv", limit=30000, directory=SNAPSHOT_DIR):
+    manifest = _read_manifest(directory)
+    if not is_valid(manifest, csv_path, limit):
+        return load_or_build(csv_path, limit, directory, as_store=True, rebuild=True)
+    records = list(_pending_updates(directory, manifest))
+    store, index = _load(directory, manifest, mmap_mode=None)
+    if records:
+        store, index = apply_updates(store, index, records)
+        save_snapshot(store, index, csv_path, limit, directory,
+                      updates_applied=manifest.get('updates_applied', 0) + len(records))
+    return store, index
@@ -1,18 +1,76 @@
+import argparse
+import json
+import math
+import time
+import tracemalloc
 import joblib
+import numpy as np
 import pandas as pd
-import re
-from sklearn.model_selection import train_test_split, RandomizedSearchCV, RepeatedKFold
+import cleaning
+import model_evaluation
+import taste_predictor
+from sklearn.model_selection import train_test_split, RandomizedSearchCV, RepeatedKFold, StratifiedKFold, ParameterSampler
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import classification_report, roc_auc_score
 from sklearn.feature_extraction.text import CountVectorizer
 
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# --- TEMPI E MEMORIA PER FASE ---
+# Per ogni fase: durata, picco di memoria allocata (tracemalloc, include i buffer
+# NumPy/SciPy) e RSS massimo del processo fino a quel momento (dove disponibile).
+class StageReport:
+    def __init__(self, track_memory=True):
+        self.track_memory = track_memory
+        self.stages = []
+
+    def stage(self, name):
+        return _Stage(self, name)
+
+    def print_summary(self):
+        print('\n--- TEMPI E MEMORIA PER FASE ---')
+        for s in self.stages:
+            picco = f"{s['peak_mb']:9.1f} MB" if s['peak_mb'] is not None else "        -"
+            print(f"  {s['stage']:28} {s['seconds']:9.2f} s   picco {picco}")
+        print(f"  {'totale':28} {sum(s['seconds'] for s in self.stages):9.2f} s")
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'stages': self.stages}, f, indent=2)
+
+
+class _Stage:
+    def __init__(self, report, name):
+        self.report = report
+        self.name = name
+
+    def __enter__(self):
+        if self.report.track_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+        peak = tracemalloc.get_traced_memory()[1] / 2**20 if self.report.track_memory else None
+        rss = None
+        if resource is not None:
+            # ru_maxrss: KB su Linux
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self.report.stages.append({'stage': self.name, 'seconds': round(seconds, 3),
+                                   'peak_mb': round(peak, 1) if peak is not None else None,
+                                   'max_rss_mb': round(rss, 1) if rss is not None else None})
+        return False
+
 # --- pulizia colonna ingredients ---
+# Versione per singola cella; per colonne intere si usa cleaning.TRAINING_CLEANER.clean_series
 def clean_ingredients_format(text):
-    if pd.isna(text): return ""  # noqa: E701
-    text = re.sub(r'[\[\]"]', '', text)
-    text = re.sub(r'\d+/\d+|\d+\s*(pound|cup|with|liquid|green|tablespoon|teaspoon|package|large|ounce|g|ml|lb|oz)s?', '', text, flags=re.IGNORECASE)
-    text = re.sub(r'\b\d+\b', '', text)
-    return text.lower().strip()
+    return cleaning.TRAINING_CLEANER.clean(text)
 
 def balance_dataset(df, target_count):
 
@@ -29,7 +87,8 @@ def balance_dataset(df, target_count):
             print(f"Attenzione: la classe {taste} ha solo {len(subset)} campioni.")
             balanced_chunks.append(subset)
 
-    df_balanced = pd.concat(balanced_chunks).sample(frac=1).reset_index(drop=True)
+    # Mescolamento con seme: stesso dataset a ogni esecuzione (la cache dei fold resta valida)
+    df_balanced = pd.concat(balanced_chunks).sample(frac=1, random_state=42).reset_index(drop=True)
     return df_balanced
 
 
@@ -130,12 +189,153 @@ def SearchingBestModelStats(X_train, X_test, y_train, y_test):
     modelEvaluation(y_test, y_pred_final, pred_prob_final)
     return dtc_final
 
-def main():
+# --- MODALITÀ VELOCE: MATRICE SPARSA + SUCCESSIVE HALVING ---
+# Al posto delle tre RandomizedSearch ripetute: molti candidati valutati su un
+# sottoinsieme piccolo del training set, ad ogni giro sopravvive 1/factor dei
+# candidati e i campioni crescono di factor, fino al training set completo.
+# La ricerca si ferma alla scadenza del budget (in secondi) con il migliore
+# trovato fin lì. Le foreste usano i thread (n_jobs): la matrice CSR non viene
+# copiata nei processi figli.
+def SuccessiveHalvingSearch(hyperparameters, X_train, y_train, budget_s=300, n_candidates=27,
+                            factor=3, cv=2, n_jobs=-1, random_state=42):
+    deadline = time.monotonic() + budget_s
+    candidates = list(ParameterSampler(hyperparameters, n_iter=n_candidates, random_state=random_state))
+    # Giri necessari per arrivare a un solo sopravvissuto (l'ultimo giro usa tutti i campioni)
+    n_rounds, rimasti = 1, len(candidates)
+    while rimasti > factor:
+        rimasti = math.ceil(rimasti / factor)
+        n_rounds += 1
+    n_total = X_train.shape[0]
+    n_samples = max(n_total // factor ** (n_rounds - 1), 20 * cv)
+    y_train = np.asarray(y_train)
+    history = []
+    scaduto = False
+
+    for round_i in range(n_rounds):
+        if n_samples < n_total:
+            idx, _ = train_test_split(np.arange(n_total), train_size=n_samples,
+                                      random_state=random_state, stratify=y_train)
+        else:
+            idx = np.arange(n_total)
+        X_r, y_r = X_train[idx], y_train[idx]
+        print(f"Giro {round_i + 1}/{n_rounds}: {len(candidates)} candidati su {len(idx)} campioni")
+
+        scores = []
+        for params in candidates:
+            # Almeno un candidato per giro viene sempre valutato
+            if scores and time.monotonic() > deadline:
+                scaduto = True
+                break
+            fold_scores = []
+            for tr, va in StratifiedKFold(n_splits=cv, shuffle=True, random_state=random_state).split(X_r, y_r):
+                model = RandomForestClassifier(**params, random_state=random_state, n_jobs=n_jobs)
+                model.fit(X_r[tr], y_r[tr])
+                fold_scores.append(roc_auc_score(y_r[va], model.predict_proba(X_r[va]), multi_class='ovr'))
+            scores.append(float(np.mean(fold_scores)))
+            history.append({'round': round_i, 'n_samples': int(len(idx)), 'params': params,
+                            'roc_score': scores[-1]})
+
+        ordine = np.argsort(scores)[::-1]
+        candidates = [candidates[i] for i in ordine]
+        if scaduto:
+            print(f"Budget di {budget_s}s esaurito: si tiene il migliore del giro {round_i + 1}")
+            break
+        if len(candidates) == 1 or round_i == n_rounds - 1:
+            break
+        candidates = candidates[:max(1, math.ceil(len(candidates) / factor))]
+        n_samples = min(n_total, n_samples * factor)
+
+    return {'params': candidates[0], 'history': history, 'budget_exhausted': scaduto}
+
+
+# Spazio di ricerca delle modalità 'fast' e 'parallel'
+HYPERPARAMETERS = {
+    'criterion': ['gini', 'entropy'],
+    'max_depth': list(range(5, 30, 5)),
+    'min_samples_split': [2, 5, 10],
+    'min_samples_leaf': [1, 2, 4],
+    'class_weight': [None, 'balanced']
+}
+
+
+def FastModelTraining(X_train, X_test, y_train, y_test, report, budget_s=300, n_jobs=-1):
+    with report.stage('modello base'):
+        print('\nIniziale composizione del modello con iperparametri basici...')
+        dtc = RandomForestClassifier(max_depth=5, random_state=42, n_jobs=n_jobs)
+        dtc.fit(X_train, y_train)
+        print('\nValutazione del modello base...')
+        modelEvaluation(y_test, dtc.predict(X_test), dtc.predict_proba(X_test))
+
+    with report.stage('ricerca iperparametri'):
+        print(f'\nRicerca iperparametri (successive halving, budget {budget_s}s)...')
+        best_res = SuccessiveHalvingSearch(HYPERPARAMETERS, X_train, y_train, budget_s=budget_s, n_jobs=n_jobs)
+
+    print('\n--- MIGLIORI IPERPARAMETRI TROVATI ---')
+    best_params = best_res['params']
+    for p, v in best_params.items():
+        if v is not None and p in ['criterion', 'max_depth', 'min_samples_split', 'min_samples_leaf']:
+            print(f"{p}: {v}")
+
+    # Unico fit sul training set completo con i parametri migliori
+    with report.stage('modello finale'):
+        print('\nComposizione del modello con i nuovi iperparametri...')
+        dtc_final = RandomForestClassifier(**best_params, random_state=42, n_jobs=n_jobs)
+        dtc_final.fit(X_train, y_train)
+        modelEvaluation(y_test, dtc_final.predict(X_test), dtc_final.predict_proba(X_test))
+    return dtc_final
+
+
+# --- MODALITÀ PARALLELA: CANDIDATI IN CROSS-VALIDATION SU UN POOL DI PROCESSI ---
+# Modello base e n_candidates configurazioni campionate valutati insieme da
+# model_evaluation.EvaluationEngine (fold in parallelo, matrice condivisa in
+# mmap, fold già calcolati letti dalla cache); il migliore per ROC-AUC
+# out-of-fold viene riaddestrato sul training set e valutato sul test set una volta sola.
+def ParallelModelTraining(X_train, X_test, y_train, y_test, report, n_candidates=12, cv=3, workers=None,
+                          cache_dir=model_evaluation.CACHE_DIR, n_jobs=-1, eval_report_path=None):
+    candidati = [('base', {'max_depth': 5})]
+    candidati += [(f"cand{i:02d}", params) for i, params in
+                  enumerate(ParameterSampler(HYPERPARAMETERS, n_iter=n_candidates, random_state=42))]
+    start = time.perf_counter()
+    with report.stage('valutazione parallela'):
+        print(f'\nValutazione di {len(candidati)} configurazioni ({cv} fold)...')
+        engine = model_evaluation.EvaluationEngine(X_train, y_train, cv=cv, workers=workers, cache_dir=cache_dir)
+        risultati = engine.evaluate(candidati)
+
+    migliore = risultati[0]
+    with report.stage('modello finale'):
+        print(f"\nComposizione del modello finale ({migliore['name']})...")
+        dtc_final = RandomForestClassifier(**migliore['params'], random_state=42, n_jobs=n_jobs)
+        t0 = time.perf_counter()
+        dtc_final.fit(X_train, y_train)
+        t1 = time.perf_counter()
+        pred_prob = dtc_final.predict_proba(X_test)
+        t2 = time.perf_counter()
+        test = {'model': migliore['name'], 'params': migliore['params'],
+                **model_evaluation.evaluate_predictions(y_test, pred_prob, dtc_final.classes_),
+                'fit_s': t1 - t0, 'predict_ms_per_1k': (t2 - t1) / X_test.shape[0] * 1e6}
+
+    valutazione = engine.report(risultati, test, seconds=round(time.perf_counter() - start, 3))
+    model_evaluation.print_report(valutazione)
+    if eval_report_path:
+        model_evaluation.save_report(valutazione, eval_report_path)
+        print(f"Report di valutazione salvato in {eval_report_path}")
+    return dtc_final
+
+
+# mode='fast': matrice CSR, successive halving con budget, un solo fit finale
+# mode='classic': matrice densa e tre RandomizedSearch come nella versione originale
+# mode='parallel': matrice CSR, candidati valutati in parallelo (ParallelModelTraining)
+def main(mode='fast', budget_s=300, n_jobs=-1, path='recipes_extended.csv', track_memory=True,
+         report_path=None, workers=None, n_candidates=12, cache_dir=model_evaluation.CACHE_DIR,
+         eval_report_path=None):
+    report = StageReport(track_memory=track_memory)
+
     # caricamento dataset
-    df = pd.read_csv('recipes_extended.csv')
+    cols_to_check = ['ingredient_text', 'primary_taste']
+    with report.stage('lettura csv'):
+        df = pd.read_csv(path, usecols=cols_to_check)
     
     # Pulizia righe con valori mancanti nelle colonne fondamentali
-    cols_to_check = ['ingredient_text', 'primary_taste']
     df = df.dropna(subset=cols_to_check)
 
     # bilanciamento dataset
@@ -147,14 +347,21 @@ def main():
 
     # pulizia del testo
     print("\nPulizia ingredienti...")
-    df['clean_ingredients'] = df['ingredient_text'].apply(clean_ingredients_format)
+    with report.stage('pulizia'):
+        df['clean_ingredients'] = cleaning.TRAINING_CLEANER.clean_series(df['ingredient_text'])
 
     # vettorizzazione
     # aumentiamo a 500 feature per catturare meglio le differenze tra savory e spicy
-    vectorizer = CountVectorizer(stop_words='english', max_features=500, binary=True)
-    ing_matrix = vectorizer.fit_transform(df['clean_ingredients']).toarray()
-    X = pd.DataFrame(ing_matrix, columns=vectorizer.get_feature_names_out())
-    y = df['primary_taste']
+    with report.stage('vettorizzazione'):
+        if mode in ('fast', 'parallel'):
+            # CSR float32: è già il formato che la foresta usa internamente, nessuna copia densa
+            vectorizer = CountVectorizer(stop_words='english', max_features=500, binary=True, dtype=np.float32)
+            X = vectorizer.fit_transform(df['clean_ingredients'])
+        else:
+            vectorizer = CountVectorizer(stop_words='english', max_features=500, binary=True)
+            ing_matrix = vectorizer.fit_transform(df['clean_ingredients']).toarray()
+            X = pd.DataFrame(ing_matrix, columns=vectorizer.get_feature_names_out())
+        y = df['primary_taste']
 
     # split (Manteniamo la stratificazione per sicurezza)
     X_train, X_test, y_train, y_test = train_test_split(
@@ -162,7 +369,17 @@ def main():
     )
 
     # ottimizzazione e valutazione
-    best_dtc = SearchingBestModelStats(X_train, X_test, y_train, y_test)
+    if mode == 'fast':
+        best_dtc = FastModelTraining(X_train, X_test, y_train, y_test, report, budget_s=budget_s, n_jobs=n_jobs)
+    elif mode == 'parallel':
+        best_dtc = ParallelModelTraining(X_train, X_test, y_train, y_test, report, n_candidates=n_candidates,
+                                         workers=workers, cache_dir=cache_dir, n_jobs=n_jobs,
+                                         eval_report_path=eval_report_path)
+    elif mode == 'classic':
+        with report.stage('ricerca + modello finale'):
+            best_dtc = SearchingBestModelStats(X_train, X_test, y_train, y_test)
+    else:
+        raise ValueError(f"Modalità di addestramento sconosciuta: {mode}")
 
     print('\nFase di apprendimento completata con successo.')
     print('Il modello è ora addestrato su un dataset bilanciato (n=~28500 totali).')
@@ -172,8 +389,37 @@ def main():
         'model': best_dtc,
         'vectorizer': vectorizer
     }
-    joblib.dump(model_data, 'modello_gusti_ricette.pkl')
+    with report.stage('salvataggio'):
+        joblib.dump(model_data, 'modello_gusti_ricette.pkl')
     print("\nModello e vettorizzatore salvati con successo in 'modello_gusti_ricette.pkl'!")
 
+    # Artefatto compatto per il Main: alberi in array NumPy, caricabile senza scikit-learn
+    with report.stage('esportazione compatta'):
+        taste_predictor.export_compact_model(best_dtc, vectorizer, source='modello_gusti_ricette.pkl')
+
+    report.print_summary()
+    if report_path:
+        report.save(report_path)
+    return best_dtc
+
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Addestramento del modello dei gusti")
+    parser.add_argument('--mode', choices=['fast', 'classic', 'parallel'], default='fast')
+    parser.add_argument('--budget', type=float, default=300, help="budget della ricerca iperparametri (s)")
+    parser.add_argument('--n-jobs', type=int, default=-1)
+    parser.add_argument('--csv', default='recipes_extended.csv')
+    parser.add_argument('--no-memory', action='store_true', help="non tracciare il picco di memoria (più veloce)")
+    parser.add_argument('--report', default=None, help="salva tempi e memoria per fase in JSON")
+    parser.add_argument('--workers', type=int, default=None, help="processi della modalità parallel")
+    parser.add_argument('--candidates', type=int, default=12, help="configurazioni campionate (parallel)")
+    parser.add_argument('--cv-cache', default=model_evaluation.CACHE_DIR, help="cache dei fold (parallel)")
+    parser.add_argument('--eval-report', default=None, help="salva il report di valutazione in JSON (parallel)")
+    args = parser.parse_args(argv)
+    main(args.mode, args.budget, args.n_jobs, args.csv, not args.no_memory, args.report,
+         args.workers, args.candidates, args.cv_cache, args.eval_report)
+    return 0
+
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    cli()
\ No newline at end of file
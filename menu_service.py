@@ -0,0 +1,271 @@
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import io
+import json
+import multiprocessing as mp
+import os
+import sys
+import threading
+import time
+import CSP
+import instrumentation
+import kb_server
+import kb_snapshot
+import menu_solver
+
+# --- SERVIZIO ASINCRONO DEI MENU ---
+# Le richieste (stesso formato dei profili di batch_menu:
+#   {"id": ..., "preferred_taste": ..., "user_data": {...}, "timeout": 5.0, "seed": 1})
+# arrivano in concorrenza su un event loop asyncio. La risoluzione, CPU-bound,
+# gira in un executor (processi o thread) e restituisce solo gli id di riga
+# delle ricette scelte; il servizio trasmette poi un evento per giorno,
+# creando le stringhe dall'archivio delle ricette solo per quel giorno.
+#
+# Eventi di MenuService.stream():
+#   {"type": "accepted"}                         subito, prima di risolvere
+#   {"type": "day", "day": "Lun", "meals": {...}} uno per giorno
+#   {"type": "done", "status": "ok", ...}        oppure status no_menu / timeout / cancelled / error
+#
+# Un giorno viene trasmesso appena il solver restituisce l'assegnamento completo:
+# prima, con il backtracking, nessun giorno è definitivo. Il timeout per
+# richiesta è anche il timeout del solver; se il risultato non arriva entro il
+# timeout (più un margine) la richiesta termina con 'timeout' e l'esecuzione
+# viene interrotta: subito con i thread (should_stop del solver), alla scadenza
+# del timeout del solver con i processi. Le richieste ancora in coda vengono
+# semplicemente annullate.
+# Con kb_shm (--kb-shm NOME) archivio e indice vengono dal segmento di kb_server.
+
+MARGINE_TIMEOUT = 1.0
+CAMPI_RICETTA = ['recipe_title', 'primary_taste', 'ingredients_raw', 'est_prep_time_min']
+
+# Stato dei worker: (archivio, indice)
+_DATI = None
+
+
+def _load(csv_path, limit, directory, kb_shm=None):
+    if kb_shm:
+        return kb_server.attach(kb_shm).data
+    return kb_snapshot.load_or_build(csv_path, limit, directory, as_store=True)
+
+
+def _init_worker(csv_path, limit, directory, kb_shm=None):
+    global _DATI
+    if _DATI is None:
+        # Metodo 'spawn'/'forkserver': nessuna memoria ereditata, si riapre lo snapshot
+        # (o ci si collega alla KB condivisa)
+        with contextlib.redirect_stdout(io.StringIO()):
+            _DATI = _load(csv_path, limit, directory, kb_shm)
+
+
+# Stessi passi di CSP.solve_menu_csp ma senza stampe (build_menu_model con
+# quiet=True, esiti restituiti come stato): redirect_stdout non è utilizzabile
+# con più thread (sys.stdout è unico per processo)
+def _solve(profilo, timeout, seed, stop=None):
+    store, index = _DATI
+    start = time.perf_counter()
+    modello = CSP.build_menu_model(profilo['user_data'], profilo.get('preferred_taste', 'neutral'),
+                                   store, index, CSP.DOMAIN_CACHE, seed=seed, quiet=True)
+    if modello is None:
+        return None, 'no_menu', time.perf_counter() - start
+    risolutore = menu_solver.MenuSolver(modello.variabili, modello.domini, **modello.solver_options())
+    soluzione, stats = risolutore.solve(timeout=timeout, should_stop=stop.is_set if stop is not None else None)
+    instrumentation.record_search('propagation', stats)
+    elapsed = time.perf_counter() - start
+    if not soluzione:
+        esiti = {menu_solver.TIMEOUT: 'timeout', menu_solver.CANCELLED: 'cancelled'}
+        return None, esiti.get(stats.status, 'no_menu'), elapsed
+    menu = CSP.menu_da_soluzione(soluzione, modello.domini_profilo)
+    # Solo interi verso il processo principale: le viste sull'archivio restano qui
+    righe = {g: {pt: menu[g][pt].row for pt in CSP.PASTI_TIPO} for g in CSP.GIORNI}
+    return righe, None, elapsed
+
+
+class MenuService:
+    def __init__(self, data=None, workers=None, executor='process', timeout=5.0,
+                 csv_path="recipes_extended.csv", limit=30000, directory=kb_snapshot.SNAPSHOT_DIR,
+                 kb_shm=None):
+        self.data = data
+        self.workers = workers or os.cpu_count() or 1
+        self.executor_kind = executor
+        self.timeout = timeout
+        self.csv_path = csv_path
+        self.limit = limit
+        self.directory = directory
+        self.kb_shm = kb_shm
+        self._executor = None
+        self.stats = {'accepted': 0, 'ok': 0, 'no_menu': 0, 'timeout': 0, 'cancelled': 0, 'error': 0}
+
+    async def start(self):
+        global _DATI
+        loop = asyncio.get_running_loop()
+        if self.data is None:
+            # Caricamento dello snapshot fuori dall'event loop
+            self.data = await loop.run_in_executor(
+                None, _load, self.csv_path, self.limit, self.directory, self.kb_shm)
+            if self.data is None:
+                raise RuntimeError("KB non disponibile")
+        _DATI = self.data
+        if self.executor_kind == 'thread':
+            self._executor = concurrent.futures.ThreadPoolExecutor(self.workers)
+        elif self.executor_kind == 'process':
+            # 'fork' dove disponibile: i worker ereditano archivio e indice già caricati
+            metodo = 'fork' if 'fork' in mp.get_all_start_methods() else None
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                self.workers, mp_context=mp.get_context(metodo), initializer=_init_worker,
+                initargs=(self.csv_path, self.limit, self.directory, self.kb_shm))
+        else:
+            raise ValueError(f"Executor sconosciuto: {self.executor_kind}")
+        return self
+
+    async def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _meals(self, righe):
+        store = self.data[0]
+        return {pt: {campo: store.value(riga, campo) for campo in CAMPI_RICETTA}
+                for pt, riga in righe.items()}
+
+    def _done(self, rid, status, start, **extra):
+        self.stats[status] += 1
+        return {'type': 'done', 'id': rid, 'status': status,
+                'latency_ms': round((time.perf_counter() - start) * 1000, 3), **extra}
+
+    async def stream(self, request):
+        if self._executor is None:
+            raise RuntimeError("Servizio non avviato (usare start() o 'async with')")
+        start = time.perf_counter()
+        rid = request.get('id')
+        timeout = float(request.get('timeout', self.timeout))
+        self.stats['accepted'] += 1
+        yield {'type': 'accepted', 'id': rid}
+
+        loop = asyncio.get_running_loop()
+        stop = threading.Event() if self.executor_kind == 'thread' else None
+        future = loop.run_in_executor(self._executor, _solve, request, timeout, request.get('seed'), stop)
+        concluso = False
+        try:
+            try:
+                righe, esito, elapsed = await asyncio.wait_for(asyncio.shield(future), timeout + MARGINE_TIMEOUT)
+            except asyncio.TimeoutError:
+                concluso = True
+                yield self._done(rid, 'timeout', start)
+                return
+            except Exception as e:
+                # Qualsiasi errore del worker (o executor rotto) è un esito della richiesta;
+                # CancelledError (BaseException) risale e conta come annullata
+                concluso = True
+                yield self._done(rid, 'error', start, error=f"{type(e).__name__}: {e}")
+                return
+
+            if righe is None:
+                concluso = True
+                yield self._done(rid, esito, start)
+                return
+            for g in CSP.GIORNI:
+                yield {'type': 'day', 'id': rid, 'day': g, 'meals': self._meals(righe[g])}
+                # Un giorno alla volta: gli altri stream avanzano tra un giorno e l'altro
+                await asyncio.sleep(0)
+            concluso = True
+            yield self._done(rid, 'ok', start, solve_ms=round(elapsed * 1000, 3))
+        finally:
+            # Client disconnesso, richiesta annullata o scaduta: si ferma il lavoro ancora in corso
+            if not future.done():
+                future.cancel()
+                if stop is not None:
+                    stop.set()
+            if not concluso:
+                self.stats['cancelled'] += 1
+
+    # Menu completo (giorno -> pasto -> campi) in un'unica risposta
+    async def generate(self, request):
+        menu = {}
+        esito = None
+        async for evento in self.stream(request):
+            if evento['type'] == 'day':
+                menu[evento['day']] = evento['meals']
+            elif evento['type'] == 'done':
+                esito = evento
+        if esito is None:
+            # Stream chiuso senza evento finale (già contato come annullato)
+            return {'type': 'done', 'id': request.get('id'), 'status': 'cancelled', 'menu': None}
+        esito['menu'] = menu if esito['status'] == 'ok' else None
+        return esito
+
+
+# --- CLIENT LOCALE (nello stesso processo) ---
+# Invia le richieste in concorrenza e misura, per ciascuna, il tempo al primo
+# evento, al primo giorno e alla fine; con verbose stampa i giorni appena arrivano.
+class LocalClient:
+    def __init__(self, service):
+        self.service = service
+
+    async def request(self, profilo, verbose=False):
+        start = time.perf_counter()
+        tempi = {}
+        esito = None
+        async for evento in self.service.stream(profilo):
+            ora = round((time.perf_counter() - start) * 1000, 3)
+            if evento['type'] == 'accepted':
+                tempi['accepted_ms'] = ora
+            elif evento['type'] == 'day':
+                tempi.setdefault('first_day_ms', ora)
+                if verbose:
+                    sys.stdout.write(f"[{evento['id']}]" + CSP.format_day(evento['day'], evento['meals']))
+            else:
+                esito = evento
+        tempi['done_ms'] = round((time.perf_counter() - start) * 1000, 3)
+        return {'id': esito['id'], 'status': esito['status'], **tempi}
+
+    async def run(self, profili, concurrency=8, verbose=False):
+        limite = asyncio.Semaphore(concurrency)
+
+        async def uno(profilo):
+            async with limite:
+                return await self.request(profilo, verbose)
+
+        return await asyncio.gather(*(uno(p) for p in profili))
+
+
+async def _demo(args):
+    with open(args.profiles, 'r', encoding='utf-8') as f:
+        profili = [json.loads(r) for r in f if r.strip()][:args.limit_profiles]
+    async with MenuService(workers=args.workers, executor=args.executor, timeout=args.timeout,
+                           csv_path=args.csv, limit=args.rows, kb_shm=args.kb_shm) as servizio:
+        risultati = await LocalClient(servizio).run(profili, args.concurrency, args.verbose)
+    for chiave in ('accepted_ms', 'first_day_ms', 'done_ms'):
+        valori = sorted(r[chiave] for r in risultati if chiave in r)
+        if valori:
+            print(f"{chiave:13}: p50 {valori[len(valori) // 2]:.3f}  max {valori[-1]:.3f}")
+    print(f"Esiti: {servizio.stats}")
+    return risultati
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servizio asincrono dei menu con client locale di prova")
+    parser.add_argument('profiles', help="file JSONL dei profili (come batch_menu)")
+    parser.add_argument('--executor', choices=['process', 'thread'], default='process')
+    parser.add_argument('-w', '--workers', type=int, default=None)
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help="richieste contemporanee del client")
+    parser.add_argument('--timeout', type=float, default=5.0)
+    parser.add_argument('--limit-profiles', type=int, default=None)
+    parser.add_argument('--csv', default="recipes_extended.csv")
+    parser.add_argument('--rows', type=int, default=30000)
+    parser.add_argument('-v', '--verbose', action='store_true', help="stampa i giorni appena arrivano")
+    parser.add_argument('--kb-shm', default=None, help="nome della KB condivisa di kb_server")
+    args = parser.parse_args(argv)
+    asyncio.run(_demo(args))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
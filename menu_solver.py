@@ -0,0 +1,556 @@
+import statistics
+import time
+from collections import Counter
+
+# --- SOLVER CON PROPAGAZIONE DEI VINCOLI ---
+# Alternativa al backtracking di python-constraint per il menù settimanale.
+# I vincoli sono quelli di CSP.solve_menu_csp:
+#   - AllDifferent su gruppi di variabili (pranzi, cene)
+#   - coppie (pranzo, cena) dello stesso giorno: valori diversi e non entrambi high_fat
+#   - requisiti "almeno un piatto X" su un insieme di variabili (vincoli di conteggio)
+#   - limiti "al più k piatti X" su un insieme di variabili (es. frequenza di un
+#     ingrediente in una finestra di giorni, planner): controllati all'assegnamento
+#     e nel forward checking (posti rimasti di ogni limite, vedi _apply_limits)
+# Ad ogni assegnamento si applica forward checking: per ogni variabile libera si
+# contano i valori ancora ammessi raggruppati per "firma" (i requisiti che il
+# valore soddisfa + flag high_fat). Dai conteggi si verifica subito che ogni
+# variabile abbia ancora valori, che i gruppi AllDifferent abbiano abbastanza
+# valori liberi e che i requisiti non ancora soddisfatti possano esserlo dalle
+# variabili rimaste, così un profilo insoddisfacibile fallisce alla radice.
+
+OK = 'ok'
+UNSAT = 'unsat'
+TIMEOUT = 'timeout'
+BEST_EFFORT = 'best_effort'
+CANCELLED = 'cancelled'
+
+
+class SolveCancelled(Exception):
+    pass
+
+
+# checks: verifiche di consistenza (propagazione) eseguite;
+# rejections: valori o assegnamenti scartati, per vincolo responsabile
+# ('all_different', 'fat_limit_constraint', 'empty_domain', nome di un requisito
+# o 'requirements' se i requisiti falliscono solo insieme)
+class SolverStats:
+    def __init__(self):
+        self.status = None
+        self.nodes = 0
+        self.backtracks = 0
+        self.checks = 0
+        self.rejections = {}
+        self.elapsed = 0.0
+        self.unmet = []
+
+    def reject(self, constraint, n=1):
+        self.rejections[constraint] = self.rejections.get(constraint, 0) + n
+
+    def merge(self, other):
+        self.nodes += other.nodes
+        self.backtracks += other.backtracks
+        self.checks += other.checks
+        for nome, n in other.rejections.items():
+            self.reject(nome, n)
+
+    def as_dict(self):
+        return {'status': self.status, 'nodes': self.nodes, 'backtracks': self.backtracks,
+                'checks': self.checks, 'rejections': dict(self.rejections),
+                'elapsed': self.elapsed, 'unmet': list(self.unmet)}
+
+
+class MenuSolver:
+    def __init__(self, variables, domains, groups=(), pairs=(), high_fat=frozenset(), requirements=(), limits=()):
+        # variables: ordine di assegnamento; domains: var -> lista di valori (ordine = preferenza)
+        self.variables = list(variables)
+        self.domains = domains
+        self.high_fat = high_fat
+        # requirements: lista di (nome, insieme di valori che lo soddisfano, variabili coinvolte)
+        self.requirements = [(name, values, set(scope)) for name, values, scope in requirements]
+        self.full_mask = (1 << len(self.requirements)) - 1
+        # limits: lista di (nome, insieme di valori, variabili coinvolte, massimo)
+        self.limits = [(name, values, set(scope), maximum) for name, values, scope, maximum in limits]
+        self.limits_of = {v: [li for li, (_, _, scope, _) in enumerate(self.limits) if v in scope]
+                          for v in self.variables}
+
+        self.groups_of = {v: [] for v in self.variables}
+        self.groups = [list(g) for g in groups]
+        for gi, g in enumerate(self.groups):
+            for v in g:
+                self.groups_of[v].append(gi)
+        self.partners = {v: [] for v in self.variables}
+        for a, b in pairs:
+            self.partners[a].append(b)
+            self.partners[b].append(a)
+
+        # Firma di ogni valore: bit dei requisiti soddisfatti + flag high_fat
+        self._sig = {}
+        self._scope = {v: self._scope_mask(v) for v in self.variables}
+        self._domain_set = {}
+        self._counts = {}
+        # Domini con gli stessi valori (es. copie rimescolate) condividono insieme e conteggi
+        condivisi = []
+        per_lista = {}
+        for v in self.variables:
+            scope_mask = self._scope[v]
+            # Stessa lista passata a più variabili: nessun bisogno di ricostruire l'insieme
+            stessa = per_lista.get((id(self.domains[v]), scope_mask))
+            if stessa is not None:
+                self._domain_set[v], self._counts[v] = stessa
+                continue
+            domain_set = set(self.domains[v])
+            for mask, other_set, other_counts in condivisi:
+                if mask == scope_mask and other_set == domain_set:
+                    domain_set, counts = other_set, other_counts
+                    break
+            else:
+                counts = {}
+                for value in domain_set:
+                    key = self._signature(value, scope_mask)
+                    counts[key] = counts.get(key, 0) + 1
+                condivisi.append((scope_mask, domain_set, counts))
+            self._domain_set[v] = domain_set
+            self._counts[v] = counts
+            per_lista[(id(self.domains[v]), scope_mask)] = (domain_set, counts)
+        self._union_size = [len(set().union(*(self._domain_set[v] for v in g))) for g in self.groups]
+        # Valori di ogni limite nel dominio di ogni variabile, per firma
+        self._limit_counts = {}
+        per_dominio = {}
+        for v in self.variables:
+            for li in self.limits_of[v]:
+                key = (id(self._domain_set[v]), self._scope[v], li)
+                if key not in per_dominio:
+                    counts = {}
+                    for value in self._domain_set[v] & self.limits[li][1]:
+                        sig = self._signature(value, self._scope[v])
+                        counts[sig] = counts.get(sig, 0) + 1
+                    per_dominio[key] = counts
+                self._limit_counts[(v, li)] = per_dominio[key]
+
+    def _scope_mask(self, var):
+        mask = 0
+        for i, (_, _, scope) in enumerate(self.requirements):
+            if var in scope:
+                mask |= 1 << i
+        return mask
+
+    def _signature(self, value, scope_mask):
+        sig = self._sig.get(value)
+        if sig is None:
+            sig = 0
+            for i, (_, values, _) in enumerate(self.requirements):
+                if value in values:
+                    sig |= 1 << i
+            self._sig[value] = sig
+        return (sig & scope_mask, value in self.high_fat)
+
+    # Nome del primo limite che 'value' supererebbe in 'var' (None se nessuno)
+    def _over_limit(self, var, value, counts):
+        for li in self.limits_of[var]:
+            name, values, _, maximum = self.limits[li]
+            if value in values and counts[li] >= maximum:
+                return name
+        return None
+
+    def _count_limits(self, var, value, counts, delta):
+        for li in self.limits_of[var]:
+            if value in self.limits[li][1]:
+                counts[li] += delta
+
+    # --- PROPAGAZIONE ---
+    # Valori esclusi per 'var' da AllDifferent e dalle coppie, e se il partner è high_fat
+    def _exclusions(self, var, assignment, used):
+        no_fat = any(p in assignment and assignment[p] in self.high_fat for p in self.partners[var])
+        excluded = set()
+        for gi in self.groups_of[var]:
+            excluded |= used[gi]
+        for p in self.partners[var]:
+            if p in assignment:
+                excluded.add(assignment[p])
+        return excluded, no_fat
+
+    # Valori ancora ammessi per 'var', per firma, dato l'assegnamento parziale
+    # (li: solo i valori del limite li)
+    def _available(self, var, assignment, used, exclusions=None, li=None):
+        excluded, no_fat = exclusions or self._exclusions(var, assignment, used)
+        counts = dict(self._counts[var] if li is None else self._limit_counts[(var, li)])
+        if no_fat:
+            counts = {k: n for k, n in counts.items() if not k[1]}
+        domain = self._domain_set[var]
+        scope_mask = self._scope[var]
+        for value in excluded:
+            if value in domain and (li is None or value in self.limits[li][1]):
+                key = self._signature(value, scope_mask)
+                if key in counts:
+                    counts[key] -= 1
+        return counts
+
+    # Limiti "al più" nel forward checking (assigned: valori del limite già assegnati).
+    # Se un limite è saturo i suoi valori non sono più ammessi: per ogni firma si
+    # tolgono quelli del limite saturo più numeroso (per difetto se più limiti
+    # saturi condividono valori). Una variabile con soli valori di un limite non
+    # saturo ne occuperà comunque un posto: si conta in forced.
+    def _apply_limits(self, var, counts, exclusions, assigned, forced):
+        totale = sum(n for n in counts.values() if n > 0)
+        tolti = {}
+        for li in self.limits_of[var]:
+            nel_limite = self._available(var, None, None, exclusions, li)
+            if assigned[li] >= self.limits[li][3]:
+                for key, n in nel_limite.items():
+                    if n > tolti.get(key, 0):
+                        tolti[key] = n
+            elif totale and totale <= sum(n for n in nel_limite.values() if n > 0):
+                forced[li] += 1
+        if tolti:
+            counts = {k: n - tolti.get(k, 0) for k, n in counts.items()}
+        return counts
+
+    def _consistent(self, assignment, used, unmet, stats=None):
+        if stats is not None:
+            stats.checks += 1
+        free = [v for v in self.variables if v not in assignment]
+        if self.limits:
+            assigned = [sum(1 for v in scope if v in assignment and assignment[v] in values)
+                        for _, values, scope, _ in self.limits]
+            forced = [0] * len(self.limits)
+        options = []
+        for v in free:
+            exclusions = self._exclusions(v, assignment, used)
+            counts = self._available(v, assignment, used, exclusions)
+            if self.limits_of[v]:
+                counts = self._apply_limits(v, counts, exclusions, assigned, forced)
+            sigs = {k[0] for k, n in counts.items() if n > 0}
+            if not sigs:
+                if stats is not None:
+                    stats.reject('empty_domain')
+                return False
+            options.append({s & unmet for s in sigs})
+
+        # AllDifferent: i valori liberi del gruppo devono bastare per le variabili libere
+        for gi, g in enumerate(self.groups):
+            liberi = sum(1 for v in g if v not in assignment)
+            if liberi > self._union_size[gi] - len(used[gi]):
+                if stats is not None:
+                    stats.reject('all_different')
+                return False
+
+        # Limiti: le variabili libere costrette a un valore del limite devono starci
+        if self.limits:
+            for li, n in enumerate(forced):
+                name, _, _, maximum = self.limits[li]
+                if n > maximum - assigned[li]:
+                    if stats is not None:
+                        stats.reject(name)
+                    return False
+
+        # Requisiti di conteggio: i requisiti mancanti devono essere coperti
+        # da variabili libere distinte (programmazione dinamica sui sottoinsiemi)
+        if unmet:
+            reach = {0}
+            for opts in options:
+                reach = {m | o for m in reach for o in opts}
+                if unmet in reach:
+                    break
+            if unmet not in reach:
+                if stats is not None:
+                    self._reject_requirements(unmet, options, stats)
+                return False
+        return True
+
+    # Requisiti che nessuna variabile libera può più soddisfare (solo a fallimento avvenuto)
+    def _reject_requirements(self, unmet, options, stats):
+        coperti = 0
+        for opts in options:
+            for o in opts:
+                coperti |= o
+        mancanti = [name for i, (name, _, _) in enumerate(self.requirements)
+                    if unmet & (1 << i) and not coperti & (1 << i)]
+        for name in mancanti or ['requirements']:
+            stats.reject(name)
+
+    def _unmet(self, assignment):
+        unmet = self.full_mask
+        for v, value in assignment.items():
+            unmet &= ~self._signature(value, self._scope[v])[0]
+        return unmet
+
+    # --- RICERCA ---
+    # should_stop: funzione senza argomenti controllata insieme al timeout
+    # (es. threading.Event.is_set) per interrompere la ricerca dall'esterno
+    def solve(self, timeout=5.0, best_effort=False, should_stop=None):
+        stats = SolverStats()
+        start = time.monotonic()
+        deadline = start + timeout if timeout is not None else None
+        assignment = {}
+        used = [set() for _ in self.groups]
+        counts = [0] * len(self.limits)
+
+        def assign(var, value):
+            assignment[var] = value
+            for gi in self.groups_of[var]:
+                used[gi].add(value)
+            self._count_limits(var, value, counts, 1)
+
+        def unassign(var):
+            value = assignment.pop(var)
+            for gi in self.groups_of[var]:
+                used[gi].discard(value)
+            self._count_limits(var, value, counts, -1)
+
+        def search(i, unmet):
+            if i == len(self.variables):
+                return True
+            var = self.variables[i]
+            no_fat = any(p in assignment and assignment[p] in self.high_fat for p in self.partners[var])
+            excluded = set()
+            for gi in self.groups_of[var]:
+                excluded |= used[gi]
+            for p in self.partners[var]:
+                if p in assignment:
+                    excluded.add(assignment[p])
+            scope_mask = self._scope[var]
+            # Firme già risultate inconsistenti a questo nodo: stessi conteggi, stesso esito
+            failed = set()
+
+            for value in self.domains[var]:
+                if value in excluded:
+                    stats.reject('all_different')
+                    continue
+                if no_fat and value in self.high_fat:
+                    stats.reject('fat_limit_constraint')
+                    continue
+                if self.limits_of[var]:
+                    limite = self._over_limit(var, value, counts)
+                    if limite is not None:
+                        stats.reject(limite)
+                        continue
+                key = self._signature(value, scope_mask)
+                if key in failed:
+                    continue
+                if deadline is not None and time.monotonic() > deadline:
+                    raise TimeoutError
+                if should_stop is not None and should_stop():
+                    raise SolveCancelled
+                stats.nodes += 1
+                assign(var, value)
+                new_unmet = unmet & ~key[0]
+                if self._consistent(assignment, used, new_unmet, stats):
+                    if search(i + 1, new_unmet):
+                        return True
+                else:
+                    failed.add(key)
+                unassign(var)
+                stats.backtracks += 1
+            return False
+
+        try:
+            if self._consistent(assignment, used, self.full_mask, stats) and search(0, self.full_mask):
+                stats.status = OK
+            else:
+                stats.status = UNSAT
+                assignment = None
+        except SolveCancelled:
+            stats.status = CANCELLED
+            assignment = None
+        except TimeoutError:
+            if best_effort:
+                stats.status = BEST_EFFORT
+                assignment = self._complete_greedy(assignment, used, counts)
+            else:
+                stats.status = TIMEOUT
+                assignment = None
+
+        if assignment is not None:
+            unmet = self._unmet(assignment)
+            stats.unmet = [name for i, (name, _, _) in enumerate(self.requirements) if unmet & (1 << i)]
+        stats.elapsed = time.monotonic() - start
+        return assignment, stats
+
+    # Completamento senza backtracking: rispetta AllDifferent, le coppie e i limiti,
+    # preferendo i valori che soddisfano requisiti ancora mancanti
+    def _complete_greedy(self, assignment, used, counts):
+        assignment = dict(assignment)
+        for var in self.variables:
+            if var in assignment:
+                continue
+            unmet = self._unmet(assignment)
+            no_fat = any(p in assignment and assignment[p] in self.high_fat for p in self.partners[var])
+            excluded = set()
+            for gi in self.groups_of[var]:
+                excluded |= used[gi]
+            excluded.update(assignment[p] for p in self.partners[var] if p in assignment)
+            best = None
+            for value in self.domains[var]:
+                if value in excluded or (no_fat and value in self.high_fat):
+                    continue
+                if self.limits_of[var] and self._over_limit(var, value, counts) is not None:
+                    continue
+                if best is None:
+                    best = value
+                if self._signature(value, self._scope[var])[0] & unmet:
+                    best = value
+                    break
+            if best is None:
+                return None
+            assignment[var] = best
+            for gi in self.groups_of[var]:
+                used[gi].add(best)
+            self._count_limits(var, best, counts, 1)
+        return assignment
+
+
+# --- OTTIMIZZAZIONE: I MIGLIORI K MENU ---
+# Beam search sulle stesse variabili e sugli stessi vincoli di MenuSolver.
+# Il punteggio di un menu è la somma dei punteggi delle singole ricette
+# (unary: valore -> punteggio) più diversity per ogni ingrediente nuovo che la
+# ricetta aggiunge alla settimana (items: valore -> insieme di ingredienti).
+# I domini sono indicizzati per firma e ordinati per punteggio: ad ogni livello
+# ogni stato si espande con i migliori valori di ciascuna firma, così anche i
+# valori che soddisfano i requisiti "almeno uno" restano tra i candidati.
+# Gli stati si tengono solo se la propagazione (_consistent) li ammette.
+class MenuOptimizer(MenuSolver):
+    def __init__(self, variables, domains, unary, items=None, diversity=0.0, **kwargs):
+        super().__init__(variables, domains, **kwargs)
+        self.unary = unary
+        self.items = items or {}
+        self.diversity = diversity
+        # Domini indicizzati: var -> [valori della firma, in ordine di punteggio decrescente]
+        self._ranked = {}
+        condivisi = {}
+        for v in self.variables:
+            key = (id(self._domain_set[v]), self._scope[v])
+            if key not in condivisi:
+                gruppi = {}
+                for value in sorted(self._domain_set[v], key=lambda x: -unary.get(x, 0.0)):
+                    gruppi.setdefault(self._signature(value, self._scope[v]), []).append(value)
+                condivisi[key] = list(gruppi.values())
+            self._ranked[v] = condivisi[key]
+
+    def score(self, assignment):
+        visti = set()
+        totale = 0.0
+        for var in self.variables:
+            if var in assignment:
+                value = assignment[var]
+                ingredienti = self.items.get(value, ())
+                totale += self.unary.get(value, 0.0) + self.diversity * len(set(ingredienti) - visti)
+                visti.update(ingredienti)
+        return totale
+
+    # ripetuti: valore -> volte in cui compare nei menu già scelti. Per ogni firma
+    # si propongono i per_group migliori valori non ripetuti (e al più per_group
+    # ripetuti, che il fascio penalizza): altrimenti i passaggi successivi di
+    # top_k vedrebbero sempre le stesse ricette.
+    def _candidates(self, var, assignment, used, per_group, ripetuti=None):
+        no_fat = any(p in assignment and assignment[p] in self.high_fat for p in self.partners[var])
+        excluded = set()
+        for gi in self.groups_of[var]:
+            excluded |= used[gi]
+        for p in self.partners[var]:
+            if p in assignment:
+                excluded.add(assignment[p])
+        for valori in self._ranked[var]:
+            presi = gia_visti = 0
+            for value in valori:
+                if value in excluded or (no_fat and value in self.high_fat):
+                    continue
+                if ripetuti and value in ripetuti:
+                    if gia_visti >= per_group:
+                        continue
+                    gia_visti += 1
+                else:
+                    presi += 1
+                yield value
+                if presi >= per_group:
+                    break
+
+    # Un passaggio di beam search: menu completi del fascio finale, in ordine di
+    # punteggio (con 'penalty' in meno per ogni ripetizione di un valore già scelto)
+    def _beam(self, beam_width, per_group, ripetuti, penalty, deadline, stats):
+        beam = [(0.0, {}, [set() for _ in self.groups], self.full_mask, frozenset())]
+        for var in self.variables:
+            if deadline is not None and time.monotonic() > deadline:
+                # Tempo scaduto: si prosegue con il solo stato migliore
+                beam = beam[:1]
+                stats.status = BEST_EFFORT
+            figli = []
+            for pi, (punteggio, assignment, used, unmet, visti) in enumerate(beam):
+                for value in self._candidates(var, assignment, used, per_group, ripetuti):
+                    ingredienti = self.items.get(value, ())
+                    guadagno = self.unary.get(value, 0.0) - penalty * ripetuti.get(value, 0)
+                    if self.diversity:
+                        guadagno += self.diversity * len(set(ingredienti) - visti)
+                    figli.append((punteggio + guadagno, pi, value))
+            figli.sort(key=lambda f: -f[0])
+
+            nuovo = []
+            larghezza = 1 if stats.status == BEST_EFFORT else beam_width
+            for punteggio, pi, value in figli:
+                if len(nuovo) >= larghezza:
+                    break
+                _, assignment, used, unmet, visti = beam[pi]
+                assignment = dict(assignment)
+                assignment[var] = value
+                used = [u | {value} if gi in self.groups_of[var] else u for gi, u in enumerate(used)]
+                new_unmet = unmet & ~self._signature(value, self._scope[var])[0]
+                stats.nodes += 1
+                if not self._consistent(assignment, used, new_unmet, stats):
+                    stats.backtracks += 1
+                    continue
+                nuovo.append((punteggio, assignment, used, new_unmet, visti | frozenset(self.items.get(value, ()))))
+            beam = nuovo
+            if not beam:
+                break
+        return [assignment for _, assignment, _, unmet, _ in beam
+                if len(assignment) == len(self.variables) and not unmet]
+
+    # Restituisce ([(punteggio, assegnamento)] in ordine decrescente, stats).
+    # min_diff: numero minimo di pasti diversi tra due menu restituiti. Gli stati
+    # di un solo fascio condividono quasi tutto il prefisso, quindi i menu si
+    # cercano in più passaggi: dopo ogni passaggio le ricette dei menu scelti
+    # costano 'penalty' (default: deviazione standard dei punteggi) per ogni
+    # volta che sono già comparse, e la penalità raddoppia se un passaggio non
+    # trova menu abbastanza diversi.
+    def top_k(self, k=5, beam_width=None, per_group=3, min_diff=7, timeout=5.0, penalty=None):
+        stats = SolverStats()
+        start = time.monotonic()
+        deadline = start + timeout if timeout is not None else None
+        beam_width = beam_width or max(4 * k, 20)
+        if penalty is None:
+            penalty = statistics.pstdev(self.unary.values()) if self.unary else 0.0
+            penalty = penalty or 1.0
+
+        if not self._consistent({}, [set() for _ in self.groups], self.full_mask, stats):
+            stats.status = UNSAT
+            stats.elapsed = time.monotonic() - start
+            return [], stats
+
+        risultati = []
+        ripetuti = Counter()
+        for _ in range(2 * k):
+            trovati = 0
+            for assignment in self._beam(beam_width, per_group, ripetuti, penalty, deadline, stats):
+                if all(sum(assignment[v] != altro[v] for v in self.variables) >= min_diff for _, altro in risultati):
+                    risultati.append((self.score(assignment), assignment))
+                    ripetuti.update(assignment.values())
+                    trovati += 1
+                    if len(risultati) >= k:
+                        break
+            if len(risultati) >= k or stats.status == BEST_EFFORT:
+                break
+            if not trovati:
+                penalty *= 2
+        risultati.sort(key=lambda r: -r[0])
+
+        if not risultati:
+            # Fascio esaurito (candidati troppo pochi per i vincoli): una soluzione qualsiasi
+            restante = None if deadline is None else max(0.0, deadline - time.monotonic())
+            assignment, ricerca = self.solve(timeout=restante)
+            stats.merge(ricerca)
+            stats.status = ricerca.status
+            if assignment is not None:
+                risultati.append((self.score(assignment), assignment))
+        elif stats.status is None:
+            stats.status = OK
+        stats.elapsed = time.monotonic() - start
+        return risultati, stats
@@ -0,0 +1,246 @@
+import concurrent.futures
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import time
+import numpy as np
+import scipy.sparse as sp
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.metrics import classification_report, roc_auc_score
+from sklearn.model_selection import StratifiedKFold
+
+# --- VALUTAZIONE PARALLELA DEI CANDIDATI (CROSS-VALIDATION) ---
+# Ogni configurazione candidata viene valutata in k fold; le coppie
+# (candidato, fold) girano in parallelo in un pool di processi, una foresta a
+# thread singolo per processo. La matrice di training (CSR o densa), le
+# etichette e l'assegnazione dei fold vengono scritte una volta in .npy nella
+# cartella di cache (chiave: hash dei dati) e i worker le aprono con
+# mmap_mode='r': nessuna copia della matrice per ogni task.
+# Per ogni fold si salvano le probabilità sul fold di validazione e i tempi di
+# fit e predict, con chiave l'hash dei parametri: rieseguendo la valutazione
+# sugli stessi dati i fold già calcolati vengono letti dalla cache. Dalle
+# probabilità out-of-fold si ricavano le metriche del report consolidato
+# (per classe, ROC-AUC, latenze di fit e predict per modello).
+
+CACHE_DIR = "cv_cache"
+REPORT_VERSION = 1
+
+# Stato dei worker: (X, y, fold di ogni riga, classi)
+_DATI = None
+
+
+def _hash(*parts):
+    h = hashlib.sha1()
+    for p in parts:
+        h.update(p if isinstance(p, bytes) else json.dumps(p, sort_keys=True, default=str).encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+def param_hash(params, random_state):
+    return _hash({'model': 'RandomForestClassifier', 'params': params, 'random_state': random_state})
+
+
+def _save_npy(path, array):
+    tmp = path + ".tmp.npy"
+    np.save(tmp, array)
+    os.replace(tmp, path)
+
+
+# --- MATRICE CONDIVISA SU DISCO ---
+def _matrix_arrays(X):
+    if sp.issparse(X):
+        X = X.tocsr()
+        return {'data': X.data, 'indices': X.indices, 'indptr': X.indptr}, list(X.shape)
+    return {'dense': np.ascontiguousarray(X)}, list(X.shape)
+
+
+def write_dataset(directory, X, y, cv, random_state):
+    arrays, shape = _matrix_arrays(X)
+    y = np.asarray(y).astype(str)
+    key = _hash(*(np.ascontiguousarray(a).tobytes() for a in arrays.values()), y.tobytes(),
+                {'shape': shape, 'cv': cv, 'random_state': random_state})
+    cartella = os.path.join(directory, key)
+    manifest = os.path.join(cartella, "dataset.json")
+    if not os.path.exists(manifest):
+        os.makedirs(cartella, exist_ok=True)
+        for nome, a in arrays.items():
+            _save_npy(os.path.join(cartella, f"X.{nome}.npy"), a)
+        _save_npy(os.path.join(cartella, "y.npy"), y)
+        fold = np.empty(len(y), dtype=np.int8)
+        for k, (_, va) in enumerate(StratifiedKFold(n_splits=cv, shuffle=True,
+                                                    random_state=random_state).split(np.zeros(len(y)), y)):
+            fold[va] = k
+        _save_npy(os.path.join(cartella, "fold.npy"), fold)
+        # Il manifest per ultimo: una scrittura interrotta viene rifatta
+        with open(manifest + ".tmp", 'w') as f:
+            json.dump({'shape': shape, 'sparse': 'dense' not in arrays, 'cv': cv,
+                       'random_state': random_state}, f)
+        os.replace(manifest + ".tmp", manifest)
+    return cartella
+
+
+def open_dataset(cartella):
+    with open(os.path.join(cartella, "dataset.json"), 'r') as f:
+        meta = json.load(f)
+    carica = lambda nome: np.load(os.path.join(cartella, f"{nome}.npy"), mmap_mode='r')
+    if meta['sparse']:
+        X = sp.csr_matrix((carica('X.data'), carica('X.indices'), carica('X.indptr')),
+                          shape=tuple(meta['shape']), copy=False)
+    else:
+        X = carica('X.dense')
+    y = np.asarray(carica('y'))
+    return X, y, np.asarray(carica('fold')), meta
+
+
+def _init_worker(cartella):
+    global _DATI
+    X, y, fold, _ = open_dataset(cartella)
+    _DATI = (X, y, fold, np.unique(y))
+
+
+def _fit_fold(cartella, params, random_state, k):
+    if _DATI is None:
+        _init_worker(cartella)
+    X, y, fold, classi = _DATI
+    tr, va = np.flatnonzero(fold != k), np.flatnonzero(fold == k)
+    model = RandomForestClassifier(**params, random_state=random_state, n_jobs=1)
+    start = time.perf_counter()
+    model.fit(X[tr], y[tr])
+    fit_s = time.perf_counter() - start
+    start = time.perf_counter()
+    proba = model.predict_proba(X[va])
+    predict_s = time.perf_counter() - start
+    # Colonne sempre nell'ordine di tutte le classi, anche se un fold ne manca una
+    completa = np.zeros((len(va), len(classi)))
+    completa[:, np.searchsorted(classi, model.classes_)] = proba
+    return completa, fit_s, predict_s
+
+
+# --- METRICHE ---
+def evaluate_predictions(y_true, proba, classes):
+    y_true = np.asarray(y_true).astype(str)
+    classes = np.asarray(classes).astype(str)
+    y_pred = classes[np.argmax(proba, axis=1)]
+    report = classification_report(y_true, y_pred, labels=classes, output_dict=True, zero_division=0)
+    per_classe = {c: {'precision': report[c]['precision'], 'recall': report[c]['recall'],
+                      'f1': report[c]['f1-score'], 'support': int(report[c]['support']),
+                      'roc_auc': float(roc_auc_score(y_true == c, proba[:, i]))
+                      if 0 < (y_true == c).sum() < len(y_true) else None}
+                  for i, c in enumerate(classes)}
+    return {'accuracy': float(np.mean(y_pred == y_true)),
+            'roc_auc': float(roc_auc_score(y_true, proba, multi_class='ovr', labels=classes)),
+            'macro_f1': report['macro avg']['f1-score'],
+            'per_class': per_classe}
+
+
+class EvaluationEngine:
+    def __init__(self, X, y, cv=3, random_state=42, workers=None, cache_dir=CACHE_DIR):
+        self.cv = cv
+        self.random_state = random_state
+        self.workers = workers or os.cpu_count() or 1
+        self.cartella = write_dataset(cache_dir, X, y, cv, random_state)
+        _, self.y, self.fold, self.meta = open_dataset(self.cartella)
+        self.classes = np.unique(self.y)
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def _fold_path(self, chiave, k):
+        return os.path.join(self.cartella, f"{chiave}.fold{k}.npz")
+
+    def _read_fold(self, chiave, k):
+        try:
+            with np.load(self._fold_path(chiave, k)) as f:
+                return f['proba'], float(f['fit_s']), float(f['predict_s'])
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            return None
+
+    def _write_fold(self, chiave, k, risultato):
+        proba, fit_s, predict_s = risultato
+        tmp = self._fold_path(chiave, k) + ".tmp"
+        with open(tmp, 'wb') as f:
+            np.savez(f, proba=proba, fit_s=fit_s, predict_s=predict_s)
+        os.replace(tmp, self._fold_path(chiave, k))
+
+    # candidates: [(nome, parametri)]; restituisce un risultato per candidato,
+    # ordinati per ROC-AUC out-of-fold decrescente
+    def evaluate(self, candidates):
+        chiavi = [param_hash(params, self.random_state) for _, params in candidates]
+        folds = {}
+        da_calcolare = []
+        for chiave, (_, params) in zip(chiavi, candidates):
+            for k in range(self.cv):
+                if (chiave, k) in folds:
+                    continue
+                risultato = self._read_fold(chiave, k)
+                if risultato is None:
+                    self.cache_misses += 1
+                    folds[(chiave, k)] = None
+                    da_calcolare.append((chiave, params, k))
+                else:
+                    self.cache_hits += 1
+                    folds[(chiave, k)] = risultato
+
+        if da_calcolare:
+            print(f"Valutazione di {len(da_calcolare)} fold su {min(self.workers, len(da_calcolare))} processi "
+                  f"({self.cache_hits} dalla cache)")
+            metodo = 'fork' if 'fork' in mp.get_all_start_methods() else None
+            with concurrent.futures.ProcessPoolExecutor(
+                    min(self.workers, len(da_calcolare)), mp_context=mp.get_context(metodo),
+                    initializer=_init_worker, initargs=(self.cartella,)) as pool:
+                futures = {pool.submit(_fit_fold, self.cartella, params, self.random_state, k): (chiave, k)
+                           for chiave, params, k in da_calcolare}
+                for i, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                    chiave, k = futures[future]
+                    folds[(chiave, k)] = future.result()
+                    self._write_fold(chiave, k, folds[(chiave, k)])
+                    if i % max(1, len(futures) // 10) == 0 or i == len(futures):
+                        print(f"  fold completati: {i}/{len(futures)}")
+
+        risultati = []
+        for chiave, (nome, params) in zip(chiavi, candidates):
+            oof = np.zeros((len(self.y), len(self.classes)))
+            fit_s, predict_s = [], []
+            for k in range(self.cv):
+                proba, f_s, p_s = folds[(chiave, k)]
+                oof[self.fold == k] = proba
+                fit_s.append(f_s)
+                predict_s.append(p_s)
+            risultati.append({'name': nome, 'params': params, 'param_hash': chiave,
+                              **evaluate_predictions(self.y, oof, self.classes),
+                              'fit_s_mean': float(np.mean(fit_s)),
+                              'predict_ms_per_1k': float(sum(predict_s) / len(self.y) * 1e6)})
+        risultati.sort(key=lambda r: -r['roc_auc'])
+        return risultati
+
+    def report(self, risultati, test=None, seconds=None):
+        return {'version': REPORT_VERSION,
+                'dataset': {'rows': int(self.meta['shape'][0]), 'features': int(self.meta['shape'][1]),
+                            'sparse': self.meta['sparse'], 'classes': self.classes.tolist(),
+                            'cache': self.cartella},
+                'cv': self.cv, 'workers': self.workers,
+                'cache': {'hits': self.cache_hits, 'misses': self.cache_misses},
+                'seconds': seconds, 'best': risultati[0]['name'] if risultati else None,
+                'candidates': risultati, 'test': test}
+
+
+def print_report(report):
+    print('\n--- VALUTAZIONE DEI CANDIDATI (cross-validation) ---')
+    print(f"  {'candidato':14} {'ROC-AUC':>8} {'acc':>7} {'macro F1':>9} {'fit s':>8} {'pred ms/1k':>11}")
+    for r in report['candidates']:
+        print(f"  {r['name']:14} {r['roc_auc']:8.4f} {r['accuracy']:7.4f} {r['macro_f1']:9.4f} "
+              f"{r['fit_s_mean']:8.2f} {r['predict_ms_per_1k']:11.2f}")
+    print(f"  cache fold: {report['cache']['hits']} letti, {report['cache']['misses']} calcolati")
+    test = report.get('test')
+    if test:
+        print(f"\nTest ({test['model']}): ROC-AUC {test['roc_auc']:.4f}, accuracy {test['accuracy']:.4f}, "
+              f"fit {test['fit_s']:.2f}s, predict {test['predict_ms_per_1k']:.2f} ms/1k righe")
+        for c, m in test['per_class'].items():
+            auc = f"{m['roc_auc']:.4f}" if m['roc_auc'] is not None else "-"
+            print(f"  {c:10} precision {m['precision']:.3f}  recall {m['recall']:.3f}  "
+                  f"f1 {m['f1']:.3f}  AUC {auc}  n={m['support']}")
+
+
+def save_report(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,290 @@
+import argparse
+import contextlib
+import io
+import json
+import sys
+import time
+from collections import deque
+import numpy as np
+import CSP
+import instrumentation
+import menu_solver
+
+# --- PIANIFICAZIONE SU PIÙ SETTIMANE ---
+# Orizzonte di N settimane risolto una settimana alla volta con menu_solver,
+# sullo stesso modello settimanale di CSP.build_menu_model (domini del profilo,
+# coppie pranzo/cena, requisiti "almeno uno a settimana"), più due vincoli di
+# varietà che attraversano le settimane:
+#   - nessuna ripetizione di un pranzo o di una cena entro 'window' giorni
+#     (window >= 7): nella settimana un AllDifferent su tutti i pasti principali,
+#     verso le settimane precedenti i titoli dei giorni ancora nella finestra
+#     vengono tolti dal dominio di ogni giorno
+#   - al più 'cap' pasti con un ingrediente in ogni finestra mobile di
+#     'cap_days' giorni (tutti i pasti): un limite di menu_solver per finestra,
+#     con il massimo ridotto dei pasti già pianificati nei giorni precedenti
+# Delle settimane passate resta solo la coda che cade ancora nelle finestre
+# (max(window, cap_days) giorni): ogni settimana ha lo stesso numero di
+# variabili e vincoli, quindi il tempo cresce linearmente con l'orizzonte.
+# monolithic_plan risolve invece tutto l'orizzonte in un solo modello (per il
+# confronto di bench: variabili e finestre crescono con le settimane).
+#
+#   python planner.py plan --weeks 4 --window 14 --cap salmon=2 --taste savory
+#   python planner.py bench --weeks 1 2 4 8 --monolithic-max 2
+
+PRINCIPALI = ["Pranzo", "Cena"]
+
+
+# Ingrediente (token del vocabolario dell'archivio, come nei fatti contains)
+# -> titoli la cui ricetta (l'ultima riga del titolo, come nel CSP) lo contiene
+def ingredient_titles(store, ingrediente):
+    ids = np.flatnonzero(store.vocabulary == ingrediente)
+    if not len(ids):
+        raise KeyError(ingrediente)
+    righe = np.repeat(np.arange(len(store)), np.diff(store.indptr))[np.isin(store.indices, ids)]
+    righe = set(righe.tolist())
+    return frozenset(t for t, r in store.title_rows().items() if r in righe)
+
+
+def _var(giorno, pasto):
+    return f"{CSP.GIORNI[giorno % 7]}_{pasto}"
+
+
+class MenuPlanner:
+    def __init__(self, store, index, user_data, preferred_taste, window=14, caps=None, cap_days=7,
+                 timeout=5.0, seed=0, cache=CSP.DOMAIN_CACHE):
+        if window < 7:
+            raise ValueError("window deve essere almeno 7 giorni (una settimana senza ripetizioni)")
+        self.store = store
+        self.index = index
+        self.user_data = user_data
+        self.preferred_taste = preferred_taste
+        self.window = window
+        self.cap_days = cap_days
+        self.timeout = timeout
+        self.seed = seed
+        self.cache = cache
+        # ingrediente -> (titoli che lo contengono, massimo per finestra)
+        self.caps = {ing: (ingredient_titles(store, ing), int(n)) for ing, n in (caps or {}).items()}
+        # Coda dei giorni già pianificati: (giorno assoluto, pasto -> titolo)
+        self.history = deque(maxlen=max(window, cap_days))
+        self.stats = menu_solver.SolverStats()
+
+    # Domini della settimana senza i pasti principali ancora nella finestra
+    def _domains(self, modello, settimana):
+        domini = {}
+        for k in range(7):
+            giorno = settimana * 7 + k
+            vietati = set()
+            for passato, pasti in self.history:
+                if giorno - passato < self.window:
+                    vietati.update(pasti[pt] for pt in PRINCIPALI)
+            for pt in CSP.PASTI_TIPO:
+                var = _var(k, pt)
+                dominio = modello.domini[var]
+                domini[var] = [t for t in dominio if t not in vietati] if vietati and pt in PRINCIPALI else dominio
+        return domini
+
+    # Un limite per ingrediente e per finestra che finisce in un giorno della settimana
+    def _limits(self, settimana):
+        limiti = []
+        for ing, (titoli, massimo) in self.caps.items():
+            for k in range(7):
+                fine = settimana * 7 + k
+                inizio = fine - self.cap_days + 1
+                gia = sum(1 for passato, pasti in self.history if passato >= inizio
+                          for t in pasti.values() if t in titoli)
+                scope = [_var(g % 7, pt) for g in range(max(inizio, settimana * 7), fine + 1)
+                         for pt in CSP.PASTI_TIPO]
+                limiti.append((f"cap.{ing}", titoli, scope, max(0, massimo - gia)))
+        return limiti
+
+    def solve_week(self, settimana):
+        with contextlib.redirect_stdout(io.StringIO()):
+            modello = CSP.build_menu_model(self.user_data, self.preferred_taste, self.store, self.index,
+                                           self.cache, seed=self.seed + settimana)
+        if modello is None:
+            return None, None
+        opzioni = modello.solver_options()
+        principali = [v for v in modello.variabili if v.split('_')[1] in PRINCIPALI]
+        opzioni['groups'] = [principali]
+        opzioni['limits'] = self._limits(settimana)
+        risolutore = menu_solver.MenuSolver(modello.variabili, self._domains(modello, settimana), **opzioni)
+        soluzione, stats = risolutore.solve(timeout=self.timeout)
+        instrumentation.record_search('planner', stats)
+        self.stats.merge(stats)
+        return soluzione, stats
+
+    # Una settimana alla volta (generatore): {'week', 'status', 'menu', 'seconds', 'nodes'}.
+    # Una settimana senza soluzione chiude il piano.
+    def plan(self, weeks):
+        for settimana in range(weeks):
+            start = time.perf_counter()
+            with instrumentation.stage('planner.week'):
+                soluzione, stats = self.solve_week(settimana)
+            risultato = {'week': settimana + 1, 'seconds': round(time.perf_counter() - start, 4),
+                         'nodes': stats.nodes if stats is not None else 0}
+            if not soluzione:
+                risultato['status'] = stats.status if stats is not None else 'no_menu'
+                risultato['menu'] = None
+                yield risultato
+                return
+            menu = {g: {pt: soluzione[f"{g}_{pt}"] for pt in CSP.PASTI_TIPO} for g in CSP.GIORNI}
+            for k, g in enumerate(CSP.GIORNI):
+                self.history.append((settimana * 7 + k, menu[g]))
+            risultato['status'] = menu_solver.OK
+            risultato['menu'] = menu
+            yield risultato
+
+
+# --- MODELLO UNICO SULL'INTERO ORIZZONTE (confronto) ---
+# Stessi vincoli in un solo MenuSolver: un AllDifferent per ogni finestra di
+# 'window' giorni, requisiti e limiti per ogni settimana / finestra.
+def monolithic_plan(store, index, user_data, preferred_taste, weeks, window=14, caps=None, cap_days=7,
+                    timeout=60.0, seed=0, cache=CSP.DOMAIN_CACHE):
+    with contextlib.redirect_stdout(io.StringIO()):
+        modello = CSP.build_menu_model(user_data, preferred_taste, store, index, cache, seed=seed)
+    if modello is None:
+        return None, None
+    giorni = weeks * 7
+    nome = lambda g, pt: f"S{g // 7 + 1}_{CSP.GIORNI[g % 7]}_{pt}"
+    variabili = [nome(g, pt) for g in range(giorni) for pt in CSP.PASTI_TIPO]
+    domini = {nome(g, pt): modello.domini[_var(g, pt)] for g in range(giorni) for pt in CSP.PASTI_TIPO}
+    gruppi = [[nome(g, pt) for g in range(s, min(s + window, giorni)) for pt in PRINCIPALI]
+              for s in range(max(1, giorni - window + 1))]
+    coppie = [(nome(g, "Pranzo"), nome(g, "Cena")) for g in range(giorni)]
+    requisiti = [(f"{n}.S{w + 1}", valori, [nome(w * 7 + k, pt) for k in range(7) for pt in PRINCIPALI])
+                 for w in range(weeks) for n, valori, _ in modello.requisiti]
+    limiti = []
+    for ing, n in (caps or {}).items():
+        titoli = ingredient_titles(store, ing)
+        for fine in range(giorni):
+            limiti.append((f"cap.{ing}", titoli,
+                           [nome(g, pt) for g in range(max(0, fine - cap_days + 1), fine + 1) for pt in CSP.PASTI_TIPO],
+                           int(n)))
+    risolutore = menu_solver.MenuSolver(variabili, domini, gruppi, coppie, modello.high_fat, requisiti, limiti)
+    soluzione, stats = risolutore.solve(timeout=timeout)
+    instrumentation.record_search('planner.monolithic', stats)
+    return soluzione, stats
+
+
+# --- BENCHMARK: tempo di risoluzione al crescere delle settimane ---
+def bench(store, index, user_data, preferred_taste, weeks_list, window=14, caps=None, cap_days=7,
+          monolithic_max=0, timeout=60.0, seed=0):
+    righe = []
+    for weeks in weeks_list:
+        planner = MenuPlanner(store, index, user_data, preferred_taste, window, caps, cap_days, timeout, seed)
+        start = time.perf_counter()
+        settimane = list(planner.plan(weeks))
+        riga = {'weeks': weeks, 'variables': 21 * weeks, 'planner_s': round(time.perf_counter() - start, 4),
+                'planner_status': settimane[-1]['status'] if len(settimane) == weeks else 'incomplete',
+                'planner_nodes': planner.stats.nodes}
+        riga['planner_s_per_week'] = round(riga['planner_s'] / weeks, 4)
+        if weeks <= monolithic_max:
+            start = time.perf_counter()
+            _, stats = monolithic_plan(store, index, user_data, preferred_taste, weeks, window, caps, cap_days,
+                                       timeout, seed)
+            riga['monolithic_s'] = round(time.perf_counter() - start, 4)
+            riga['monolithic_status'] = stats.status if stats is not None else 'no_menu'
+            riga['monolithic_nodes'] = stats.nodes if stats is not None else 0
+        righe.append(riga)
+    return righe
+
+
+def print_bench(righe):
+    print(f"  {'sett.':>5} {'variabili':>9} {'planner s':>10} {'s/sett.':>8} {'nodi':>7}  "
+          f"{'monolitico s':>12} {'nodi':>7}")
+    for r in righe:
+        mono = (f"{r['monolithic_s']:12.3f} {r['monolithic_nodes']:7}  {r['monolithic_status']}"
+                if 'monolithic_s' in r else f"{'-':>12} {'-':>7}")
+        print(f"  {r['weeks']:5} {r['variables']:9} {r['planner_s']:10.3f} {r['planner_s_per_week']:8.3f} "
+              f"{r['planner_nodes']:7}  {mono}  ({r['planner_status']})")
+
+
+def print_plan(settimane):
+    for r in settimane:
+        print(f"\n=== SETTIMANA {r['week']} ({r['status']}, {r['seconds']:.3f}s) ===")
+        if r['menu'] is None:
+            print("  Nessun menu con questi vincoli.")
+            continue
+        for g in CSP.GIORNI:
+            pasti = "  |  ".join(r['menu'][g][pt].replace('_', ' ').title() for pt in CSP.PASTI_TIPO)
+            print(f"  {g}: {pasti}")
+
+
+# --- MAIN ---
+def _caps(valori):
+    caps = {}
+    for v in valori or []:
+        ing, _, n = v.partition('=')
+        if not n.isdigit():
+            raise argparse.ArgumentTypeError(f"Limite non valido: {v} (formato ingrediente=N)")
+        caps[ing.strip().lower()] = int(n)
+    return caps
+
+
+def main(argv=None):
+    import kb_snapshot
+    parser = argparse.ArgumentParser(description="Menu su più settimane con vincoli di varietà")
+    parser.add_argument('comando', choices=['plan', 'bench'])
+    parser.add_argument('--weeks', type=int, nargs='+', default=None,
+                        help="settimane (plan: la prima; bench: default 1 2 4 8)")
+    parser.add_argument('--window', type=int, default=14, help="giorni senza ripetere un pranzo o una cena")
+    parser.add_argument('--cap', action='append', default=[], metavar='INGREDIENTE=N',
+                        help="al più N pasti con l'ingrediente ogni --cap-days giorni")
+    parser.add_argument('--cap-days', type=int, default=7)
+    parser.add_argument('--taste', default='savory', help="gusto preferito")
+    parser.add_argument('--bmi', type=float, default=22.0)
+    parser.add_argument('--sport', action='store_true')
+    parser.add_argument('--vegetarian', action='store_true')
+    parser.add_argument('--lattosio', action='store_true', help="intollerante al lattosio")
+    parser.add_argument('--noci', action='store_true', help="allergia alle noci")
+    parser.add_argument('--glutine', action='store_true', help="celiachia")
+    parser.add_argument('--timeout', type=float, default=60.0, help="timeout del solver (s)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--monolithic-max', type=int, default=2,
+                        help="bench: settimane massime anche per il modello unico")
+    parser.add_argument('--csv', default="recipes_extended.csv")
+    parser.add_argument('--limit', type=int, default=30000)
+    parser.add_argument('-o', '--output', default=None, help="plan: salva le settimane in JSONL; bench: in JSON")
+    args = parser.parse_args(argv)
+    try:
+        caps = _caps(args.cap)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    dati = kb_snapshot.load_or_build(args.csv, args.limit, as_store=True)
+    if dati is None:
+        return 1
+    store, index = dati
+    user_data = {'bmi': args.bmi, 'sport': args.sport, 'is_vegetarian': args.vegetarian,
+                 'intolleranze': {'lattosio': args.lattosio, 'noci': args.noci, 'glutine': args.glutine}}
+    try:
+        if args.comando == 'plan':
+            planner = MenuPlanner(store, index, user_data, args.taste, args.window, caps, args.cap_days,
+                                  args.timeout, args.seed)
+            settimane = []
+            out = open(args.output, 'w', encoding='utf-8') if args.output else None
+            try:
+                for r in planner.plan((args.weeks or [4])[0]):
+                    print_plan([r])
+                    settimane.append(r)
+                    if out is not None:
+                        out.write(json.dumps(r) + "\n")
+            finally:
+                if out is not None:
+                    out.close()
+            return 0 if settimane and settimane[-1]['status'] == menu_solver.OK else 1
+        righe = bench(store, index, user_data, args.taste, args.weeks or [1, 2, 4, 8], args.window, caps,
+                      args.cap_days, args.monolithic_max, args.timeout, args.seed)
+    except KeyError as e:
+        print(f"[ERRORE] Ingrediente sconosciuto: {e}")
+        return 1
+    print_bench(righe)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(righe, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,365 @@
+import argparse
+import re
+import sys
+import time
+import numpy as np
+import KB
+import kb_index
+
+# --- RICERCA DELLE RICETTE ---
+# Indice invertito ingrediente -> ricette: per ogni ingrediente una posting list
+# ordinata di id ricetta (int32, stessi id di kb_index.PredicateIndex, cioè per
+# titolo), tutte in un unico array in forma CSR. Sulle stesse liste si
+# rispondono query booleane su:
+#   - ingredienti (salmon, ing:pasta)
+#   - categorie della tassonomia (is_fish_source, cat:is_carb_source): unione
+#     delle liste dei loro ingredienti
+#   - predicati dell'indice (is_mediterranean, pred:high_fat) e fatti di base
+#     con valore (taste=sweet)
+# Come nei container di roaring, un insieme di id è una lista ordinata se sparso
+# e una bitmap (array bool su tutti gli id) se contiene più di 1/16 delle
+# ricette. Le operazioni scelgono la forma: bitmap con bitmap sono AND/OR di
+# array, lista con bitmap un lookup per elemento, due liste searchsorted sulla
+# più lunga. Il NOT resta simbolico finché possibile (A AND NOT B = A \ B) e solo
+# un NOT isolato si calcola sull'insieme di tutte le ricette.
+
+TOKEN_RE = re.compile(r'\(|\)|[^\s()]+')
+OPERATORI = {'AND', 'OR', 'NOT'}
+
+
+DENSITA_BITMAP = 16
+VUOTO = np.zeros(0, dtype=np.int32)
+
+
+def _is_bitmap(x):
+    return x.dtype == np.bool_
+
+
+# Elementi (stima per ordinare le intersezioni): le bitmap contano come dense
+def _peso(x):
+    return x.size if not _is_bitmap(x) else x.size // DENSITA_BITMAP + 1
+
+
+def _intersect(a, b):
+    if _is_bitmap(a) and _is_bitmap(b):
+        return a & b
+    if _is_bitmap(a):
+        a, b = b, a
+    if _is_bitmap(b):
+        return a[b[a]]
+    if len(a) > len(b):
+        a, b = b, a
+    if not len(a) or not len(b):
+        return VUOTO
+    pos = np.minimum(np.searchsorted(b, a), len(b) - 1)
+    return a[b[pos] == a]
+
+
+def _difference(a, b):
+    if _is_bitmap(a):
+        if _is_bitmap(b):
+            return a & ~b
+        a = a.copy()
+        a[b] = False
+        return a
+    if not len(a) or not len(b):
+        return a
+    if _is_bitmap(b):
+        return a[~b[a]]
+    pos = np.minimum(np.searchsorted(b, a), len(b) - 1)
+    return a[b[pos] != a]
+
+
+def _union(insiemi, n):
+    insiemi = [x for x in insiemi if x.size and (not _is_bitmap(x) or x.any())]
+    if not insiemi:
+        return VUOTO
+    if len(insiemi) == 1:
+        return insiemi[0]
+    liste = [x for x in insiemi if not _is_bitmap(x)]
+    if len(liste) == len(insiemi) and sum(len(x) for x in liste) * DENSITA_BITMAP < n:
+        return np.unique(np.concatenate(liste))
+    risultato = np.zeros(n, dtype=bool)
+    for x in insiemi:
+        if _is_bitmap(x):
+            risultato |= x
+        else:
+            risultato[x] = True
+    return risultato
+
+
+# Forma compatta per un insieme ordinato di id: bitmap se denso
+def _contenitore(ids, n):
+    if len(ids) * DENSITA_BITMAP > n:
+        bitmap = np.zeros(n, dtype=bool)
+        bitmap[ids] = True
+        return bitmap
+    return np.asarray(ids, dtype=np.int32)
+
+
+class SearchResult:
+    def __init__(self, total, ids, titles, offset, limit, elapsed_s):
+        self.total = total
+        self.ids = ids
+        self.titles = titles
+        self.offset = offset
+        self.limit = limit
+        self.elapsed_s = elapsed_s
+
+    @property
+    def has_more(self):
+        return self.offset + len(self.ids) < self.total
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __repr__(self):
+        return f"SearchResult(total={self.total}, offset={self.offset}, page={len(self.ids)})"
+
+
+class RecipeSearch:
+    def __init__(self, titles, vocabulary, indptr, postings, categories, index, values, universe):
+        # titles[id] = titolo della ricetta con quell'id
+        self.titles = titles
+        self.vocabulary = {v: i for i, v in enumerate(vocabulary)}
+        self.indptr = indptr
+        self.postings = postings
+        # categoria della tassonomia -> ingredienti
+        self.categories = categories
+        self.index = index
+        # predicato di base -> valore -> insieme di id (es. taste -> sweet)
+        self.values = values
+        # bitmap delle ricette presenti
+        self.universe = universe
+        self.n = len(universe)
+        self._cache = {}
+
+    # --- LISTE PER TERMINE ---
+    def ingredient(self, name):
+        i = self.vocabulary.get(name)
+        if i is None:
+            return VUOTO
+        ids = self.postings[self.indptr[i]:self.indptr[i + 1]]
+        if len(ids) * DENSITA_BITMAP <= self.n:
+            return ids
+        # Ingredienti molto comuni: bitmap calcolata una volta
+        chiave = ('ing', name)
+        if chiave not in self._cache:
+            self._cache[chiave] = _contenitore(ids, self.n)
+        return self._cache[chiave]
+
+    def category(self, name):
+        chiave = ('cat', name)
+        if chiave not in self._cache:
+            unione = _union([self.ingredient(i) for i in self.categories.get(name, ())], self.n)
+            self._cache[chiave] = unione if _is_bitmap(unione) else _contenitore(unione, self.n)
+        return self._cache[chiave]
+
+    def predicate(self, name):
+        chiave = ('pred', name)
+        if chiave not in self._cache:
+            self._cache[chiave] = _contenitore(np.flatnonzero(self.index.mask(name)), self.n)
+        return self._cache[chiave]
+
+    # Termine della query -> insieme di id (lista ordinata o bitmap). Senza prefisso si cerca nell'ordine:
+    # predicato dell'indice, categoria, ingrediente
+    def ids(self, term):
+        if '=' in term:
+            predicato, valore = term.split('=', 1)
+            if predicato not in self.values:
+                raise KeyError(f"Predicato con valore sconosciuto: {predicato}")
+            return self.values[predicato].get(valore, VUOTO)
+        if ':' in term:
+            tipo, nome = term.split(':', 1)
+            if tipo == 'ing':
+                return self.ingredient(nome)
+            if tipo == 'cat':
+                return self.category(nome)
+            if tipo == 'pred':
+                return self.predicate(nome)
+            raise KeyError(f"Prefisso sconosciuto: {tipo}")
+        if term in self.index.columns:
+            return self.predicate(term)
+        if term in self.categories:
+            return self.category(term)
+        return self.ingredient(term)
+
+    # --- VALUTAZIONE ---
+    # Ogni nodo restituisce (ids, negato): con negato=True il risultato è il complemento di ids
+    def _and(self, parti):
+        positivi = sorted((ids for ids, neg in parti if not neg), key=_peso)
+        negativi = [ids for ids, neg in parti if neg]
+        if not positivi:
+            return _union(negativi, self.n), True
+        risultato = positivi[0]
+        for ids in positivi[1:]:
+            risultato = _intersect(risultato, ids)
+        for ids in negativi:
+            risultato = _difference(risultato, ids)
+        return risultato, False
+
+    def _or(self, parti):
+        positivi = [ids for ids, neg in parti if not neg]
+        negativi = sorted((ids for ids, neg in parti if neg), key=_peso)
+        if not negativi:
+            return _union(positivi, self.n), False
+        # A OR NOT B OR NOT C = NOT ((B AND C) \ A)
+        esclusi = negativi[0]
+        for ids in negativi[1:]:
+            esclusi = _intersect(esclusi, ids)
+        return _difference(esclusi, _union(positivi, self.n)), True
+
+    def _risolvi(self, ids, negato):
+        return _difference(self.universe, ids) if negato else ids
+
+    # all_of AND (almeno uno di any_of) AND NOT none_of
+    def search(self, all_of=(), any_of=(), none_of=(), offset=0, limit=20):
+        start = time.perf_counter()
+        parti = [(self.ids(t), False) for t in all_of]
+        if any_of:
+            parti.append(self._or([(self.ids(t), False) for t in any_of]))
+        parti += [(self.ids(t), True) for t in none_of]
+        ids = self._risolvi(*self._and(parti)) if parti else self.universe
+        return self._pagina(ids, offset, limit, start)
+
+    # Query testuale: termini, AND / OR / NOT (anche '-termine'), parentesi;
+    # termini vicini senza operatore sono in AND. Es. "salmon is_mediterranean -walnut"
+    def query(self, text, offset=0, limit=20):
+        start = time.perf_counter()
+        tokens = TOKEN_RE.findall(text)
+        if not tokens:
+            raise ValueError("Query vuota")
+        pos = 0
+
+        def prossimo():
+            return tokens[pos] if pos < len(tokens) else None
+
+        def espressione():
+            nonlocal pos
+            parti = [congiunzione()]
+            while prossimo() == 'OR':
+                pos += 1
+                parti.append(congiunzione())
+            return parti[0] if len(parti) == 1 else self._or(parti)
+
+        def congiunzione():
+            nonlocal pos
+            parti = [negazione()]
+            while prossimo() is not None and prossimo() not in ('OR', ')'):
+                if prossimo() == 'AND':
+                    pos += 1
+                parti.append(negazione())
+            return parti[0] if len(parti) == 1 else self._and(parti)
+
+        def negazione():
+            nonlocal pos
+            t = prossimo()
+            if t == 'NOT':
+                pos += 1
+                ids, neg = negazione()
+                return ids, not neg
+            if t is not None and t.startswith('-') and len(t) > 1:
+                pos += 1
+                return self.ids(t[1:]), True
+            return atomo()
+
+        def atomo():
+            nonlocal pos
+            t = prossimo()
+            if t is None or t in OPERATORI or t == ')':
+                raise ValueError(f"Termine atteso in posizione {pos}: {t}")
+            pos += 1
+            if t == '(':
+                risultato = espressione()
+                if prossimo() != ')':
+                    raise ValueError("Parentesi non chiusa")
+                pos += 1
+                return risultato
+            return self.ids(t), False
+
+        risultato = espressione()
+        if pos != len(tokens):
+            raise ValueError(f"Token inatteso: {tokens[pos]}")
+        return self._pagina(self._risolvi(*risultato), offset, limit, start)
+
+    def _pagina(self, ids, offset, limit, start):
+        if _is_bitmap(ids):
+            totale = int(np.count_nonzero(ids))
+            if limit is None:
+                pagina = np.flatnonzero(ids)[offset:]
+            else:
+                # Si scorre solo il prefisso della bitmap che contiene la pagina
+                fine = offset + limit
+                stop = min(len(ids), fine * len(ids) // max(totale, 1) + 64)
+                posizioni = np.flatnonzero(ids[:stop])
+                while len(posizioni) < fine and stop < len(ids):
+                    stop = min(len(ids), stop * 2)
+                    posizioni = np.flatnonzero(ids[:stop])
+                pagina = posizioni[offset:fine]
+            pagina = pagina.astype(np.int32)
+        else:
+            totale = len(ids)
+            pagina = ids[offset:offset + limit] if limit is not None else ids[offset:]
+        return SearchResult(totale, pagina, self.titles[pagina].tolist(), offset, limit,
+                            time.perf_counter() - start)
+
+
+# Indice di ricerca da un dataframe o da un recipe_store.RecipeStore (con l'indice
+# dei predicati già pronto, se c'è: gli id ricetta sono i suoi)
+def build_search_index(data, index=None, kb_list=None):
+    facts = KB.build_fact_tables(data)
+    if index is None:
+        index = kb_index.build_predicate_index(None, kb_list, facts)
+    ids_titoli = index.ids_of(facts.titles.tolist())
+    if (ids_titoli < 0).any():
+        raise ValueError("Indice dei predicati non allineato alle ricette")
+
+    # Coppie (ingrediente, ricetta) distinte, ordinate per ingrediente e poi per id
+    ricette = ids_titoli[facts.title_codes[facts.contains_rows]]
+    n = len(index)
+    coppie = np.unique(facts.contains_ings.astype(np.int64) * n + ricette)
+    ingredienti = coppie // n
+    indptr = np.zeros(len(facts.vocabulary) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(ingredienti, minlength=len(facts.vocabulary)), out=indptr[1:])
+    postings = (coppie % n).astype(np.int32)
+
+    categories, _ = kb_index._parse_domain_knowledge(kb_list or KB.domain_knowledge())
+    values = {}
+    for predicate, (codes, uniques) in facts.values.items():
+        ids_riga = ids_titoli[facts.title_codes]
+        values[predicate] = {str(u): _contenitore(np.unique(ids_riga[codes == i]), n)
+                             for i, u in enumerate(uniques.tolist())}
+    universe = np.zeros(n, dtype=bool)
+    universe[ids_titoli] = True
+    return RecipeSearch(index.titles, facts.vocabulary.tolist(), indptr, postings,
+                        categories, index, values, universe)
+
+
+def main(argv=None):
+    import kb_snapshot
+    parser = argparse.ArgumentParser(description="Ricerca booleana delle ricette")
+    parser.add_argument('query', help="es. \"salmon AND is_mediterranean AND NOT walnut\"")
+    parser.add_argument('--offset', type=int, default=0)
+    parser.add_argument('--limit', type=int, default=20)
+    parser.add_argument('--csv', default="recipes_extended.csv")
+    parser.add_argument('--rows', type=int, default=30000)
+    args = parser.parse_args(argv)
+
+    dati = kb_snapshot.load_or_build(args.csv, args.rows, as_store=True)
+    if dati is None:
+        return 1
+    ricerca = build_search_index(*dati)
+    try:
+        risultato = ricerca.query(args.query, args.offset, args.limit)
+    except (ValueError, KeyError) as e:
+        print(f"[ERRORE] {e}")
+        return 1
+    print(f"{risultato.total} ricette ({risultato.elapsed_s * 1e6:.0f} µs), "
+          f"da {args.offset + 1} a {args.offset + len(risultato)}:")
+    for titolo in risultato.titles:
+        print(f" > {titolo.replace('_', ' ').title()}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
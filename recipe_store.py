@@ -0,0 +1,364 @@
+import json
+import os
+from array import array
+import numpy as np
+
+# --- ARCHIVIO COMPATTO DELLE RICETTE ---
+# Le ricette sono righe con id intero (posizione nel dataframe di origine):
+#   - titoli internati: title_codes[riga] -> indice in titles
+#   - colonne categoriche (cucina, gusto, difficoltà, is_*): codici interi + valori distinti
+#   - colonne numeriche: array NumPy
+#   - testi liberi (ingredients_raw): un buffer UTF-8 + offset in byte per riga
+#   - ingredienti: postings CSR riga -> ingrediente (indptr, indices) su un
+#     vocabolario internato; tutti i token, così 'ingredients' si ricostruisce esatto
+# Le stringhe vengono create solo quando si leggono (Recipe, record, column).
+# Con save/load gli array vanno su disco in .npy e si riaprono con mmap_mode='r'.
+
+TITLE_COLUMN = 'recipe_title'
+TOKEN_COLUMN = 'ingredients'
+TEXT_COLUMNS = ('ingredients_raw',)
+LAYOUT = "store.json"
+
+
+def _int_minimo(n):
+    for dtype in (np.int8, np.int16, np.int32):
+        if n <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+# --- STRINGHE SU DISCO (buffer UTF-8 + offset in byte) ---
+def encode_strings(values):
+    parti = [v.encode('utf-8') for v in values]
+    offsets = np.zeros(len(parti) + 1, dtype=np.int64)
+    np.cumsum([len(p) for p in parti], out=offsets[1:])
+    return np.frombuffer(b''.join(parti), dtype=np.uint8), offsets
+
+
+def save_strings(directory, name, values):
+    data, offsets = encode_strings(values)
+    np.save(os.path.join(directory, f"{name}.data.npy"), data)
+    np.save(os.path.join(directory, f"{name}.offsets.npy"), offsets)
+
+
+def decode_strings(data, offsets):
+    data = data.tobytes()
+    offsets = np.asarray(offsets).tolist()
+    return [data[a:b].decode('utf-8') for a, b in zip(offsets[:-1], offsets[1:])]
+
+
+def load_strings(directory, name):
+    return decode_strings(np.load(os.path.join(directory, f"{name}.data.npy"), mmap_mode='r'),
+                          np.load(os.path.join(directory, f"{name}.offsets.npy")))
+
+
+# Unione di due tabelle di valori distinti: (tabella estesa, codice di ogni valore di 'others')
+def merge_uniques(uniques, others):
+    import pandas as pd
+    codici = pd.Index(uniques).get_indexer(others)
+    nuovi = codici < 0
+    codici[nuovi] = len(uniques) + np.arange(int(nuovi.sum()))
+    if nuovi.any():
+        uniques = np.concatenate([uniques, np.asarray(others, dtype=object)[nuovi]])
+    return uniques, codici.astype(np.int32)
+
+
+# Righe indicate di un array a lunghezza variabile (dati + offset): (dati, nuovi offset)
+def _take_ragged(data, offsets, rows):
+    offsets = np.asarray(offsets)
+    starts = offsets[rows]
+    lengths = offsets[rows + 1] - starts
+    nuovi = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=nuovi[1:])
+    sel = np.repeat(starts - nuovi[:-1], lengths) + np.arange(nuovi[-1], dtype=np.int64)
+    return np.asarray(data)[sel], nuovi
+
+
+# Valori distinti delle colonne categoriche in JSON: stringhe, booleani, numeri (None per NaN)
+def uniques_to_json(valori):
+    return [None if isinstance(v, float) and v != v else (v.item() if hasattr(v, 'item') else v)
+            for v in valori.tolist()]
+
+
+def uniques_from_json(valori):
+    return np.array([float('nan') if v is None else v for v in valori], dtype=object)
+
+
+class Recipe:
+    # Vista su una riga dell'archivio: si usa come il dict di df.to_dict('records')
+    __slots__ = ('store', 'row')
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    def __getitem__(self, name):
+        return self.store.value(self.row, name)
+
+    def get(self, name, default=None):
+        try:
+            return self.store.value(self.row, name)
+        except KeyError:
+            return default
+
+    def keys(self):
+        return self.store.columns
+
+    def to_dict(self):
+        return self.store.record(self.row)
+
+    def __eq__(self, other):
+        return isinstance(other, Recipe) and other.store is self.store and other.row == self.row
+
+    def __hash__(self):
+        return hash((id(self.store), self.row))
+
+    def __repr__(self):
+        return f"Recipe({self.row}, {self[TITLE_COLUMN]!r})"
+
+
+class RecipeStore:
+    __slots__ = ('layout', 'titles', 'title_codes', 'categorical', 'numeric', 'texts',
+                 'vocabulary', 'indptr', 'indices', '_title_rows', '_token_lengths')
+
+    def __init__(self, layout, titles, title_codes, categorical, numeric, texts, vocabulary, indptr, indices):
+        # [(colonna, tipo)] nell'ordine del dataframe; tipo: title/tokens/category/numeric/text
+        self.layout = layout
+        self.titles = titles
+        self.title_codes = title_codes
+        # colonna -> (codici, valori distinti)
+        self.categorical = categorical
+        self.numeric = numeric
+        # colonna -> (buffer uint8, offset in byte)
+        self.texts = texts
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.indices = indices
+        self._title_rows = None
+        self._token_lengths = None
+
+    def __len__(self):
+        return len(self.title_codes)
+
+    @property
+    def columns(self):
+        return [nome for nome, _ in self.layout]
+
+    @property
+    def nbytes(self):
+        arrays = [self.title_codes, self.indptr, self.indices, *self.numeric.values()]
+        arrays += [c for c, _ in self.categorical.values()] + [a for t in self.texts.values() for a in t]
+        return int(sum(a.nbytes for a in arrays))
+
+    def _kind(self, name):
+        for nome, tipo in self.layout:
+            if nome == name:
+                return tipo
+        raise KeyError(name)
+
+    # --- LETTURA ---
+    def row_titles(self, rows=None):
+        codes = self.title_codes if rows is None else self.title_codes[rows]
+        return self.titles[codes]
+
+    def codes(self, name):
+        return self.categorical[name]
+
+    def tokens(self, row):
+        return self.vocabulary[self.indices[self.indptr[row]:self.indptr[row + 1]]].tolist()
+
+    def ingredient_ids(self, row):
+        return self.indices[self.indptr[row]:self.indptr[row + 1]]
+
+    # Id degli ingredienti con almeno min_len caratteri (quelli dei fatti contains)
+    def ingredient_set(self, row, min_len=3):
+        if self._token_lengths is None:
+            self._token_lengths = np.fromiter((len(v) for v in self.vocabulary.tolist()),
+                                              dtype=np.int64, count=len(self.vocabulary))
+        ids = self.ingredient_ids(row)
+        return frozenset(ids[self._token_lengths[ids] >= min_len].tolist())
+
+    def _text(self, name, row):
+        data, offsets = self.texts[name]
+        return data[offsets[row]:offsets[row + 1]].tobytes().decode('utf-8')
+
+    def value(self, row, name):
+        tipo = self._kind(name)
+        if tipo == 'title':
+            return self.titles[self.title_codes[row]]
+        if tipo == 'category':
+            codes, uniques = self.categorical[name]
+            return uniques[codes[row]]
+        if tipo == 'numeric':
+            return self.numeric[name][row].item()
+        if tipo == 'text':
+            return self._text(name, row)
+        return '_'.join(self.tokens(row))
+
+    # Colonna intera (o solo le righe indicate) come array
+    def column(self, name, rows=None):
+        tipo = self._kind(name)
+        if tipo == 'title':
+            return self.row_titles(rows)
+        if tipo == 'category':
+            codes, uniques = self.categorical[name]
+            return uniques[codes if rows is None else codes[rows]]
+        if tipo == 'numeric':
+            valori = self.numeric[name]
+            return np.array(valori if rows is None else valori[rows])
+        righe = range(len(self)) if rows is None else np.asarray(rows).tolist()
+        if tipo == 'text':
+            return np.array([self._text(name, r) for r in righe], dtype=object)
+        return np.array(['_'.join(self.tokens(r)) for r in righe], dtype=object)
+
+    def record(self, row):
+        return {nome: self.value(row, nome) for nome in self.columns}
+
+    def recipe(self, row):
+        return Recipe(self, int(row))
+
+    # titolo -> ultima riga con quel titolo (i titoli duplicati sono la stessa ricetta)
+    def title_rows(self):
+        if self._title_rows is None:
+            ultima = np.full(len(self.titles), -1, dtype=np.int64)
+            np.maximum.at(ultima, self.title_codes, np.arange(len(self), dtype=np.int64))
+            self._title_rows = dict(zip(self.titles.tolist(), ultima.tolist()))
+        return self._title_rows
+
+    # Righe (maschera booleana) dei titoli indicati
+    def rows_of(self, titles):
+        import pandas as pd
+        codici = pd.Index(self.titles).get_indexer(list(titles))
+        return np.isin(self.title_codes, codici[codici >= 0])
+
+    # --- MODIFICHE (aggiornamenti incrementali dello snapshot) ---
+    # Nuovo archivio con le sole righe indicate (maschera o indici): i titoli non
+    # più usati escono dalla tabella dei titoli, vocabolario e valori distinti restano
+    def take(self, rows):
+        rows = np.asarray(rows)
+        rows = np.flatnonzero(rows) if rows.dtype == bool else rows.astype(np.int64)
+        codes = np.asarray(self.title_codes)[rows]
+        usati = np.zeros(len(self.titles), dtype=bool)
+        usati[codes] = True
+        nuovo_codice = (np.cumsum(usati) - 1).astype(np.int32)
+        indices, indptr = _take_ragged(self.indices, self.indptr, rows)
+        return RecipeStore(self.layout, self.titles[usati], nuovo_codice[codes],
+                           {n: (np.asarray(c)[rows], u) for n, (c, u) in self.categorical.items()},
+                           {n: np.asarray(v)[rows] for n, v in self.numeric.items()},
+                           {n: _take_ragged(data, offsets, rows) for n, (data, offsets) in self.texts.items()},
+                           self.vocabulary, indptr, indices)
+
+    # Nuovo archivio con le righe di 'other' in coda (stesse colonne): titoli,
+    # valori distinti e ingredienti di other vengono rimappati sui codici di questo
+    def concat(self, other):
+        if other.layout != self.layout:
+            raise ValueError(f"Colonne diverse: {other.layout} invece di {self.layout}")
+        titles, mappa = merge_uniques(self.titles, other.titles)
+        title_codes = np.concatenate([np.asarray(self.title_codes), mappa[np.asarray(other.title_codes)]])
+        categorical = {}
+        for nome, (codes, uniques) in self.categorical.items():
+            o_codes, o_uniques = other.categorical[nome]
+            uniques, mappa = merge_uniques(uniques, o_uniques)
+            codes = np.concatenate([np.asarray(codes, dtype=np.int64), mappa[np.asarray(o_codes)]])
+            categorical[nome] = (codes.astype(_int_minimo(len(uniques))), uniques)
+        numeric = {n: np.concatenate([np.asarray(v), np.asarray(other.numeric[n])]) for n, v in self.numeric.items()}
+        texts = {}
+        for nome, (data, offsets) in self.texts.items():
+            o_data, o_offsets = other.texts[nome]
+            texts[nome] = (np.concatenate([np.asarray(data), np.asarray(o_data)]),
+                           np.concatenate([np.asarray(offsets), np.asarray(o_offsets)[1:] + offsets[-1]]))
+        vocabulary, mappa = merge_uniques(self.vocabulary, other.vocabulary)
+        return RecipeStore(self.layout, titles, title_codes, categorical, numeric, texts, vocabulary,
+                           np.concatenate([np.asarray(self.indptr), np.asarray(other.indptr)[1:] + self.indptr[-1]]),
+                           np.concatenate([np.asarray(self.indices), mappa[np.asarray(other.indices)]]))
+
+    # --- COSTRUZIONE / CONVERSIONE ---
+    @classmethod
+    def from_dataframe(cls, df, columns=None, text_columns=TEXT_COLUMNS):
+        import pandas as pd
+        df = df.reset_index(drop=True)
+        layout, categorical, numeric, texts = [], {}, {}, {}
+        titles = title_codes = None
+        vocabulary, indptr, indices = {}, array('q', [0]), array('i')
+        for nome in (columns or df.columns):
+            serie = df[nome]
+            if nome == TITLE_COLUMN:
+                codes, uniques = pd.factorize(serie, use_na_sentinel=False)
+                titles, title_codes = np.asarray(uniques, dtype=object), codes.astype(np.int32)
+                layout.append((nome, 'title'))
+            elif nome == TOKEN_COLUMN:
+                # Ingredienti internati al volo, senza la lista completa dei token in memoria
+                for text in serie.tolist():
+                    for ing in text.split('_'):
+                        indices.append(vocabulary.setdefault(ing, len(vocabulary)))
+                    indptr.append(len(indices))
+                layout.append((nome, 'tokens'))
+            elif nome in text_columns:
+                texts[nome] = encode_strings(['' if pd.isna(v) else str(v) for v in serie.tolist()])
+                layout.append((nome, 'text'))
+            elif pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+                numeric[nome] = serie.to_numpy()
+                layout.append((nome, 'numeric'))
+            else:
+                codes, uniques = pd.factorize(serie, use_na_sentinel=False)
+                categorical[nome] = (codes.astype(_int_minimo(len(uniques))), np.asarray(uniques, dtype=object))
+                layout.append((nome, 'category'))
+        if title_codes is None:
+            raise ValueError(f"Colonna '{TITLE_COLUMN}' mancante")
+        if len(indptr) == 1:
+            indptr = array('q', [0] * (len(df) + 1))
+        return cls(layout, titles, title_codes, categorical, numeric, texts,
+                   np.array(list(vocabulary), dtype=object),
+                   np.frombuffer(indptr, dtype=np.int64).copy(), np.frombuffer(indices, dtype=np.int32).copy())
+
+    def to_dataframe(self):
+        import pandas as pd
+        return pd.DataFrame({nome: self.column(nome) for nome in self.columns}, columns=self.columns)
+
+    # --- SALVATAGGIO / CARICAMENTO ---
+    def save(self, directory, prefix="store"):
+        os.makedirs(directory, exist_ok=True)
+        percorso = lambda nome: os.path.join(directory, f"{prefix}.{nome}.npy")
+        save_strings(directory, f"{prefix}.titles", self.titles.tolist())
+        save_strings(directory, f"{prefix}.vocabulary", self.vocabulary.tolist())
+        np.save(percorso('title_codes'), self.title_codes)
+        np.save(percorso('indptr'), self.indptr)
+        np.save(percorso('indices'), self.indices)
+        uniques = {}
+        for nome, (codes, valori) in self.categorical.items():
+            np.save(percorso(f"{nome}.codes"), codes)
+            uniques[nome] = uniques_to_json(valori)
+        for nome, valori in self.numeric.items():
+            np.save(percorso(nome), valori)
+        for nome, (data, offsets) in self.texts.items():
+            np.save(percorso(f"{nome}.data"), data)
+            np.save(percorso(f"{nome}.offsets"), offsets)
+        with open(os.path.join(directory, f"{prefix}.{LAYOUT}"), 'w') as f:
+            json.dump({'layout': self.layout, 'uniques': uniques}, f)
+
+    @classmethod
+    def load(cls, directory, prefix="store", mmap_mode='r'):
+        with open(os.path.join(directory, f"{prefix}.{LAYOUT}"), 'r') as f:
+            meta = json.load(f)
+        carica = lambda nome: np.load(os.path.join(directory, f"{prefix}.{nome}.npy"), mmap_mode=mmap_mode)
+        layout = [tuple(x) for x in meta['layout']]
+        categorical, numeric, texts = {}, {}, {}
+        for nome, tipo in layout:
+            if tipo == 'category':
+                categorical[nome] = (carica(f"{nome}.codes"), uniques_from_json(meta['uniques'][nome]))
+            elif tipo == 'numeric':
+                numeric[nome] = carica(nome)
+            elif tipo == 'text':
+                texts[nome] = (carica(f"{nome}.data"), carica(f"{nome}.offsets"))
+        return cls(layout, np.array(load_strings(directory, f"{prefix}.titles"), dtype=object),
+                   carica('title_codes'), categorical, numeric, texts,
+                   np.array(load_strings(directory, f"{prefix}.vocabulary"), dtype=object),
+                   carica('indptr'), carica('indices'))
+
+
+# Archivio per un dataframe (o l'archivio stesso). Nessuna cache globale: chi
+# converte più volte lo stesso dataframe tiene l'archivio (es. CSP.DomainCache)
+def as_store(data):
+    if isinstance(data, RecipeStore):
+        return data
+    return RecipeStore.from_dataframe(data)
@@ -0,0 +1,276 @@
+import argparse
+import ast
+import csv
+import json
+import re
+import sys
+import time
+from collections import OrderedDict
+import KB
+import cleaning
+from recipe_store import Recipe
+
+# --- LISTA DELLA SPESA E CATEGORIE NUTRIZIONALI DEI MENU ---
+# Gli ingredienti di ogni ricetta (ingredients_raw, es. "['2 cups walnut', 'cheese']")
+# vengono analizzati una sola volta in (nome, quantità, unità) e tenuti in una
+# cache per id di riga dell'archivio. Unità riconosciute: quelle che KB.clean_pl
+# rimuove (cleaning.KB_UNITS, pound/ounce scritte lb/oz); il nome è l'atomo della
+# KB (minuscolo, spazi -> underscore), quindi si confronta con KB.TAXONOMY.
+# Per ogni menu settimanale si ottengono la lista della spesa (quantità sommate
+# per ingrediente e unità, 'occurrences' conta anche le voci senza quantità) e il
+# numero di ingredienti per categoria (proteine, carboidrati, grassi, fibre).
+# I menu (es. l'output JSONL di batch_menu) si leggono e si scrivono uno alla
+# volta: la memoria dipende solo dalla cache delle ricette, non dal numero di menu.
+#
+#   python shopping_list.py menu_batch.jsonl -o spesa.jsonl
+#   python shopping_list.py menu_batch.jsonl -o spesa.csv --format csv
+
+CATEGORIES = {
+    'protein': 'is_protein_source',
+    'carb': 'is_carb_source',
+    'fat': 'is_fat_source',
+    'fiber': 'is_fiber_source',
+}
+UNIT_ALIASES = {'pound': 'lb', 'ounce': 'oz'}
+CSV_FIELDS = ['id', 'type', 'name', 'unit', 'quantity', 'count']
+
+# Quantità (intera, decimale, frazione o numero misto "1 1/2"), unità facoltativa
+# (anche al plurale), nome. Oltre alle unità della KB si riconoscono le confezioni
+# (es. "2 (8 ounce) packages cream cheese": 2 package di cream_cheese); le note
+# tra parentesi sul formato vengono scartate prima dell'analisi.
+PACKAGE_UNITS = ['package', 'can', 'jar']
+_UNITS = sorted(cleaning.KB_UNITS + PACKAGE_UNITS, key=len, reverse=True)
+ITEM_RE = re.compile(r'^\s*(\d+\s+\d+/\d+|\d+/\d+|\d+(?:\.\d+)?)?\s*(?:(' + '|'.join(_UNITS) + r')s?\b)?\s*(.*)$',
+                     flags=re.IGNORECASE)
+PAREN_RE = re.compile(r'\([^()]*\)')
+SPECIAL_RE = cleaning.PROLOG_CLEANER.special
+NUMBERS_RE = cleaning.PROLOG_CLEANER.numbers
+
+
+def _quantity(text):
+    if not text:
+        return None
+    totale = 0.0
+    for parte in text.split():
+        if '/' in parte:
+            num, den = parte.split('/')
+            if not float(den):
+                return None
+            totale += float(num) / float(den)
+        else:
+            totale += float(parte)
+    return totale
+
+
+def parse_item(item):
+    m = ITEM_RE.match(PAREN_RE.sub(' ', item))
+    qty, unit, nome = m.groups()
+    quantita = _quantity(qty)
+    # Unità senza quantità (es. "cup sugar"): fa parte del nome, come "g" in "garlic"
+    if quantita is None and unit:
+        nome = m.group(0)
+        unit = None
+    # Frazioni rimaste nel nome (es. "salt 1/2"): numeri tolti, '/' come separatore
+    nome = NUMBERS_RE.sub('', SPECIAL_RE.sub('', nome)).replace('/', ' ')
+    nome = '_'.join(nome.lower().split())
+    if unit:
+        unit = unit.lower()
+        unit = UNIT_ALIASES.get(unit, unit)
+    return nome, quantita, unit
+
+
+def split_ingredients(raw):
+    raw = (raw or '').strip()
+    if raw.startswith('['):
+        try:
+            return [str(x) for x in ast.literal_eval(raw)]
+        except (ValueError, SyntaxError):
+            raw = raw.strip('[]')
+    return [x.strip().strip('\'"') for x in raw.split(',') if x.strip()]
+
+
+def parse_ingredients(raw):
+    voci = (parse_item(item) for item in split_ingredients(raw))
+    return tuple(v for v in voci if v[0])
+
+
+# --- AGGREGAZIONE ---
+class ShoppingAggregator:
+    def __init__(self, store, maxsize=65536, categories=CATEGORIES, taxonomy=None):
+        self.store = store
+        self.maxsize = maxsize
+        self._parsed = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        taxonomy = KB.TAXONOMY if taxonomy is None else taxonomy
+        # ingrediente (atomo) -> categorie a cui appartiene
+        self._categorie = {}
+        for nome, predicato in categories.items():
+            for ingrediente in taxonomy.get(predicato, []):
+                self._categorie.setdefault(ingrediente, []).append(nome)
+        self.categories = list(categories)
+
+    # Ingredienti analizzati di una riga dell'archivio (cache LRU per id di riga)
+    def parsed(self, row):
+        voce = self._parsed.get(row)
+        if voce is not None:
+            self._parsed.move_to_end(row)
+            self.hits += 1
+            return voce
+        self.misses += 1
+        voce = self._parsed[row] = parse_ingredients(self.store.value(row, 'ingredients_raw'))
+        if len(self._parsed) > self.maxsize:
+            self._parsed.popitem(last=False)
+        return voce
+
+    # Riga dell'archivio per una ricetta del menu: vista Recipe, id di riga,
+    # titolo (ultima riga con quel titolo, come nel CSP) o record con 'recipe_title'
+    def row_of(self, ricetta):
+        if isinstance(ricetta, Recipe):
+            return ricetta.row
+        if isinstance(ricetta, int):
+            return ricetta
+        if isinstance(ricetta, dict):
+            ricetta = ricetta['recipe_title']
+        return self.store.title_rows()[ricetta]
+
+    # menu: giorno -> pasto -> ricetta; restituisce (voci della lista, conteggi per categoria)
+    def aggregate(self, menu):
+        somme = {}
+        conteggi = dict.fromkeys(self.categories, 0)
+        for pasti in menu.values():
+            for ricetta in pasti.values():
+                for nome, quantita, unit in self.parsed(self.row_of(ricetta)):
+                    voce = somme.get((nome, unit))
+                    if voce is None:
+                        voce = somme[(nome, unit)] = [None, 0]
+                    if quantita is not None:
+                        voce[0] = (voce[0] or 0.0) + quantita
+                    voce[1] += 1
+                    for categoria in self._categorie.get(nome, ()):
+                        conteggi[categoria] += 1
+        voci = [{'ingredient': nome, 'unit': unit, 'quantity': None if q is None else round(q, 3),
+                 'occurrences': n, 'categories': self._categorie.get(nome, [])}
+                for (nome, unit), (q, n) in sorted(somme.items(), key=lambda x: (x[0][0], x[0][1] or ''))]
+        return voci, conteggi
+
+    # Record di batch_menu ({'id', 'status', 'menu'}) -> record della lista, uno alla volta
+    def stream(self, records, totals=None):
+        for record in records:
+            if totals is not None:
+                totals['menus'] += 1
+            if record.get('status', 'ok') != 'ok' or not record.get('menu'):
+                if totals is not None:
+                    totals['skipped'] += 1
+                continue
+            try:
+                voci, conteggi = self.aggregate(record['menu'])
+            except KeyError as e:
+                if totals is not None:
+                    totals['skipped'] += 1
+                print(f"[!] Menu {record.get('id')}: ricetta sconosciuta {e}", file=sys.stderr)
+                continue
+            if totals is not None:
+                totals['aggregated'] += 1
+                for categoria, n in conteggi.items():
+                    totals['categories'][categoria] = totals['categories'].get(categoria, 0) + n
+            yield {'id': record.get('id'), 'shopping_list': voci, 'categories': conteggi}
+
+    def stats(self):
+        richieste = self.hits + self.misses
+        return {'size': len(self._parsed), 'maxsize': self.maxsize, 'hits': self.hits,
+                'misses': self.misses, 'hit_rate': self.hits / richieste if richieste else 0.0}
+
+
+# --- OUTPUT ---
+def write_jsonl(risultati, out):
+    for r in risultati:
+        out.write(json.dumps(r) + "\n")
+
+
+# CSV "lungo": una riga per voce della lista (type=item) e per categoria (type=category)
+def write_csv(risultati, out):
+    writer = csv.writer(out)
+    writer.writerow(CSV_FIELDS)
+    for r in risultati:
+        for v in r['shopping_list']:
+            writer.writerow([r['id'], 'item', v['ingredient'], v['unit'] or '',
+                             '' if v['quantity'] is None else v['quantity'], v['occurrences']])
+        for categoria, n in r['categories'].items():
+            writer.writerow([r['id'], 'category', categoria, '', '', n])
+
+
+def format_shopping_list(voci, conteggi):
+    righe = [f"\n{'LISTA DELLA SPESA SETTIMANALE':^60}", "-" * 60]
+    for v in voci:
+        if v['quantity'] is None:
+            quantita = f"x{v['occurrences']}"
+        else:
+            quantita = f"{v['quantity']:g} {v['unit'] or ''}".strip()
+        righe.append(f"  {v['ingredient'].replace('_', ' '):28} {quantita}")
+    righe.append("\n  Ingredienti per categoria: " + ", ".join(f"{c} {n}" for c, n in conteggi.items()))
+    return "\n".join(righe) + "\n"
+
+
+def read_menus(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for riga in f:
+            riga = riga.strip()
+            if riga:
+                yield json.loads(riga)
+
+
+def run(menus_path, output_path, fmt=None, store=None, csv_path="recipes_extended.csv", limit=30000,
+        kb_shm=None):
+    if store is None:
+        if kb_shm:
+            import kb_server
+            store = kb_server.attach(kb_shm).store
+        else:
+            import kb_snapshot
+            dati = kb_snapshot.load_or_build(csv_path, limit, as_store=True)
+            if dati is None:
+                return None
+            store = dati[0]
+    fmt = fmt or ('csv' if output_path.endswith('.csv') else 'jsonl')
+    aggregatore = ShoppingAggregator(store)
+    totals = {'menus': 0, 'aggregated': 0, 'skipped': 0, 'categories': {}}
+    start = time.perf_counter()
+    with open(output_path, 'w', encoding='utf-8', newline='' if fmt == 'csv' else None) as out:
+        risultati = aggregatore.stream(read_menus(menus_path), totals)
+        (write_csv if fmt == 'csv' else write_jsonl)(risultati, out)
+    totals['seconds'] = round(time.perf_counter() - start, 3)
+    totals['recipe_cache'] = aggregatore.stats()
+    print(f"Liste della spesa: {totals['aggregated']} menu in {totals['seconds']}s "
+          f"({totals['skipped']} saltati) -> {output_path}")
+    print(f"Ingredienti per categoria (totale): {totals['categories']}")
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Liste della spesa e categorie nutrizionali dei menu generati")
+    parser.add_argument('menus', help="file JSONL dei menu (output di batch_menu)")
+    parser.add_argument('-o', '--output', default="lista_spesa.jsonl", help="file di output (.jsonl o .csv)")
+    parser.add_argument('--format', choices=['jsonl', 'csv'], default=None,
+                        help="default: dall'estensione del file di output")
+    parser.add_argument('--csv', default="recipes_extended.csv")
+    parser.add_argument('--limit', type=int, default=30000)
+    parser.add_argument('--kb-shm', default=None, help="nome della KB condivisa di kb_server")
+    parser.add_argument('--report', default=None, help="salva il riepilogo anche in JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        totals = run(args.menus, args.output, args.format, csv_path=args.csv, limit=args.limit, kb_shm=args.kb_shm)
+    except FileNotFoundError as e:
+        print(f"[ERRORE] {e}")
+        return 1
+    if totals is None:
+        return 1
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(totals, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,221 @@
+import json
+import os
+import re
+import sys
+import numpy as np
+
+# --- MODELLO DEI GUSTI COMPATTO ---
+# Esporta la RandomForest e il CountVectorizer di learning_fase in una cartella
+# di array NumPy (.npy, caricati con mmap_mode='r') più un manifest JSON con
+# vocabolario e classi. Il predittore non importa scikit-learn: attraversa gli
+# alberi in modo vettoriale su tutte le righe insieme e somma le foglie albero
+# per albero nello stesso ordine di RandomForestClassifier.predict_proba, così
+# le probabilità sono identiche bit a bit a quelle del modello originale.
+# Le foglie puntano a se stesse con soglia +inf: dopo max_depth passi ogni riga
+# si trova nella sua foglia, senza distinguere nodi interni e foglie a ogni passo.
+
+ARTIFACT_VERSION = 1
+ARTIFACT_DIR = "modello_gusti"
+MANIFEST = "manifest.json"
+ARRAYS = ['feature', 'threshold', 'left', 'right', 'value', 'roots']
+
+
+def _file_state(path):
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+# --- ESPORTAZIONE (richiede gli oggetti scikit-learn già caricati) ---
+def export_compact_model(model, vectorizer, directory=ARTIFACT_DIR, source=None):
+    import sklearn
+    if getattr(model, 'n_outputs_', 1) != 1:
+        raise ValueError("Modello multi-output non supportato")
+    if (vectorizer.analyzer != 'word' or tuple(vectorizer.ngram_range) != (1, 1)
+            or vectorizer.tokenizer is not None or vectorizer.preprocessor is not None
+            or vectorizer.strip_accents is not None):
+        raise ValueError("Configurazione del vettorizzatore non supportata dal predittore compatto")
+
+    n_classes = len(model.classes_)
+    # Prima della 1.4 tree_.value conteneva i conteggi e predict_proba li normalizzava
+    normalizza = tuple(int(x) for x in sklearn.__version__.split('.')[:2]) < (1, 4)
+    feature, threshold, left, right, value, roots = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for est in model.estimators_:
+        tree = est.tree_
+        roots.append(offset)
+        max_depth = max(max_depth, int(tree.max_depth))
+        # Figli con indice globale; le foglie puntano a se stesse
+        foglia = tree.children_left < 0
+        propri = np.arange(offset, offset + tree.node_count, dtype=np.int64)
+        left.append(np.where(foglia, propri, tree.children_left + offset).astype(np.int32))
+        right.append(np.where(foglia, propri, tree.children_right + offset).astype(np.int32))
+        feature.append(np.where(foglia, 0, tree.feature).astype(np.int32))
+        threshold.append(np.where(foglia, np.inf, tree.threshold).astype(np.float64))
+        v = np.array(tree.value[:, 0, :n_classes], dtype=np.float64)
+        if normalizza:
+            norm = v.sum(axis=1)[:, np.newaxis]
+            norm[norm == 0.0] = 1.0
+            v /= norm
+        value.append(v)
+        offset += tree.node_count
+
+    os.makedirs(directory, exist_ok=True)
+    arrays = {'feature': np.concatenate(feature), 'threshold': np.concatenate(threshold),
+              'left': np.concatenate(left), 'right': np.concatenate(right),
+              'value': np.concatenate(value), 'roots': np.array(roots, dtype=np.int64)}
+    for name, arr in arrays.items():
+        np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(arr))
+
+    vocabolario = [None] * len(vectorizer.vocabulary_)
+    for termine, i in vectorizer.vocabulary_.items():
+        vocabolario[i] = termine
+    manifest = {
+        'version': ARTIFACT_VERSION,
+        'classes': [str(c) for c in model.classes_],
+        'n_trees': len(model.estimators_),
+        'n_nodes': int(offset),
+        'max_depth': max_depth,
+        'vocabulary': vocabolario,
+        'token_pattern': vectorizer.token_pattern,
+        'lowercase': bool(vectorizer.lowercase),
+        'binary': bool(vectorizer.binary),
+        'source': {'path': os.path.abspath(source), **_file_state(source)} if source else None,
+    }
+    # Il manifest si scrive per ultimo: un'esportazione interrotta resta invalida
+    tmp = os.path.join(directory, MANIFEST + ".tmp")
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(directory, MANIFEST))
+    print(f"Modello compatto salvato in {directory}/")
+    return directory
+
+
+# --- PREDITTORE ---
+class CompactVectorizer:
+    def __init__(self, vocabulary, token_pattern, lowercase=True, binary=True):
+        self.vocabulary_ = {t: i for i, t in enumerate(vocabulary)}
+        self.token_re = re.compile(token_pattern)
+        self.lowercase = lowercase
+        self.binary = binary
+
+    # Matrice densa (righe x termini): 0/1 in uint8 se binary, conteggi float32 altrimenti
+    def transform(self, texts):
+        vocab = self.vocabulary_
+        X = np.zeros((len(texts), len(vocab)), dtype=np.uint8 if self.binary else np.float32)
+        for r, text in enumerate(texts):
+            if self.lowercase:
+                text = text.lower()
+            ids = [vocab[t] for t in self.token_re.findall(text) if t in vocab]
+            if self.binary:
+                X[r, ids] = 1
+            else:
+                np.add.at(X[r], ids, 1)
+        return X
+
+
+class CompactForest:
+    def __init__(self, classes, arrays, max_depth, block_size=4096):
+        self.classes_ = np.array(classes, dtype=object)
+        self.max_depth = max_depth
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.left = arrays['left']
+        self.right = arrays['right']
+        self.value = arrays['value']
+        self.roots = arrays['roots']
+        self.block_size = block_size
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    # Foglia raggiunta da ogni riga in ogni albero (matrice alberi x righe):
+    # tutte le coppie (albero, riga) scendono di un livello per passo e ogni
+    # pochi passi si tolgono quelle già arrivate in foglia
+    def _leaves(self, X, compact_every=4):
+        n, n_features = X.shape
+        flat = X.reshape(-1)
+        node = np.repeat(self.roots[:, np.newaxis], n, axis=1).reshape(-1)
+        posizioni = np.arange(node.size)
+        corrente = node
+        offset_riga = np.tile(np.arange(n, dtype=np.int64) * n_features, self.n_trees)
+        for passo in range(self.max_depth):
+            a_sinistra = flat[offset_riga + self.feature[corrente]] <= self.threshold[corrente]
+            corrente = np.where(a_sinistra, self.left[corrente], self.right[corrente])
+            if passo % compact_every == compact_every - 1:
+                node[posizioni] = corrente
+                interni = self.left[corrente] != corrente
+                posizioni, corrente, offset_riga = posizioni[interni], corrente[interni], offset_riga[interni]
+                if not len(posizioni):
+                    break
+        node[posizioni] = corrente
+        return node.reshape(self.n_trees, n)
+
+    def predict_proba(self, X):
+        X = np.ascontiguousarray(X)
+        proba = np.zeros((X.shape[0], len(self.classes_)), dtype=np.float64)
+        for start in range(0, X.shape[0], self.block_size):
+            out = proba[start:start + self.block_size]
+            foglie = self._leaves(X[start:start + self.block_size])
+            # Stesso ordine di somma di RandomForestClassifier (albero per albero)
+            for t in range(self.n_trees):
+                out += self.value[foglie[t]]
+        proba /= self.n_trees
+        return proba
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def _read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+# Artefatto utilizzabile: versione giusta e, se esportato da un pickle, pickle invariato
+def is_valid(manifest, source=None):
+    if manifest is None or manifest.get('version') != ARTIFACT_VERSION:
+        return False
+    if source is None or not os.path.exists(source):
+        return True
+    origine = manifest.get('source')
+    return origine is not None and all(origine.get(k) == v for k, v in _file_state(source).items())
+
+
+def load_compact_model(directory=ARTIFACT_DIR, source=None, mmap_mode='r'):
+    manifest = _read_manifest(directory)
+    if not is_valid(manifest, source):
+        return None
+    arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode) for name in ARRAYS}
+    model = CompactForest(manifest['classes'], arrays, manifest['max_depth'])
+    vectorizer = CompactVectorizer(manifest['vocabulary'], manifest['token_pattern'],
+                                   manifest['lowercase'], manifest['binary'])
+    return model, vectorizer
+
+
+# Modello compatto se aggiornato, altrimenti pickle joblib (e si esporta il compatto per il prossimo avvio)
+def load_taste_model(pkl_path='modello_gusti_ricette.pkl', directory=ARTIFACT_DIR):
+    compatto = load_compact_model(directory, source=pkl_path)
+    if compatto is not None:
+        return compatto
+    import joblib
+    data = joblib.load(pkl_path)
+    model, vectorizer = data['model'], data['vectorizer']
+    try:
+        export_compact_model(model, vectorizer, directory, source=pkl_path)
+    except (ValueError, OSError) as e:
+        print(f"[!] Esportazione del modello compatto non riuscita: {e}")
+    return model, vectorizer
+
+
+if __name__ == "__main__":
+    # Conversione di un pickle esistente: python taste_predictor.py [modello.pkl] [cartella]
+    import joblib
+    pkl = sys.argv[1] if len(sys.argv) > 1 else 'modello_gusti_ricette.pkl'
+    data = joblib.load(pkl)
+    export_compact_model(data['model'], data['vectorizer'],
+                         sys.argv[2] if len(sys.argv) > 2 else ARTIFACT_DIR, source=pkl)
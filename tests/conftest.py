@@ -0,0 +1,7 @@
+import os
+import sys
+
+# I moduli del progetto stanno nella radice del repository (nessun pacchetto)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
@@ -0,0 +1,16 @@
+import pytest
+
+pytest.importorskip('numpy')
+import batch_menu
+
+
+@pytest.mark.parametrize('errore', [AttributeError, IndexError, ZeroDivisionError, KeyError])
+def test_profile_exception_is_an_error_result(monkeypatch, errore):
+    def rotto(*args, **kwargs):
+        raise errore("boom")
+    monkeypatch.setattr(batch_menu.CSP, 'solve_menu_csp', rotto)
+    monkeypatch.setattr(batch_menu, '_DATI', (None, None))
+    monkeypatch.setattr(batch_menu, '_OPZIONI', {'seed': 0, 'timeout': 1.0, 'best_effort': False})
+    risultato = batch_menu._solve_one((0, {'id': 'u1', 'user_data': {}}))
+    assert risultato['status'] == 'error'
+    assert risultato['error'].startswith(errore.__name__)
@@ -0,0 +1,44 @@
+import os
+import subprocess
+import sys
+import pytest
+from conftest import ROOT
+
+pytest.importorskip('numpy')
+pytest.importorskip('pandas')
+pytest.importorskip('pytholog')
+
+
+def _python(cwd, *args):
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.run([sys.executable, *args], cwd=cwd, env=env, capture_output=True, text=True, timeout=300)
+
+
+# "python KB.py" definisce FactTables in __main__: il pickle deve comunque
+# essere leggibile da un altro processo che importa KB (come Main)
+def test_pickle_from_kb_main_loads_from_main(tmp_path):
+    import benchmark
+    benchmark.generate_recipes_csv(str(tmp_path / "recipes_extended.csv"), 300)
+
+    scritto = _python(tmp_path, os.path.join(ROOT, "KB.py"))
+    assert scritto.returncode == 0, scritto.stderr
+    assert (tmp_path / "kb_data.pkl").exists()
+
+    letto = _python(tmp_path, "-c", (
+        "import Main, KB\n"
+        "facts = KB.load_fact_tables('kb_data.pkl')\n"
+        "assert facts is not None and facts.n_rows == 300, facts\n"
+        "kb = KB.load_kb_from_pickle('kb_data.pkl', engine='datalog')\n"
+        "assert kb is not None\n"))
+    assert letto.returncode == 0, letto.stderr
+
+
+def test_state_round_trip(tmp_path):
+    import numpy as np
+    import benchmark
+    import KB
+    csv_path = benchmark.generate_recipes_csv(str(tmp_path / "recipes.csv"), 200)
+    facts = KB.build_fact_tables(KB.build_dataframe(200, path=csv_path))
+    copia = KB.FactTables.from_state(facts.to_state())
+    assert list(copia.iter_facts()) == list(facts.iter_facts())
+    assert np.array_equal(copia.contains_ings, facts.contains_ings)
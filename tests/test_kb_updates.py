@@ -0,0 +1,68 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('pandas')
+pytest.importorskip('pytholog')
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    import benchmark
+    import KB
+    import kb_snapshot
+    csv_path = benchmark.generate_recipes_csv(str(tmp_path / "recipes.csv"), 300)
+    extra = benchmark.generate_recipes_csv(str(tmp_path / "extra.csv"), 20, seed=7)
+    directory = str(tmp_path / "snapshot")
+    kb_snapshot.load_or_build(csv_path, 300, directory, as_store=True)
+    return csv_path, directory, KB.build_dataframe(20, path=extra)
+
+
+def _masks(store, index):
+    ids = index.ids_of(store.row_titles().tolist())
+    return {p: np.asarray(index.mask(p))[ids] for p in index.predicates}
+
+
+# Lo snapshot aggiornato dal registro coincide con uno ricostruito dalle stesse righe
+def _assert_same_as_rebuild(store, index):
+    import kb_index
+    from recipe_store import RecipeStore
+    atteso = RecipeStore.from_dataframe(store.to_dataframe())
+    indice = kb_index.build_predicate_index(atteso)
+    assert store.row_titles().tolist() == atteso.row_titles().tolist()
+    assert store.column('ingredients').tolist() == atteso.column('ingredients').tolist()
+    assert store.column('ingredients_raw').tolist() == atteso.column('ingredients_raw').tolist()
+    ottenute, attese = _masks(store, index), _masks(atteso, indice)
+    assert sorted(ottenute) == sorted(attese)
+    for p in attese:
+        assert np.array_equal(ottenute[p], attese[p]), p
+
+
+def test_add_and_retract_are_applied_on_load(snapshot):
+    import kb_snapshot
+    csv_path, directory, extra = snapshot
+    store, _ = kb_snapshot.load_snapshot(csv_path, 300, directory, as_store=True)
+    ritirati = store.titles[:3].tolist()
+
+    kb_snapshot.add_recipes(extra, directory)
+    kb_snapshot.retract_recipes(ritirati, directory)
+    aggiornato, index = kb_snapshot.load_snapshot(csv_path, 300, directory, as_store=True)
+
+    assert len(aggiornato) == len(store) + len(extra) - int(store.rows_of(ritirati).sum())
+    assert not aggiornato.rows_of(ritirati).any()
+    assert aggiornato.rows_of(extra['recipe_title'].tolist()).sum() >= len(extra)
+    _assert_same_as_rebuild(aggiornato, index)
+
+
+def test_compact_and_rebuild_keep_updates(snapshot):
+    import kb_snapshot
+    csv_path, directory, extra = snapshot
+    kb_snapshot.add_recipes(extra, directory)
+    atteso, _ = kb_snapshot.load_snapshot(csv_path, 300, directory, as_store=True)
+
+    kb_snapshot.compact(csv_path, 300, directory)
+    compattato, index = kb_snapshot.load_snapshot(csv_path, 300, directory, as_store=True)
+    assert compattato.row_titles().tolist() == atteso.row_titles().tolist()
+    _assert_same_as_rebuild(compattato, index)
+
+    ricostruito, _ = kb_snapshot.load_or_build(csv_path, 300, directory, as_store=True, rebuild=True)
+    assert ricostruito.row_titles().tolist() == atteso.row_titles().tolist()
@@ -0,0 +1,51 @@
+import asyncio
+import pytest
+
+pytest.importorskip('numpy')
+import menu_service
+
+
+def _genera(request, **kwargs):
+    async def run():
+        async with menu_service.MenuService(data=(None, None), workers=1, executor='thread', **kwargs) as s:
+            return await s.generate(request), dict(s.stats)
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize('errore', [AttributeError, IndexError, RuntimeError, KeyError])
+def test_worker_exception_is_an_error_result(monkeypatch, errore):
+    def rotto(*args):
+        raise errore("boom")
+    monkeypatch.setattr(menu_service, '_solve', rotto)
+    esito, stats = _genera({'id': 7, 'user_data': {}})
+    assert esito['status'] == 'error'
+    assert esito['error'].startswith(errore.__name__)
+    assert esito['menu'] is None
+    assert stats['error'] == 1 and stats['cancelled'] == 0
+
+
+def test_generate_without_done_event(monkeypatch):
+    async def solo_accettata(self, request):
+        yield {'type': 'accepted', 'id': request.get('id')}
+    monkeypatch.setattr(menu_service.MenuService, 'stream', solo_accettata)
+    esito, _ = _genera({'id': 3})
+    assert esito == {'type': 'done', 'id': 3, 'status': 'cancelled', 'menu': None}
+
+
+# Dominio vuoto: esito no_menu senza stampe dal worker
+def test_solve_empty_domain_is_quiet(monkeypatch, capsys, tmp_path):
+    pytest.importorskip('pandas')
+    pytest.importorskip('pytholog')
+    import benchmark
+    import KB
+    import kb_index
+    from recipe_store import RecipeStore
+    df = KB.build_dataframe(100, path=benchmark.generate_recipes_csv(str(tmp_path / "recipes.csv"), 100))
+    df['is_dairy_free'] = 'no'
+    store = RecipeStore.from_dataframe(df)
+    monkeypatch.setattr(menu_service, '_DATI', (store, kb_index.build_predicate_index(store)))
+    profilo = {'preferred_taste': 'savory',
+               'user_data': {'intolleranze': {'lattosio': True, 'noci': False, 'glutine': False}}}
+    righe, esito, _ = menu_service._solve(profilo, 1.0, 0)
+    assert righe is None and esito == 'no_menu'
+    assert capsys.readouterr().out == ''
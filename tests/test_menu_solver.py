@@ -0,0 +1,56 @@
+import menu_solver
+
+GIORNI = range(7)
+VARIABILI = [f"{g}_{p}" for g in GIORNI for p in ('Colazione', 'Pranzo', 'Cena')]
+PRINCIPALI = [v for v in VARIABILI if not v.endswith('Colazione')]
+GRUPPI = [[v for v in VARIABILI if v.endswith(p)] for p in ('Pranzo', 'Cena')]
+COPPIE = [(f"{g}_Pranzo", f"{g}_Cena") for g in GIORNI]
+PRANZO_CENA = [f"r{i}" for i in range(300)]
+COLAZIONE = [f"b{i}" for i in range(100)]
+# Requisito soddisfatto solo da r0..r9, che hanno tutti l'ingrediente limitato
+REQUISITI = [('med', frozenset(f"r{i}" for i in range(10)), PRINCIPALI)]
+LIMITATI = frozenset(f"r{i}" for i in range(300) if i < 10 or i % 3 == 0)
+
+
+def _solver(limits, colazione=COLAZIONE):
+    domini = {v: colazione if v.endswith('Colazione') else PRANZO_CENA for v in VARIABILI}
+    return menu_solver.MenuSolver(VARIABILI, domini, GRUPPI, COPPIE, frozenset(), REQUISITI, limits)
+
+
+def _rispetta(assignment, limits):
+    return all(sum(assignment[v] in valori for v in scope) <= massimo for _, valori, scope, massimo in limits)
+
+
+# Limite saturo: i suoi valori escono dai conteggi, il requisito fallisce alla radice
+def test_saturated_limit_fails_at_root():
+    assignment, stats = _solver([('cap.salt', LIMITATI, VARIABILI, 0)]).solve(timeout=2.0)
+    assert assignment is None
+    assert stats.status == menu_solver.UNSAT
+    assert stats.nodes == 0
+
+
+# Variabili con soli valori limitati: più variabili che posti rimasti
+def test_forced_variables_exceed_limit():
+    limits = [('cap.milk', frozenset(COLAZIONE[:50]), VARIABILI, 6)]
+    assignment, stats = _solver(limits, COLAZIONE[:50]).solve(timeout=2.0)
+    assert stats.status == menu_solver.UNSAT
+    assert stats.nodes == 0
+
+
+def test_tight_limits_still_solve():
+    limits = [('cap.milk', frozenset(COLAZIONE[:50]), VARIABILI, 7), ('cap.salt', LIMITATI, VARIABILI, 1)]
+    assignment, stats = _solver(limits, COLAZIONE[:50]).solve(timeout=2.0)
+    assert stats.status == menu_solver.OK
+    assert _rispetta(assignment, limits)
+    assert any(assignment[v] in REQUISITI[0][1] for v in PRINCIPALI)
+
+
+def test_topk_respects_limits():
+    limits = [('cap.salt', LIMITATI, VARIABILI, 2)]
+    domini = {v: COLAZIONE if v.endswith('Colazione') else PRANZO_CENA for v in VARIABILI}
+    unary = {v: 1.0 for v in LIMITATI}
+    ottimizzatore = menu_solver.MenuOptimizer(VARIABILI, domini, unary, groups=GRUPPI, pairs=COPPIE,
+                                              requirements=REQUISITI, limits=limits)
+    risultati, stats = ottimizzatore.top_k(k=3, timeout=5.0)
+    assert risultati
+    assert all(_rispetta(a, limits) for _, a in risultati)
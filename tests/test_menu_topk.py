@@ -0,0 +1,60 @@
+import itertools
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('pandas')
+pytest.importorskip('pytholog')
+
+
+@pytest.fixture(scope='module')
+def kb(tmp_path_factory):
+    import benchmark
+    import kb_snapshot
+    tmp = tmp_path_factory.mktemp("topk")
+    csv_path = benchmark.generate_recipes_csv(str(tmp / "recipes.csv"), 3000)
+    return kb_snapshot.load_or_build(csv_path, 3000, str(tmp / "snapshot"), as_store=True)
+
+
+def _slots(menu):
+    import CSP
+    return [menu[g][pt]['recipe_title'] for g in CSP.GIORNI for pt in CSP.PASTI_TIPO]
+
+
+# Le versioni servite da Main con "un'altra versione" devono cambiare almeno min_diff pasti
+@pytest.mark.parametrize('profilo', range(0, 48, 7))
+def test_topk_menus_differ_pairwise(kb, profilo):
+    import benchmark
+    import CSP
+    store, index = kb
+    p = benchmark.profile_matrix()[profilo]
+    menu = CSP.solve_menu_topk(None, p['user_data'], p['preferred_taste'], store, index=index, k=5, min_diff=7)
+    assert len(menu) == 5
+    punteggi = [s for s, _ in menu]
+    assert punteggi == sorted(punteggi, reverse=True)
+    for (_, a), (_, b) in itertools.combinations(menu, 2):
+        assert sum(x != y for x, y in zip(_slots(a), _slots(b))) >= 7
+
+
+# Titolo duplicato: una riga dolce (ammessa a colazione) e l'ultima, quella mostrata
+# e usata per il punteggio, salata. Non deve finire a colazione con il bonus del gusto.
+def test_duplicate_title_breakfast_uses_displayed_row(tmp_path):
+    import benchmark
+    import pandas as pd
+    import CSP
+    import KB
+    import kb_index
+    from recipe_store import RecipeStore
+    csv_path = benchmark.generate_recipes_csv(str(tmp_path / "recipes.csv"), 2000)
+    df = KB.build_dataframe(2000, path=csv_path)
+    copie = df[df['primary_taste'] == 'savory'].copy()
+    copie['primary_taste'] = 'sweet'
+    store = RecipeStore.from_dataframe(pd.concat([copie, df], ignore_index=True))
+    index = kb_index.build_predicate_index(store)
+
+    p = benchmark.profile_matrix()[0]
+    assert p['preferred_taste'] == 'savory'
+    menu = CSP.solve_menu_topk(None, p['user_data'], 'savory', store, index=index, k=5, cache=None)
+    assert menu
+    for _, m in menu:
+        for g in CSP.GIORNI:
+            assert m[g]['Colazione']['primary_taste'] in ('sweet', 'neutral')
@@ -0,0 +1,40 @@
+import gc
+import weakref
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('pandas')
+pytest.importorskip('pytholog')
+
+
+@pytest.fixture
+def df(tmp_path):
+    import benchmark
+    import KB
+    return KB.build_dataframe(200, path=benchmark.generate_recipes_csv(str(tmp_path / "recipes.csv"), 200))
+
+
+# as_store non tiene in vita il dataframe convertito
+def test_as_store_keeps_no_reference(tmp_path):
+    import benchmark
+    import KB
+    import recipe_store
+    df = KB.build_dataframe(200, path=benchmark.generate_recipes_csv(str(tmp_path / "recipes.csv"), 200))
+    store = recipe_store.as_store(df)
+    assert len(store) == len(df)
+    ref = weakref.ref(df)
+    del df
+    gc.collect()
+    assert ref() is None
+
+
+# Profili diversi sullo stesso dataframe riusano l'archivio della DomainCache
+def test_domain_cache_reuses_store(df):
+    import CSP
+    import kb_index
+    index = kb_index.build_predicate_index(df)
+    cache = CSP.DomainCache()
+    profili = [{'intolleranze': {'lattosio': lattosio, 'noci': False, 'glutine': False}} for lattosio in (False, True)]
+    modelli = [CSP.build_menu_model(p, 'savory', df, index, cache, seed=0, quiet=True) for p in profili]
+    assert len(cache) == 2
+    assert modelli[0].domini_profilo.store is modelli[1].domini_profilo.store
@@ -0,0 +1,31 @@
+import pytest
+import KB
+import shopping_list
+
+
+@pytest.mark.parametrize('item, atteso', [
+    ('1 1/2 cups flour', ('flour', 1.5, 'cup')),
+    ('2 (8 ounce) packages cream cheese', ('cream_cheese', 2.0, 'package')),
+    ('1 (15 ounce) can black beans', ('black_beans', 1.0, 'can')),
+    ('1/2 cup sugar', ('sugar', 0.5, 'cup')),
+    ('2.5 lb beef', ('beef', 2.5, 'lb')),
+    ('3 ounces tuna', ('tuna', 3.0, 'oz')),
+    ('3 egg', ('egg', 3.0, None)),
+    ('garlic', ('garlic', None, None)),
+    ('cup sugar', ('cup_sugar', None, None)),
+])
+def test_parse_item(item, atteso):
+    assert shopping_list.parse_item(item) == atteso
+
+
+@pytest.mark.parametrize('item', ['salt/pepper to taste', 'flour 1/2', '1 1/2 (1/4 ounce) packages yeast'])
+def test_no_slash_in_names(item):
+    assert '/' not in shopping_list.parse_item(item)[0]
+
+
+# Le voci con numeri misti finiscono nella categoria giusta della tassonomia
+def test_mixed_numbers_reach_taxonomy():
+    voci = shopping_list.parse_ingredients("['1 1/2 cups flour', '2 1/4 cups rice', '1 (8 ounce) package cheese']")
+    assert voci == (('flour', 1.5, 'cup'), ('rice', 2.25, 'cup'), ('cheese', 1.0, 'package'))
+    tassonomia = {i for items in KB.TAXONOMY.values() for i in items}
+    assert all(nome in tassonomia for nome, _, _ in voci)